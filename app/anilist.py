@@ -1,7 +1,7 @@
-import requests
-import time # rate limits
 import re
 import html
+
+from app.rate_limit import limited_post
 # import os
 # from dotenv import load_dotenv
 # anilist api uses oauth, don't need token for public data
@@ -19,6 +19,7 @@ query ($page: Int, $perPage: Int) {
         english
       }
       episodes
+      status
       averageScore
       trending
       genres
@@ -49,19 +50,44 @@ query ($id: Int) {
   }
 }
 """
-# get anime info from api
-def fetch_anime(pages):
-    all_anime = []
+# episodes of many anime in one request, paged over the anime
+EPISODES_BATCH_QUERY = """
+query ($ids: [Int], $page: Int, $perPage: Int) {
+  Page(page: $page, perPage: $perPage) {
+    pageInfo {
+      hasNextPage
+    }
+    media(id_in: $ids, type: ANIME) {
+      id
+      duration
+      streamingEpisodes {
+        title
+        thumbnail
+      }
+    }
+  }
+}
+"""
+# anime per batched episode request (AniList's perPage limit)
+EPISODE_BATCH_SIZE = 50
+
+# get anime info from api, one page at a time
+def iter_anime(pages):
     for page in range(1, pages + 1):
-        response = requests.post(
+        response = limited_post(
             ANILIST_URL,
             json={"query": MAIN_QUERY, "variables": {"page": page, "perPage": 15}},
             headers={"Content-Type": "application/json"}
         )
         response.raise_for_status()
         data = response.json()
+        yield data["data"]["Page"]["media"]
+
+def fetch_anime(pages):
+    all_anime = []
+    for page_anime in iter_anime(pages):
         # add to all_anime list
-        all_anime.extend(data["data"]["Page"]["media"])
+        all_anime.extend(page_anime)
     return all_anime
 
 # if there are missing parts of date
@@ -120,7 +146,7 @@ def parse_anime(anime_raw):
 
 # get episode info from anime from api
 def fetch_episodes(anilist_id):
-    response = requests.post(
+    response = limited_post(
         ANILIST_URL,
         json={
             "query": EPISODE_QUERY,
@@ -140,6 +166,30 @@ def fetch_episodes(anilist_id):
         "duration": media.get("duration")
     }
 
+# episode info for many anime, {anilist_id: same shape as fetch_episodes}
+def fetch_episodes_batch(anilist_ids):
+    results = {anilist_id: {"streamingEpisodes": [], "duration": None} for anilist_id in anilist_ids}
+    page = 1
+    while True:
+        response = limited_post(
+            ANILIST_URL,
+            json={
+                "query": EPISODES_BATCH_QUERY,
+                "variables": {"ids": list(anilist_ids), "page": page, "perPage": EPISODE_BATCH_SIZE}
+            },
+            headers={"Content-Type": "application/json"}
+        )
+        response.raise_for_status()
+        data = response.json()["data"]["Page"]
+        for media in data["media"]:
+            results[media["id"]] = {
+                "streamingEpisodes": media.get("streamingEpisodes") or [],
+                "duration": media.get("duration")
+            }
+        if not data["pageInfo"]["hasNextPage"]:
+            return results
+        page += 1
+
 # try to get episode num
 def extract_ep_num(episode_title):
     if episode_title:
@@ -179,20 +229,30 @@ def parse_episodes(anilist_id, episodes_data):
         })
     return parsed
 
-# Take episode data, store in csvs
-def generate_episodes(anime_data):
-    all_episodes = []
-    for anime in anime_data:
+# Take episode data, store in csvs. Episodes for up to EPISODE_BATCH_SIZE
+# anime come back from one request.
+# Yields (batch, {anilist_id: episodes}) for each batched request, with None
+# in place of the episodes when the request failed
+def iter_episode_batches(anime_data):
+    for start in range(0, len(anime_data), EPISODE_BATCH_SIZE):
+        batch = anime_data[start:start + EPISODE_BATCH_SIZE]
         try:
-            #debug
-            # print(f"Fetching episodes for: {anime['title_romaji']}")
-            episodes_raw = fetch_episodes(anime["anilist_id"])
-            parsed_eps = parse_episodes(anime["anilist_id"], episodes_raw)
-            all_episodes.extend(parsed_eps)
-            # delay bc of rate limiting
-            time.sleep(1.8)
+            episodes_raw = fetch_episodes_batch([anime["anilist_id"] for anime in batch])
         except Exception as e:
-            print(f"failed to fetch episodes for {anime.get('title_english')}: {e}")
+            titles = ", ".join(str(anime.get("title_english")) for anime in batch)
+            print(f"failed to fetch episodes for {titles}: {e}")
+            yield batch, None
+            continue
+        yield batch, {
+            anime["anilist_id"]: parse_episodes(anime["anilist_id"], episodes_raw[anime["anilist_id"]])
+            for anime in batch
+        }
+
+def generate_episodes(anime_data):
+    all_episodes = []
+    for _, episodes in iter_episode_batches(anime_data):
+        for anime_episodes in (episodes or {}).values():
+            all_episodes.extend(anime_episodes)
 
     return all_episodes
 
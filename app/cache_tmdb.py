@@ -1,17 +1,34 @@
 import os
 import sqlite3
-import requests
 from dotenv import load_dotenv
 
+from app.rate_limit import limited_get
+
 load_dotenv()
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
 BASE_URL = "https://api.themoviedb.org/3"
 IMG_BASE_URL = "https://image.tmdb.org/t/p/w500"
+# These lookups run inside a page request: a 429 is not retried, and the
+# limiter is waited on for at most this many seconds
+TMDB_MAX_WAIT = 2
+
+
+# TMDb is rate limiting us, the page should ask the visitor to retry later
+class TMDbUnavailable(Exception):
+    pass
+
+
+def _page_get(url):
+    response = limited_get(url, retries=0, max_wait=TMDB_MAX_WAIT,
+                           params={"api_key": TMDB_API_KEY})
+    if response is None or response.status_code == 429:
+        raise TMDbUnavailable(url)
+    return response
 
 
 def fetch_and_cache_movie(tmdb_id, conn):
     url = f"{BASE_URL}/movie/{tmdb_id}"
-    response = requests.get(url, params={"api_key": TMDB_API_KEY})
+    response = _page_get(url)
     response.raise_for_status()
     data = response.json()
     
@@ -44,7 +61,7 @@ def fetch_and_cache_show(tmdb_id, conn):
     
     # Fetch show data
     tv_url = f"{BASE_URL}/tv/{tmdb_id}"
-    tv_response = requests.get(tv_url, params={"api_key": TMDB_API_KEY})
+    tv_response = _page_get(tv_url)
     tv_response.raise_for_status()
     tv_data = tv_response.json()
     
@@ -99,7 +116,8 @@ def fetch_and_cache_show(tmdb_id, conn):
         
         # Fetch and insert episodes for this season
         episode_url = f"{BASE_URL}/tv/{tmdb_id}/season/{season_number}"
-        episode_response = requests.get(episode_url, params={"api_key": TMDB_API_KEY})
+        # raising before the commit keeps a half fetched show out of media.db
+        episode_response = _page_get(episode_url)
         if episode_response.ok:
             episodes = episode_response.json().get("episodes", [])
             for ep in episodes:
@@ -0,0 +1,223 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from app.comments import serialize_comment
+from app.models import db, Comment, SpoolCheckpoint, User
+
+SPOOL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_comment (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    episode_id INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    content TEXT NOT NULL,
+    gif_url TEXT,
+    media_title TEXT NOT NULL,
+    created_at TEXT NOT NULL
+)
+"""
+SPOOL_COLUMNS = "id, user_id, episode_id, timestamp, content, gif_url, media_title, created_at"
+
+
+# A comment accepted into the spool but not yet in the comment table.
+# Carries the same attributes the templates and serialize_comment read.
+class PendingComment:
+    pending = True
+
+    def __init__(self, spool_id, user_id, episode_id, timestamp, content, gif_url,
+                 media_title, created_at, user=None):
+        self.spool_id = spool_id
+        self.id = f"pending-{spool_id}"
+        self.user_id = user_id
+        self.episode_id = episode_id
+        self.timestamp = timestamp
+        self.content = content
+        self.gif_url = gif_url
+        self.media_title = media_title
+        self.created_at = datetime.fromisoformat(created_at)
+        self.user = user
+
+
+# Write-behind ingestion for comment bursts. Posting appends one row to a
+# separate WAL-mode SQLite file; a background thread copies the spool into
+# the comment table in batched transactions. Copies are idempotent: the last
+# copied spool id is committed with the comments (SpoolCheckpoint), and only
+# one process flushes at a time because flushing holds the spool write lock.
+class CommentSpool:
+    def __init__(self, app=None, flush_interval=0.25, batch_size=1000):
+        self.app = None
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.on_added = None
+        self.after_commit = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+        if app is not None:
+            self.init_app(app)
+
+    # on_added(comment) runs inside the flush transaction for each comment,
+    # after_commit(flushed) once it has committed with
+    # [(spool_id, episode_id, serialized comment)]
+    def init_app(self, app, on_added=None, after_commit=None):
+        self.app = app
+        self.on_added = on_added
+        self.after_commit = after_commit
+        app.config.setdefault("COMMENT_SPOOL_ENABLED", False)
+        app.config.setdefault(
+            "COMMENT_SPOOL_PATH", os.path.join(app.instance_path, "comment_spool.db"))
+        app.config.setdefault("COMMENT_SPOOL_INTERVAL", self.flush_interval)
+        app.config.setdefault("COMMENT_SPOOL_BATCH", self.batch_size)
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.app.config["COMMENT_SPOOL_ENABLED"]
+
+    # One connection per thread and spool file
+    def _connect(self):
+        path = self.app.config["COMMENT_SPOOL_PATH"]
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.path == path:
+            return conn
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(SPOOL_SCHEMA)
+        # a recreated spool file must not hand out ids that were already copied
+        conn.execute(
+            "INSERT OR REPLACE INTO sqlite_sequence (rowid, name, seq) "
+            "SELECT (SELECT rowid FROM sqlite_sequence WHERE name = 'pending_comment'), "
+            "'pending_comment', MAX(?, COALESCE((SELECT seq FROM sqlite_sequence "
+            "WHERE name = 'pending_comment'), 0))",
+            (self._checkpoint(),))
+        self._local.conn = conn
+        self._local.path = path
+        return conn
+
+    # Accept an unsaved Comment for later insertion, returns it as a PendingComment
+    def enqueue(self, comment, user):
+        created_at = datetime.now(timezone.utc).isoformat()
+        cursor = self._connect().execute(
+            "INSERT INTO pending_comment (user_id, episode_id, timestamp, content, gif_url, "
+            "media_title, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user.id, comment.episode_id, comment.timestamp, comment.content,
+             comment.gif_url, comment.media_title, created_at),
+        )
+        self._start()
+        return PendingComment(cursor.lastrowid, user.id, comment.episode_id, comment.timestamp,
+                              comment.content, comment.gif_url, comment.media_title, created_at,
+                              user=user)
+
+    # The user's own comments on episode_id still waiting in the spool,
+    # so they see what they posted before it is flushed
+    def pending_for(self, user, episode_id):
+        if not self.enabled or not user.is_authenticated:
+            return []
+        rows = self._connect().execute(
+            f"SELECT {SPOOL_COLUMNS} FROM pending_comment "
+            "WHERE user_id = ? AND episode_id = ? AND id > ? ORDER BY timestamp, id",
+            (user.id, int(episode_id), self._checkpoint()),
+        ).fetchall()
+        return [PendingComment(*row, user=user) for row in rows]
+
+    def _checkpoint(self):
+        checkpoint = db.session.get(SpoolCheckpoint, "comment")
+        return checkpoint.last_id if checkpoint else 0
+
+    # Copy up to one batch from the spool into the comment table.
+    # Returns the number of comments inserted.
+    def flush(self):
+        conn = self._connect()
+        # the write lock keeps enqueues and other processes' flushes out
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            checkpoint = db.session.get(SpoolCheckpoint, "comment")
+            if checkpoint is None:
+                checkpoint = SpoolCheckpoint(name="comment", last_id=0)
+                db.session.add(checkpoint)
+
+            rows = conn.execute(
+                f"SELECT {SPOOL_COLUMNS} FROM pending_comment WHERE id > ? ORDER BY id LIMIT ?",
+                (checkpoint.last_id, self.app.config["COMMENT_SPOOL_BATCH"]),
+            ).fetchall()
+            if not rows:
+                db.session.rollback()
+                conn.execute("DELETE FROM pending_comment WHERE id <= ?", (checkpoint.last_id,))
+                conn.execute("COMMIT")
+                return 0
+
+            # authors in one query, they stay in the identity map so
+            # serializing below reads comment.user without a query each
+            users = User.query.filter(User.id.in_({row[1] for row in rows})).all()
+
+            added = []
+            for row in rows:
+                pending = PendingComment(*row)
+                comment = Comment(
+                    content=pending.content,
+                    timestamp=pending.timestamp,
+                    user_id=pending.user_id,
+                    episode_id=pending.episode_id,
+                    gif_url=pending.gif_url,
+                    media_title=pending.media_title,
+                    created_at=pending.created_at,
+                )
+                db.session.add(comment)
+                if self.on_added:
+                    self.on_added(comment)
+                added.append((pending.spool_id, comment))
+
+            checkpoint.last_id = rows[-1][0]
+            # serialized before the commit expires the comments, so publishing
+            # them afterwards does not reload each one
+            db.session.flush()
+            flushed = [(spool_id, comment.episode_id, serialize_comment(comment))
+                       for spool_id, comment in added]
+            db.session.commit()
+
+            conn.execute("DELETE FROM pending_comment WHERE id <= ?", (rows[-1][0],))
+            conn.execute("COMMIT")
+        except Exception:
+            db.session.rollback()
+            conn.execute("ROLLBACK")
+            raise
+
+        if self.after_commit:
+            self.after_commit(flushed)
+        return len(flushed)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name="comment-spool", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.app.config["COMMENT_SPOOL_INTERVAL"]):
+            with self.app.app_context():
+                try:
+                    # keep going while there is a backlog
+                    while self.flush() >= self.app.config["COMMENT_SPOOL_BATCH"]:
+                        pass
+                except Exception as e:
+                    self.app.logger.warning("Comment spool flush failed: %s", e)
+                finally:
+                    db.session.remove()
+
+    # Stop the background flusher (the spool itself stays on disk)
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+comment_spool = CommentSpool()
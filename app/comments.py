@@ -0,0 +1,203 @@
+import time
+
+from sqlalchemy.dialects.sqlite import insert
+
+from app.models import db, Comment, CommentBucketCount
+
+# Comments returned per window request, and the most a client may ask for
+COMMENT_PAGE_SIZE = 100
+MAX_COMMENT_PAGE_SIZE = 500
+# Runtime covered by the comments rendered into the media page itself
+INITIAL_WINDOW_SECONDS = 300
+# Width of each comment_bucket_count row in seconds of runtime
+DENSITY_BUCKET_SECONDS = 5
+# Most heatmap buckets a client may ask for, media items kept in memory, and
+# seconds before a worker reads counts again that it did not invalidate itself
+MAX_HEATMAP_BUCKETS = 200
+# Shortest runtime a heatmap may be drawn over, tinier ones overflow the bucket index
+MIN_HEATMAP_DURATION = 1
+HEATMAP_CACHE_SIZE = 512
+HEATMAP_CACHE_TTL = 10
+
+# episode_id -> (loaded at, [(bucket, count), ...])
+_heatmap_cache = {}
+
+
+# Cursors point at the last comment returned as "<timestamp>:<id>"
+def encode_cursor(comment):
+    return f"{comment.timestamp!r}:{comment.id}"
+
+
+def decode_cursor(cursor):
+    timestamp, comment_id = cursor.rsplit(":", 1)
+    return float(timestamp), int(comment_id)
+
+
+# Comments for an episode with from_secs <= timestamp < to_secs in playback
+# order, resuming after cursor. Returns (comments, next_cursor) where
+# next_cursor is None once the window is exhausted.
+def comment_window(episode_id, from_secs=0, to_secs=None, cursor=None, limit=COMMENT_PAGE_SIZE):
+    # authors come back in the same query, the page and API read comment.user
+    query = Comment.query.options(db.joinedload(Comment.user)).filter(
+        Comment.episode_id == int(episode_id),
+        Comment.timestamp >= from_secs,
+    )
+    if to_secs is not None:
+        query = query.filter(Comment.timestamp < to_secs)
+    if cursor:
+        timestamp, comment_id = decode_cursor(cursor)
+        query = query.filter(db.or_(
+            Comment.timestamp > timestamp,
+            db.and_(Comment.timestamp == timestamp, Comment.id > comment_id),
+        ))
+
+    # one extra row tells us whether there is another page
+    rows = query.order_by(Comment.timestamp, Comment.id).limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+
+
+def serialize_comment(comment):
+    return {
+        "id": comment.id,
+        "user_id": comment.user_id,
+        "username": comment.user.username,
+        "content": comment.content,
+        "gif_url": comment.gif_url,
+        "timestamp": comment.timestamp,
+    }
+
+
+def density_bucket(seconds):
+    return int(seconds // DENSITY_BUCKET_SECONDS)
+
+
+# Add (or with delta=-1 remove) one comment from its density bucket, caller commits
+def _apply_count(comment, delta):
+    key = dict(episode_id=comment.episode_id, bucket=density_bucket(comment.timestamp))
+    if delta > 0:
+        stmt = insert(CommentBucketCount).values(count=delta, **key)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["episode_id", "bucket"],
+            set_={"count": CommentBucketCount.count + delta},
+        )
+        db.session.execute(stmt)
+    else:
+        CommentBucketCount.query.filter_by(**key).update(
+            {"count": CommentBucketCount.count + delta})
+        CommentBucketCount.query.filter_by(**key).filter(
+            CommentBucketCount.count <= 0).delete()
+
+
+def record_comment_count(comment):
+    _apply_count(comment, 1)
+
+
+def remove_comment_count(comment):
+    _apply_count(comment, -1)
+
+
+# Number of comments on an episode, summed over its density buckets
+def comment_total(episode_id):
+    total = (
+        db.session.query(db.func.sum(CommentBucketCount.count))
+        .filter_by(episode_id=int(episode_id))
+        .scalar()
+    )
+    return total or 0
+
+
+# (bucket, count) rows for an episode. They are cached per media item, not
+# per (buckets, duration) request, so memory stays bounded by runtime / bucket
+# width whatever the client asks for. Other workers never see our
+# invalidate_heatmap, the TTL bounds how stale their copy gets.
+def _bucket_counts(episode_id):
+    now = time.monotonic()
+    cached = _heatmap_cache.get(episode_id)
+    if cached is not None and now - cached[0] < HEATMAP_CACHE_TTL:
+        return cached[1]
+
+    rows = (
+        db.session.query(CommentBucketCount.bucket, CommentBucketCount.count)
+        .filter_by(episode_id=episode_id)
+        .all()
+    )
+    if episode_id not in _heatmap_cache and len(_heatmap_cache) >= HEATMAP_CACHE_SIZE:
+        # drop the oldest media item
+        _heatmap_cache.pop(next(iter(_heatmap_cache)), None)
+    _heatmap_cache[episode_id] = (now, rows)
+    return rows
+
+
+# Comment density over `buckets` equal slices of [0, duration) seconds,
+# folded together from the fixed-width density buckets. A density bucket
+# that straddles slices is split between them by overlap, so evenly spread
+# comments give an even heatmap instead of stripes.
+def comment_heatmap(episode_id, buckets, duration):
+    width = duration / buckets
+    density = [0] * buckets
+    for bucket, count in _bucket_counts(episode_id):
+        start = bucket * DENSITY_BUCKET_SECONDS
+        end = start + DENSITY_BUCKET_SECONDS
+        first = int(start / width)
+        last = min(int(end / width), buckets - 1)
+        for index in range(first, last + 1):
+            overlap = min(end, (index + 1) * width) - max(start, index * width)
+            if overlap > 0:
+                density[index] += count * overlap / DENSITY_BUCKET_SECONDS
+    return [round(value, 3) for value in density]
+
+
+# Density bucket counts as they should be, straight from the comment table
+def _counted_buckets(episode_id=None):
+    # CAST truncates, which is density_bucket for non-negative timestamps and
+    # unlike floor() works on every SQLite build
+    bucket = db.cast(Comment.timestamp / DENSITY_BUCKET_SECONDS, db.Integer)
+    query = db.session.query(Comment.episode_id, bucket, db.func.count()).group_by(
+        Comment.episode_id, bucket)
+    if episode_id is not None:
+        query = query.filter(Comment.episode_id == episode_id)
+    return {(ep, b): count for ep, b, count in query}
+
+
+# Recompute density buckets from the comment table (for data that predates them)
+def rebuild_comment_counts(episode_id=None):
+    stored = CommentBucketCount.query
+    if episode_id is not None:
+        stored = stored.filter_by(episode_id=episode_id)
+    stored.delete()
+
+    counts = _counted_buckets(episode_id)
+    db.session.add_all(
+        CommentBucketCount(episode_id=ep, bucket=bucket, count=count)
+        for (ep, bucket), count in counts.items()
+    )
+    db.session.commit()
+    invalidate_heatmap(episode_id)
+    return len(counts)
+
+
+# Buckets whose stored count disagrees with the comment table, as
+# [(episode_id, bucket, expected, stored), ...]
+def check_comment_counts(episode_id=None):
+    stored = db.session.query(
+        CommentBucketCount.episode_id, CommentBucketCount.bucket, CommentBucketCount.count)
+    if episode_id is not None:
+        stored = stored.filter_by(episode_id=episode_id)
+    stored = {(ep, b): count for ep, b, count in stored}
+    expected = _counted_buckets(episode_id)
+
+    return [
+        (ep, b, expected.get((ep, b), 0), stored.get((ep, b), 0))
+        for ep, b in sorted(expected.keys() | stored.keys())
+        if expected.get((ep, b), 0) != stored.get((ep, b), 0)
+    ]
+
+
+# Forget cached heatmaps for one media item, or all of them
+def invalidate_heatmap(episode_id=None):
+    if episode_id is None:
+        _heatmap_cache.clear()
+    else:
+        _heatmap_cache.pop(int(episode_id), None)
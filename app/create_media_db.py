@@ -0,0 +1,392 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from app import anilist, tmdb
+from app.media_queries import (
+    ANIME_COLUMNS,
+    ANIME_EP_COLUMNS,
+    EPISODE_COLUMNS,
+    FEATURED_COLUMNS,
+    MEDIA_COLUMNS,
+    SEASON_COLUMNS,
+)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEDIA_DB_PATH = os.getenv("MEDIA_DB_PATH", os.path.join(BASE_DIR, "media.db"))
+
+# Pages pulled from each list in a full build
+POPULAR_PAGES = 1
+FEATURED_PAGES = 3
+ANIME_PAGES = 1
+# Rows per executemany call
+INSERT_BATCH = 500
+
+# Seconds before an entity is fetched again when nothing says it changed
+TTL_AIRING = 24 * 3600
+TTL_ENDED = 30 * 24 * 3600
+TTL_MOVIE = 7 * 24 * 3600
+# TMDb keeps its change lists for the last 14 days
+CHANGES_WINDOW = 14 * 24 * 3600
+TMDB_AIRING = {"Returning Series", "In Production", "Planned", "Pilot"}
+ANILIST_AIRING = {"RELEASING", "NOT_YET_RELEASED", "HIATUS"}
+# Season fields that decide whether its episode list needs fetching again
+SEASON_HASH_FIELDS = ("season_number", "name", "overview", "poster_path", "air_date",
+                      "episode_count")
+TABLES = ("media", "seasons", "episodes", "anime", "anime_ep", "featured_movies", "featured_tv")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    tmdb_id INTEGER PRIMARY KEY,
+    title TEXT,
+    media_type TEXT,
+    poster_url TEXT,
+    overview TEXT,
+    release_date TEXT,
+    runtime INTEGER,
+    vote_average REAL
+);
+CREATE TABLE IF NOT EXISTS seasons (
+    season_id TEXT PRIMARY KEY,
+    tv_id INTEGER,
+    title TEXT,
+    season_number INTEGER,
+    name TEXT,
+    overview TEXT,
+    poster_url TEXT,
+    air_date TEXT,
+    episode_count INTEGER,
+    vote_average REAL
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    episode_id INTEGER PRIMARY KEY,
+    season_id TEXT,
+    tv_id INTEGER,
+    season_number INTEGER,
+    episode_number INTEGER,
+    episode_name TEXT,
+    overview TEXT,
+    air_date TEXT,
+    runtime INTEGER,
+    vote_average REAL,
+    still_url TEXT
+);
+CREATE TABLE IF NOT EXISTS anime (
+    anilist_id INTEGER PRIMARY KEY,
+    title_romaji TEXT,
+    title_english TEXT,
+    episodes INTEGER,
+    average_score TEXT,
+    trending INTEGER,
+    genres TEXT,
+    description TEXT,
+    cover_url TEXT,
+    start_date TEXT
+);
+CREATE TABLE IF NOT EXISTS anime_ep (
+    episode_id INTEGER PRIMARY KEY,
+    anilist_id INTEGER,
+    episode_title TEXT,
+    thumbnail TEXT,
+    duration INTEGER
+);
+CREATE TABLE IF NOT EXISTS featured_movies (
+    tmdb_id INTEGER PRIMARY KEY,
+    title TEXT,
+    poster_url TEXT,
+    overview TEXT,
+    rank INTEGER
+);
+CREATE TABLE IF NOT EXISTS featured_tv (
+    tmdb_id INTEGER PRIMARY KEY,
+    title TEXT,
+    poster_url TEXT,
+    overview TEXT,
+    rank INTEGER
+);
+-- when each movie, tv show, season and anime was last fetched
+CREATE TABLE IF NOT EXISTS fetch_meta (
+    entity TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    content_hash TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    PRIMARY KEY (entity, entity_id)
+);
+-- the lookups in media_queries
+CREATE INDEX IF NOT EXISTS ix_seasons_tv ON seasons (tv_id, season_number);
+CREATE INDEX IF NOT EXISTS ix_episodes_season ON episodes (season_id, episode_number);
+CREATE INDEX IF NOT EXISTS ix_anime_trending ON anime (trending);
+CREATE INDEX IF NOT EXISTS ix_anime_ep_anime ON anime_ep (anilist_id);
+"""
+
+
+# INSERT OR REPLACE dict rows into table in batches, returns the row count
+def insert_rows(conn, table, columns, rows):
+    names = columns.split(", ")
+    statement = (f"INSERT OR REPLACE INTO {table} ({columns}) "
+                 f"VALUES ({', '.join('?' * len(names))})")
+    batch = []
+    count = 0
+    for row in rows:
+        batch.append(tuple(row.get(name) for name in names))
+        if len(batch) >= INSERT_BATCH:
+            conn.executemany(statement, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(statement, batch)
+        count += len(batch)
+    return count
+
+
+def content_hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+# One build or refresh of a media.db file. fetch_meta remembers when each
+# movie, show, season and anime was fetched, with a content hash and HTTP
+# validators. Entities still inside their TTL (and, for shows, missing from
+# TMDb's change list) are not fetched again, so a refresh costs requests in
+# proportion to what changed. Into an empty file this is a full build.
+#
+# Each writer handles one upstream page at a time and commits it, so memory
+# use depends on the page size, not on how many pages are imported.
+class MediaImport:
+    def __init__(self, conn, now=None):
+        self.conn = conn
+        self.now = now if now is not None else time.time()
+        self.changed_tv = set()
+        self.tv_changes_known = True
+        self.counts = dict.fromkeys(TABLES, 0)
+        self.counts["skipped"] = 0
+
+    def meta(self, entity, entity_id):
+        return self.conn.execute(
+            "SELECT fetched_at, expires_at, content_hash, etag, last_modified FROM fetch_meta "
+            "WHERE entity = ? AND entity_id = ?", (entity, str(entity_id))).fetchone()
+
+    def is_fresh(self, entity, entity_id):
+        meta = self.meta(entity, entity_id)
+        if meta is None or meta[1] <= self.now:
+            return False
+        if entity == "tv":
+            return self.tv_changes_known and entity_id not in self.changed_tv
+        return True
+
+    def record(self, entity, entity_id, ttl, content_hash=None, etag=None, last_modified=None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO fetch_meta (entity, entity_id, fetched_at, expires_at, "
+            "content_hash, etag, last_modified) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (entity, str(entity_id), self.now, self.now + ttl, content_hash, etag, last_modified))
+
+    # Shows edited on TMDb since the last run. Without a previous run inside
+    # the change-list window every show counts as changed.
+    def load_tv_changes(self):
+        last = self.meta("changes", "tv")
+        if last is None:
+            self.tv_changes_known = self.conn.execute(
+                "SELECT 1 FROM fetch_meta WHERE entity = 'tv' LIMIT 1").fetchone() is None
+        elif self.now - last[0] >= CHANGES_WINDOW:
+            self.tv_changes_known = False
+        else:
+            start = datetime.fromtimestamp(last[0], timezone.utc).strftime("%Y-%m-%d")
+            self.changed_tv = tmdb.fetch_changed_ids("tv", start)
+        self.record("changes", "tv", 0)
+
+    # Runtimes for a page of movies, fetching only the expired ones
+    def movie_runtimes(self, items):
+        ids = [item["id"] for item in items]
+        stored = dict(self.conn.execute(
+            "SELECT tmdb_id, runtime FROM media WHERE tmdb_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(ids),)).fetchall())
+        stale = [i for i in ids if i not in stored or not self.is_fresh("movie", i)]
+        self.counts["skipped"] += len(ids) - len(stale)
+        for tmdb_id, runtime in zip(stale, tmdb.fetch_concurrently(tmdb.fetch_movie_runtime, stale)):
+            if runtime is None:
+                # failed lookup: keep what is stored and try again next run
+                continue
+            stored[tmdb_id] = runtime
+            self.record("movie", tmdb_id, TTL_MOVIE)
+        return stored
+
+    # Trending lists are always fetched again, only their movie details are cached
+    def write_featured(self, media_type, table, pages):
+        self.conn.execute(f"DELETE FROM {table}")
+        rank = 1
+        for items in tmdb.iter_featured(media_type, pages):
+            runtimes = self.movie_runtimes(items) if media_type == "movie" else None
+            parsed = tmdb.parse_tmdb_items(
+                items, media_type, include_rank=True, first_rank=rank, runtimes=runtimes)
+            rank += len(parsed)
+            self.counts[table] += insert_rows(self.conn, table, FEATURED_COLUMNS, parsed)
+            # featured movies come with their runtime, so they can be opened
+            # without a lookup; shows still need their seasons fetched on demand
+            if media_type == "movie":
+                self.counts["media"] += insert_rows(self.conn, "media", MEDIA_COLUMNS, parsed)
+            self.conn.commit()
+
+    def write_popular_movies(self, pages):
+        for items in tmdb.iter_popular("movie", pages):
+            parsed = tmdb.parse_tmdb_items(items, "movie", runtimes=self.movie_runtimes(items))
+            self.counts["media"] += insert_rows(self.conn, "media", MEDIA_COLUMNS, parsed)
+            self.conn.commit()
+
+    def write_popular_shows(self, pages):
+        for items in tmdb.iter_popular("tv", pages):
+            shows = tmdb.parse_tmdb_items(items, "tv")
+            self.counts["media"] += insert_rows(self.conn, "media", MEDIA_COLUMNS, shows)
+
+            stale = [show for show in shows if not self.is_fresh("tv", show["tmdb_id"])]
+            self.counts["skipped"] += len(shows) - len(stale)
+            validators = {}
+            for show in stale:
+                meta = self.meta("tv", show["tmdb_id"])
+                validators[show["tmdb_id"]] = (meta[3], meta[4]) if meta else (None, None)
+            details = tmdb.fetch_concurrently(
+                lambda show: tmdb.fetch_if_changed(
+                    f"/tv/{show['tmdb_id']}", *validators[show["tmdb_id"]]),
+                stale)
+
+            episode_jobs = []
+            for show, (data, etag, last_modified) in zip(stale, details):
+                episode_jobs.extend(self.write_show(show, data, etag, last_modified))
+
+            episode_lists = tmdb.fetch_concurrently(
+                lambda job: tmdb.fetch_season_episodes(job[0]["tv_id"], job[0]["season_number"]),
+                episode_jobs)
+            for (season, ttl, season_hash), episodes_raw in zip(episode_jobs, episode_lists):
+                self.conn.execute("DELETE FROM episodes WHERE season_id = ?", (season["season_id"],))
+                episodes = tmdb.parse_episodes(
+                    season["tv_id"], season["season_number"], season["season_id"], episodes_raw)
+                self.counts["episodes"] += insert_rows(
+                    self.conn, "episodes", EPISODE_COLUMNS, episodes)
+                self.record("season", season["season_id"], ttl, season_hash)
+            self.conn.commit()
+
+    # Store a show's seasons, returns [(season, ttl, hash)] whose episodes
+    # need fetching: seasons that are new or changed, and the latest season
+    # of a show that is still airing
+    def write_show(self, show, data, etag, last_modified):
+        tv_id = show["tmdb_id"]
+        old = self.meta("tv", tv_id)
+        if data is None:
+            # 304: keep everything, start a new TTL period
+            self.record("tv", tv_id, old[1] - old[0], old[2], etag, last_modified)
+            self.counts["skipped"] += 1
+            return []
+
+        ttl = TTL_AIRING if data.get("status") in TMDB_AIRING else TTL_ENDED
+        seasons_raw = data.get("seasons", [])
+        seasons = tmdb.parse_seasons(tv_id, show["title"], seasons_raw)
+        season_ids = json.dumps([season["season_id"] for season in seasons])
+        self.conn.execute(
+            "DELETE FROM episodes WHERE tv_id = ? AND season_id NOT IN (SELECT value FROM json_each(?))",
+            (tv_id, season_ids))
+        self.conn.execute(
+            "DELETE FROM seasons WHERE tv_id = ? AND season_id NOT IN (SELECT value FROM json_each(?))",
+            (tv_id, season_ids))
+        self.counts["seasons"] += insert_rows(self.conn, "seasons", SEASON_COLUMNS, seasons)
+        self.record("tv", tv_id, ttl, content_hash(seasons_raw), etag, last_modified)
+
+        jobs = []
+        for i, (season, raw) in enumerate(zip(seasons, seasons_raw)):
+            season_hash = content_hash({f: raw.get(f) for f in SEASON_HASH_FIELDS})
+            meta = self.meta("season", season["season_id"])
+            latest_airing = ttl == TTL_AIRING and i == len(seasons) - 1
+            if meta is None or meta[2] != season_hash or latest_airing:
+                jobs.append((season, ttl, season_hash))
+            else:
+                self.counts["skipped"] += 1
+        return jobs
+
+    def write_anime(self, pages):
+        for items in anilist.iter_anime(pages):
+            anime = anilist.parse_anime(items)
+            self.counts["anime"] += insert_rows(self.conn, "anime", ANIME_COLUMNS, anime)
+
+            status = {item["id"]: item.get("status") for item in items}
+            stale = [a for a in anime if not self.is_fresh("anime", a["anilist_id"])]
+            self.counts["skipped"] += len(anime) - len(stale)
+            for _, by_anime in anilist.iter_episode_batches(stale):
+                if by_anime is None:
+                    # failed fetch, the batch is tried again next run
+                    continue
+                # an empty episode list is an answer too and keeps its TTL
+                for anilist_id, episodes in by_anime.items():
+                    self.conn.execute("DELETE FROM anime_ep WHERE anilist_id = ?", (anilist_id,))
+                    self.counts["anime_ep"] += insert_rows(
+                        self.conn, "anime_ep", ANIME_EP_COLUMNS, episodes)
+                    ttl = TTL_AIRING if status.get(anilist_id) in ANILIST_AIRING else TTL_ENDED
+                    self.record("anime", anilist_id, ttl, content_hash(episodes))
+            self.conn.commit()
+
+
+# Build media.db into a temp file next to `path` and swap it into place.
+# Readers keep the old file until the rename and never see a partial build;
+# a failed build leaves the old file untouched. With incremental=True the
+# current file is copied first and only expired or changed entities are
+# fetched again. Returns row counts per table plus entities skipped.
+def build_media_db(path=MEDIA_DB_PATH, popular_pages=POPULAR_PAGES,
+                   featured_pages=FEATURED_PAGES, anime_pages=ANIME_PAGES,
+                   incremental=False, now=None):
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".media-", suffix=".db", dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            if incremental and os.path.exists(path):
+                current = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                try:
+                    current.backup(conn)
+                finally:
+                    current.close()
+            # nothing reads the temp file, it is synced once before the swap
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.executescript(SCHEMA)
+
+            media_import = MediaImport(conn, now)
+            media_import.load_tv_changes()
+            media_import.write_featured("movie", "featured_movies", featured_pages)
+            media_import.write_featured("tv", "featured_tv", featured_pages)
+            media_import.write_popular_movies(popular_pages)
+            media_import.write_popular_shows(popular_pages)
+            media_import.write_anime(anime_pages)
+
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return media_import.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh media.db")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only fetch what changed or expired since the last run")
+    args = parser.parse_args()
+
+    counts = build_media_db(incremental=args.incremental)
+    for table, count in counts.items():
+        print(f"{table}: {count} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
+import os
 import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 print("Fetching new media data from TMDb and Anilist...")
-subprocess.run(["python", "app/create_media_db.py"], check=True)
+subprocess.run([sys.executable, "-m", "app.create_media_db", "--incremental"], check=True, cwd=BASE_DIR)
 
-print("Media database successfully updated.")
\ No newline at end of file
+print("Media database successfully updated.")
@@ -1,13 +1,17 @@
+import hashlib
+import math
 import os
-import sqlite3
 import subprocess
 
+import click
 import git
 import requests
 from dotenv import load_dotenv
 from flask import Flask, abort, flash, redirect, render_template, request, url_for, jsonify
 from flask import Flask, flash, redirect, render_template, request, url_for, jsonify, abort
+from flask import Response, make_response, session, stream_with_context
 from flask_behind_proxy import FlaskBehindProxy
+from markupsafe import Markup
 from flask_login import (
     LoginManager,
     current_user,
@@ -35,12 +39,34 @@ from app.anilist import (
 )
 
 from app.forms import RegistrationForm, LoginForm, commentForm
-from app.google_ai import get_comments, summarize_comments
+from app.comments import (
+    COMMENT_PAGE_SIZE,
+    MAX_COMMENT_PAGE_SIZE,
+    INITIAL_WINDOW_SECONDS,
+    MAX_HEATMAP_BUCKETS,
+    MIN_HEATMAP_DURATION,
+    check_comment_counts,
+    comment_heatmap,
+    comment_total,
+    comment_window,
+    invalidate_heatmap,
+    rebuild_comment_counts,
+    record_comment_count,
+    remove_comment_count,
+    serialize_comment,
+)
+from app.google_ai import mark_summary_stale, refresh_stale_summaries
+from app.summary_worker import summary_worker
+from app.live import comment_stream, live_comments, publish_comment, publish_serialized
+from app.comment_spool import comment_spool
+from app.media_db import media_db, media_version
+from app import media_queries
+from app.timeline import get_timeline, rebuild_timeline, record_comment_sentiment, remove_comment_sentiment
 
-from app.models import Comment, User, db, History, Favorite
+from app.models import Comment, CommentBucketCount, User, db, History, Favorite, upgrade_schema
 
 from app.tenor import search_gif, featured_gifs
-from app.cache_tmdb import fetch_and_cache_movie, fetch_and_cache_show
+from app.cache_tmdb import TMDbUnavailable, fetch_and_cache_movie, fetch_and_cache_show
 from app.history import add_to_history
 
 
@@ -54,9 +80,18 @@ PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.dirname(PROJECT_ROOT)
 app.config["MEDIA_DB_PATH"] = os.path.join(BASE_DIR, "media.db")
 
+# Pages change with the templates too, so their ETags include this stamp
+TEMPLATE_STAMP = max(
+    os.stat(os.path.join(root, name)).st_mtime_ns
+    for root, _, names in os.walk(os.path.join(PROJECT_ROOT, "templates"))
+    for name in names
+)
+
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
 
 db.init_app(app)
+media_db.init_app(app)
+summary_worker.init_app(app)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -69,6 +104,12 @@ def load_user(user_id):
 
 with app.app_context():
     db.create_all()
+    upgrade_schema(db.engine)
+    # comment counts come from the bucket table, seed it on first run
+    if Comment.query.first() and not CommentBucketCount.query.first():
+        rebuild_comment_counts()
+
+live_comments.init_app(app)
 
 # Helper function to parse comment timestamp
 def parse_timestamp_string(ts_str):
@@ -99,63 +140,131 @@ def seconds_to_hours_minutes(total_seconds):
     minutes = (total_seconds % 3600) // 60
     return hours, minutes
 
+# Keep summaries and timeline aggregates in step with comment changes.
+# Runs in the same transaction as the insert/delete, caller commits.
+def on_comment_added(comment):
+    mark_summary_stale(comment.episode_id)
+    record_comment_count(comment)
+    record_comment_sentiment(comment)
+
+def on_comment_removed(comment):
+    mark_summary_stale(comment.episode_id)
+    remove_comment_count(comment)
+    remove_comment_sentiment(comment)
+
+# Work that has to wait until the comment change is committed
+def on_comment_committed(episode_id):
+    invalidate_heatmap(episode_id)
+    summary_worker.schedule(episode_id)
+
+# Insert a new comment, or hand it to the write-behind spool when that is
+# enabled. Returns the saved Comment, or a PendingComment until it is flushed.
+def save_comment(comment):
+    if comment_spool.enabled:
+        return comment_spool.enqueue(comment, current_user)
+
+    db.session.add(comment)
+    on_comment_added(comment)
+    db.session.commit()
+    on_comment_committed(comment.episode_id)
+    publish_comment(comment)
+    return comment
+
+# Spooled comments made it into the comment table
+def on_spool_flushed(flushed):
+    for episode_id in {episode_id for _, episode_id, _ in flushed}:
+        on_comment_committed(episode_id)
+    for spool_id, episode_id, payload in flushed:
+        publish_serialized(episode_id, payload, pending_id=f"pending-{spool_id}")
+
+comment_spool.init_app(app, on_added=on_comment_added, after_commit=on_spool_flushed)
+
+# The opening comment window for a media page plus the total count, with
+# the viewer's own spooled comments folded in
+def page_comments(episode_id):
+    comments, cursor = comment_window(episode_id, 0, INITIAL_WINDOW_SECONDS)
+    pending = comment_spool.pending_for(current_user, episode_id)
+    if pending:
+        comments = sorted(
+            comments + [c for c in pending if c.timestamp < INITIAL_WINDOW_SECONDS],
+            key=lambda c: c.timestamp,
+        )
+    return comments, cursor, comment_total(episode_id) + len(pending)
+
+# Rendered catalogue rows, kept until media.db changes
+_catalogue_grids = {}  # script root -> (media version, html)
+
+
+# The featured rows only depend on media.db, so they are rendered once per
+# version of the file and shared by every visitor
+def catalogue_grid():
+    version = media_version()
+    cached = _catalogue_grids.get(request.script_root)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    html = Markup(render_template(
+        "catalogue_grid.html",
+        movies=media_queries.featured_movies(50),
+        tv_shows=media_queries.featured_tv(10),
+        anime=media_queries.trending_anime(10),
+    ))
+    _catalogue_grids[request.script_root] = (version, html)
+    return html
+
+
+# ETag for a page built from media.db, the visitor and any per-user parts
+def page_etag(*parts):
+    user_id = current_user.id if current_user.is_authenticated else None
+    state = (media_version(), TEMPLATE_STAMP, request.script_root, user_id, parts)
+    return hashlib.sha1(repr(state).encode()).hexdigest()
+
+
+# Answers a matching If-None-Match with 304 instead of calling render().
+# Anonymous pages may be stored by a shared proxy, logged-in ones only by
+# the browser, and both must be revalidated before reuse. A page showing
+# flash messages is rendered once and never validated.
+def conditional_page(render, *parts):
+    if session.get("_flashes"):
+        response = make_response(render())
+        response.headers["Cache-Control"] = "private, no-store"
+        return response
+
+    etag = page_etag(*parts)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    if current_user.is_authenticated:
+        response.headers["Cache-Control"] = "private, no-cache"
+    else:
+        response.headers["Cache-Control"] = "public, no-cache"
+    response.vary.add("Cookie")
+    return response
+
+
 # Update TMDB to show to catalogue page
 @app.route("/")
 def catalogue():
-    conn = sqlite3.connect(app.config["MEDIA_DB_PATH"])
-
-    movie_query = """
-        SELECT *
-        FROM featured_movies fm
-        ORDER BY fm.rank ASC 
-        LIMIT 50
-    """
-    
-    tv_query = """
-        SELECT *
-        FROM featured_tv ftv
-        ORDER BY ftv.rank ASC 
-        LIMIT 10
-    """
-    # Anime query remains the same since it already has description
-    anime_query = "SELECT * FROM anime ORDER BY trending DESC LIMIT 10"
-
-    def fetch_rows(conn, query):
-        cursor = conn.execute(query)
-        columns = [col[0] for col in cursor.description]
-        return [dict(zip(columns, row)) for row in cursor.fetchall()]
-
-    movies = fetch_rows(conn, movie_query)
-    tv_shows = fetch_rows(conn, tv_query)
-    anime = fetch_rows(conn, anime_query)
-
-    conn.close()
-
-    users = User.query.all()
-    return render_template(
-        "catalogue.html", movies=movies, tv_shows=tv_shows, anime=anime, users=users
-    )
+    return conditional_page(
+        lambda: render_template("catalogue.html", catalogue_grid=catalogue_grid()))
 
 @app.route("/media/<int:media_id>")
 def get_media(media_id):
-    conn = sqlite3.connect(app.config["MEDIA_DB_PATH"])
-    
     # START OF SHOW LIVE QUERY
     # Check if media exists in our database
-    media_query = f"SELECT * FROM media WHERE tmdb_id = {media_id}"
-
-    cursor = conn.execute(media_query)
-    row = cursor.fetchone()
-    if not row:
-        fetch_and_cache_show(media_id, conn)
-        cursor = conn.execute(media_query)
-        row = cursor.fetchone()
-        if not row:
-            conn.close()
+    media = media_queries.get_media(media_id)
+    if not media:
+        try:
+            with media_db.writer() as writer:
+                fetch_and_cache_show(media_id, writer)
+        except TMDbUnavailable:
+            abort(503)
+        media = media_queries.get_media(media_id)
+        if not media:
             abort(404)
 
-    media = dict(zip([c[0] for c in cursor.description], row))
-
     # history
     if current_user.is_authenticated and media["media_type"] == "tv":
         add_to_history(
@@ -167,49 +276,30 @@ def get_media(media_id):
         )
 
     # gets seasons
-    seasons = []
-    if media["media_type"] == "tv":
-        season_query = (
-            f"SELECT * FROM seasons WHERE tv_id = '{media_id}' ORDER BY season_number")
+    def render():
         seasons = []
-        season_cursor = conn.execute(season_query)
-        season_columns = [col[0] for col in season_cursor.description]
+        if media["media_type"] == "tv":
+            seasons = media_queries.get_show_tree(media_id)
+        return render_template("season_page.html", item=media, seasons=seasons,media_type="tv",media_id=media["tmdb_id"])
 
-        for row in season_cursor.fetchall():
-            season_dict = dict(zip(season_columns, row))
-            
-            episode_query = f"SELECT * FROM episodes WHERE season_id = '{row[0]}' ORDER BY episode_number"
-            ep_cursor = conn.execute(episode_query)
-            ep_columns = [col[0] for col in ep_cursor.description]
-            season_dict["episodes"] = [dict(zip(ep_columns, ep_row)) for ep_row in ep_cursor.fetchall()]
-            
-            seasons.append(season_dict)
-
-        conn.close()
-    return render_template("season_page.html", item=media, seasons=seasons,media_type="tv",media_id=media["tmdb_id"])
+    return conditional_page(render)
 
 
 # for movies
 @app.route("/movie/<int:movie_id>", methods=["GET", "POST"])
 def view_movie(movie_id):
     # get episode from sqlite
-    conn = sqlite3.connect(app.config["MEDIA_DB_PATH"])
-
-    movie_query = f"SELECT * FROM media WHERE tmdb_id = {movie_id} AND media_type = 'movie'"
-    cursor = conn.execute(movie_query)
-    row = cursor.fetchone()
-    if not row:
-        fetch_and_cache_movie(movie_id, conn)
-        cursor = conn.execute(movie_query)
-        row = cursor.fetchone()
-        if not row:
-            conn.close()
+    movie = media_queries.get_movie(movie_id)
+    if not movie:
+        try:
+            with media_db.writer() as writer:
+                fetch_and_cache_movie(movie_id, writer)
+        except TMDbUnavailable:
+            abort(503)
+        movie = media_queries.get_movie(movie_id)
+        if not movie:
             abort(404)
 
-    movie = dict(zip([c[0] for c in cursor.description], row))
-
-    conn.close()
-
     # add to history
     if current_user.is_authenticated:
         add_to_history(
@@ -238,19 +328,14 @@ def view_movie(movie_id):
             gif_url=form.gif_url.data,
             media_title=movie["title"]
         )
-        db.session.add(new_comment)
-        db.session.commit()
+        new_comment = save_comment(new_comment)
         flash("Comment added!", "toast")  # Change from default to "toast"
         return redirect(url_for("view_movie", movie_id=movie_id))
 
-    comments = (
-        Comment.query.filter_by(episode_id=int(movie_id))
-        .order_by(Comment.timestamp)
-        .all()
-    )
+    # only the opening window is rendered, the player fetches the rest as it plays
+    comments, comment_cursor, comment_count = page_comments(movie_id)
 
-    comment_block = get_comments(movie_id)
-    emoji_summary = summarize_comments(comment_block) if comment_block else ""
+    emoji_summary = summary_worker.summary_for_page(movie_id, comment_count > 0)
     user_favorites = get_user_favorites()
     
     return render_template(
@@ -259,7 +344,10 @@ def view_movie(movie_id):
         media_type="movie",
         form=form,
         comments=comments,
-        comment_count=len(comments),
+        comment_count=comment_count,
+        comment_cursor=comment_cursor,
+        comment_window_to=INITIAL_WINDOW_SECONDS,
+        live_after=live_comments.last_id(),
         emoji_summary=emoji_summary,
         comment_media_id=movie["tmdb_id"],
         user_favorites=user_favorites,
@@ -268,16 +356,10 @@ def view_movie(movie_id):
 # for shows
 @app.route("/episode/<int:episode_id>", methods=["GET", "POST"])
 def view_episode(episode_id):
-    conn = sqlite3.connect(app.config["MEDIA_DB_PATH"])
-    episode_query = f"SELECT * FROM episodes WHERE episode_id = {episode_id}"
-    cursor = conn.execute(episode_query)
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
+    episode = media_queries.get_episode(episode_id)
+    if not episode:
         abort(404)
-    episode = dict(zip([c[0] for c in cursor.description], row))
 
-    conn.close()
 
     # Allow commenting
     form = commentForm()
@@ -297,19 +379,14 @@ def view_episode(episode_id):
             episode_id=int(episode_id),
             media_title=f"S:{episode['season_number']} E:{episode['episode_number']}: {episode['episode_name']}"
         )
-        db.session.add(new_comment)
-        db.session.commit()
+        new_comment = save_comment(new_comment)
         flash("Comment added!", "toast")  # Change all instances
         return redirect(url_for("view_episode", episode_id=episode_id))
 
-    comments = (
-        Comment.query.filter_by(episode_id=int(episode_id))
-        .order_by(Comment.timestamp)
-        .all()
-    )
+    # only the opening window is rendered, the player fetches the rest as it plays
+    comments, comment_cursor, comment_count = page_comments(episode_id)
 
-    comment_block = get_comments(episode_id)
-    emoji_summary = summarize_comments(comment_block) if comment_block else ""
+    emoji_summary = summary_worker.summary_for_page(episode_id, comment_count > 0)
     
     return render_template(
         "media_page.html",
@@ -317,7 +394,10 @@ def view_episode(episode_id):
         media_type="tv",
         form=form,
         comments=comments,
-        comment_count=len(comments),
+        comment_count=comment_count,
+        comment_cursor=comment_cursor,
+        comment_window_to=INITIAL_WINDOW_SECONDS,
+        live_after=live_comments.last_id(),
         emoji_summary=emoji_summary,
         comment_media_id=episode["episode_id"],
     )
@@ -326,14 +406,9 @@ def view_episode(episode_id):
 # anime
 @app.route("/anime/<int:anime_id>")
 def view_anime(anime_id):
-    conn = sqlite3.connect(app.config["MEDIA_DB_PATH"])
-
-    anime_query = f"SELECT * FROM anime WHERE anilist_id = {anime_id}"
-    cursor = conn.execute(anime_query)
-    anime_row = cursor.fetchone()
-    if not anime_row:
+    anime = media_queries.get_anime(anime_id)
+    if not anime:
         abort(404)
-    anime = dict(zip([c[0] for c in cursor.description], anime_row))
 
     if current_user.is_authenticated:
         add_to_history(
@@ -344,40 +419,28 @@ def view_anime(anime_id):
             poster_url=anime.get("cover_url")
         )
     
-    episode_query = f"SELECT * FROM anime_ep WHERE anilist_id = {anime_id}"
-    ep_cursor = conn.execute(episode_query)
-    ep_columns = [col[0] for col in ep_cursor.description]
-    episodes = [dict(zip(ep_columns, row)) for row in ep_cursor.fetchall()]
-
-    conn.close()
     user_favorites = get_user_favorites()  # Add this line
-    # get episode nums
-    episodes.sort(key=lambda x: extract_ep_num(x.get('episode_title')), reverse=False)
 
-    return render_template("season_page.html", anime=anime, episodes=episodes,user_favorites=user_favorites,media_type="anime",media_id=anime["anilist_id"],)
+    def render():
+        episodes = media_queries.get_anime_episodes(anime_id)
+        # get episode nums
+        episodes.sort(key=lambda x: extract_ep_num(x.get('episode_title')), reverse=False)
+        return render_template("season_page.html", anime=anime, episodes=episodes,user_favorites=user_favorites,media_type="anime",media_id=anime["anilist_id"],)
+
+    # the star shows whether this anime is a favorite
+    return conditional_page(render, anime["anilist_id"] in user_favorites)
 
 # anime details
 @app.route("/aniepisode/<int:episode_id>", methods=["GET", "POST"])
 def view_anime_episode(episode_id):
-    conn = sqlite3.connect(app.config["MEDIA_DB_PATH"])
-
-    episode_query = f"SELECT * FROM anime_ep WHERE episode_id = {episode_id}"
-
-    cursor = conn.execute(episode_query)
-    row = cursor.fetchone()
-    if not row:
+    episode = media_queries.get_anime_episode(episode_id)
+    if not episode:
         abort(404)
-    episode = dict(zip([c[0] for c in cursor.description], row))
 
     anilist_id = episode.get("anilist_id") # Get the anilist_id from the episode data
     anime_details = None
     if anilist_id:
-        anime_query = f"SELECT * FROM anime WHERE anilist_id = {anilist_id}"
-        anime_cursor = conn.execute(anime_query)
-        row = anime_cursor.fetchone()
-        if row:
-            anime_details = dict(zip([c[0] for c in anime_cursor.description], row))
-    conn.close()
+        anime_details = media_queries.get_anime(anilist_id)
 
     # Allow commenting
     form = commentForm()
@@ -396,18 +459,13 @@ def view_anime_episode(episode_id):
             episode_id=int(episode_id),
             media_title=episode["episode_title"]
         )
-        db.session.add(new_comment)
-        db.session.commit()
+        new_comment = save_comment(new_comment)
         flash("Comment added!", "toast")
         return redirect(url_for("view_anime_episode", episode_id=episode_id))
-    comments = (
-        Comment.query.filter_by(episode_id=int(episode_id))
-        .order_by(Comment.timestamp)
-        .all()
-    )
+    # only the opening window is rendered, the player fetches the rest as it plays
+    comments, comment_cursor, comment_count = page_comments(episode_id)
 
-    comment_block = get_comments(episode_id)
-    emoji_summary = summarize_comments(comment_block) if comment_block else ""
+    emoji_summary = summary_worker.summary_for_page(episode_id, comment_count > 0)
     user_favorites = get_user_favorites()  # Add this line
     return render_template(
         "media_page.html",
@@ -416,7 +474,10 @@ def view_anime_episode(episode_id):
         media_type="anime_episode",
         form=form,
         comments=comments,
-        comment_count=len(comments),
+        comment_count=comment_count,
+        comment_cursor=comment_cursor,
+        comment_window_to=INITIAL_WINDOW_SECONDS,
+        live_after=live_comments.last_id(),
         emoji_summary=emoji_summary,
         user_favorites=user_favorites,
         comment_media_id=episode["episode_id"],
@@ -455,29 +516,15 @@ def favorites():
     if not media_ids:
         return render_template("Favorited.html", shows=[])
 
-    # Step 2: Open a raw SQLite connection to media.db
-    conn = sqlite3.connect(app.config["MEDIA_DB_PATH"])
-
-    conn.row_factory = sqlite3.Row  # enables dict-like row access
-    cursor = conn.cursor()
-
-    # Step 3: Query for shows that match the IDs
-    placeholders = ",".join(["?"] * len(media_ids))  # e.g., "?, ?, ?"
-    query = f"SELECT * FROM media WHERE tmdb_id IN ({placeholders})"
-    cursor.execute(query, media_ids)
-    shows = cursor.fetchall()
-
-    placeholders = ",".join(["?"] * len(media_ids))  # e.g., "?, ?, ?"
-    query = f"SELECT *, 'anime' as media_type FROM anime WHERE anilist_id IN ({placeholders})"
-    cursor.execute(query, media_ids)
-    anime = cursor.fetchall()
+    # Step 2: Query media.db for shows and anime that match the IDs
+    shows = media_queries.media_by_ids(media_ids)
+    anime = media_queries.anime_by_ids(media_ids)
     
 
     user_favorites = get_user_favorites()  # Add this line
     user_favorites=user_favorites
     
     shows.extend(anime)
-    conn.close()
     return render_template("Favorited.html", shows=shows,user_favorites=user_favorites)
 
 
@@ -492,16 +539,138 @@ def delete_comment(comment_id):
         return redirect(request.referrer or url_for("catalogue"))
 
     db.session.delete(comment)
+    on_comment_removed(comment)
     db.session.commit()
+    on_comment_committed(comment.episode_id)
     flash("Comment deleted.", "success")
     return redirect(request.referrer or url_for("catalogue"))
 
+# Title stored with a comment, by the page type it was posted from
+def comment_media_title(media_type, media_id):
+    if media_type == "movie":
+        movie = media_queries.get_movie(media_id)
+        return movie["title"] if movie else None
+    if media_type == "tv":
+        episode = media_queries.get_episode(media_id)
+        if not episode:
+            return None
+        return f"S:{episode['season_number']} E:{episode['episode_number']}: {episode['episode_name']}"
+    if media_type == "anime_episode":
+        episode = media_queries.get_anime_episode(media_id)
+        return episode["episode_title"] if episode else None
+    return None
+
+# Post a comment without a page reload. Takes the comment form fields as
+# JSON and answers with the new comment and its rendered markup; the
+# emoji summary is refreshed later by the summary worker.
+@app.route("/api/comments/<media_type>/<int:media_id>", methods=["POST"])
+def post_comment_api(media_type, media_id):
+    if not current_user.is_authenticated:
+        return jsonify(success=False, message="Log in to leave a comment."), 401
+    if media_type not in ("movie", "tv", "anime_episode"):
+        return jsonify(success=False, message="Unknown media type."), 404
+
+    form = commentForm()
+    if not form.validate_on_submit():
+        return jsonify(success=False, errors=form.errors), 400
+    try:
+        timestamp_seconds = parse_timestamp_string(form.timestamp.data)
+    except ValueError:
+        return jsonify(success=False, message="Invalid timestamp format."), 400
+
+    media_title = comment_media_title(media_type, media_id)
+    if media_title is None:
+        return jsonify(success=False, message="Media not found."), 404
+
+    new_comment = Comment(
+        content=form.content.data,
+        timestamp=timestamp_seconds,
+        user_id=current_user.id,
+        episode_id=media_id,
+        gif_url=form.gif_url.data,
+        media_title=media_title
+    )
+    new_comment = save_comment(new_comment)
+
+    return jsonify(
+        success=True,
+        comment=serialize_comment(new_comment),
+        html=render_template("comment_line.html", comment=new_comment),
+    ), 201
+
 @app.route("/api/comments/<int:media_id>")
 def get_comment_timestamps(media_id):
-    comments = Comment.query.filter_by(episode_id =media_id).all()
-    timestamps = [c.timestamp for c in comments]
+    rows = db.session.query(Comment.timestamp).filter_by(episode_id=media_id).all()
+    timestamps = [ts for ts, in rows]
     return jsonify(timestamps)
 
+# Comment density for the progress bar, already bucketed
+@app.route("/api/comments/<int:media_id>/heatmap")
+def get_comment_heatmap(media_id):
+    try:
+        buckets = int(request.args.get("buckets", MAX_HEATMAP_BUCKETS))
+        duration = float(request.args["duration"])
+    except (KeyError, ValueError):
+        return jsonify(success=False, message="Invalid heatmap parameters"), 400
+    if not math.isfinite(duration) or duration < MIN_HEATMAP_DURATION or buckets < 1:
+        return jsonify(success=False, message="Invalid heatmap parameters"), 400
+
+    buckets = min(buckets, MAX_HEATMAP_BUCKETS)
+    return jsonify(
+        buckets=buckets,
+        duration=duration,
+        density=comment_heatmap(media_id, buckets, duration),
+    )
+
+# Comments in [from, to) seconds of runtime, paged with a cursor
+@app.route("/api/comments/<int:media_id>/window")
+def get_comment_window(media_id):
+    try:
+        from_secs = float(request.args.get("from", 0))
+        to_secs = request.args.get("to")
+        to_secs = float(to_secs) if to_secs else None
+        limit = min(int(request.args.get("limit", COMMENT_PAGE_SIZE)), MAX_COMMENT_PAGE_SIZE)
+        comments, next_cursor = comment_window(
+            media_id, from_secs, to_secs, request.args.get("cursor"), max(limit, 1))
+    except ValueError:
+        return jsonify(success=False, message="Invalid window parameters"), 400
+
+    if not request.args.get("cursor"):
+        # the viewer's own spooled comments ride along with the first page
+        comments += [
+            c for c in comment_spool.pending_for(current_user, media_id)
+            if c.timestamp >= from_secs and (to_secs is None or c.timestamp < to_secs)
+        ]
+
+    return jsonify(
+        comments=[serialize_comment(c) for c in comments],
+        next_cursor=next_cursor,
+    )
+
+# New comments pushed as Server-Sent Events. Resumes after Last-Event-ID
+# on reconnect, or after ?after=<comment id> from the page on first connect.
+# Off unless LIVE_COMMENTS_ENABLED is set, see the README.
+@app.route("/api/comments/<int:media_id>/live")
+def stream_comments(media_id):
+    if not app.config["LIVE_COMMENTS_ENABLED"]:
+        abort(404)
+    try:
+        last_id = int(request.headers.get("Last-Event-ID") or request.args.get("after", 0))
+    except ValueError:
+        return jsonify(success=False, message="Invalid event id"), 400
+
+    stream = comment_stream(media_id, last_id, app.config["LIVE_KEEPALIVE_SECONDS"],
+                            app.config["LIVE_STREAM_SECONDS"])
+    return Response(
+        stream_with_context(stream),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/api/timeline/<int:media_id>")
+def get_emoji_timeline(media_id):
+    return jsonify(get_timeline(media_id))
+
 @app.route("/search_gifs")
 def search_gifs():
     query = request.args.get("q")
@@ -763,6 +932,51 @@ def logout():
     return redirect(url_for("login"))
 
 
+# Backfill missing/stale emoji summaries in batched model calls (e.g. after an import)
+@app.cli.command("refresh-summaries")
+@click.option("--limit", type=int, default=None, help="Max media items to refresh.")
+def refresh_summaries_command(limit):
+    refreshed = refresh_stale_summaries(limit=limit)
+    click.echo(f"Refreshed {refreshed} emoji summaries.")
+
+
+# Recompute per-bucket emoji timelines from existing comments
+@app.cli.command("rebuild-timeline")
+@click.option("--episode-id", type=int, default=None, help="Only rebuild this media item.")
+def rebuild_timeline_command(episode_id):
+    rows = rebuild_timeline(episode_id)
+    click.echo(f"Rebuilt {rows} timeline buckets.")
+
+
+# Recompute comment density buckets from existing comments
+@app.cli.command("rebuild-comment-counts")
+@click.option("--episode-id", type=int, default=None, help="Only rebuild this media item.")
+def rebuild_comment_counts_command(episode_id):
+    rows = rebuild_comment_counts(episode_id)
+    click.echo(f"Rebuilt {rows} comment count buckets.")
+
+
+# Compare comment density buckets against the comment table
+@app.cli.command("check-comment-counts")
+@click.option("--episode-id", type=int, default=None, help="Only check this media item.")
+@click.option("--fix", is_flag=True, help="Rebuild the media items that disagree.")
+def check_comment_counts_command(episode_id, fix):
+    mismatches = check_comment_counts(episode_id)
+    for ep, bucket, expected, stored in mismatches:
+        click.echo(f"episode {ep} bucket {bucket}: expected {expected}, stored {stored}")
+
+    if not mismatches:
+        click.echo("Comment counts are consistent.")
+        return
+    if not fix:
+        raise SystemExit(1)
+
+    episodes = sorted({ep for ep, *_ in mismatches})
+    for ep in episodes:
+        rebuild_comment_counts(ep)
+    click.echo(f"Rebuilt {len(episodes)} media items.")
+
+
 @app.route("/update_server", methods=["POST"])
 def webhook():
     if request.method == "POST":
@@ -1,13 +1,36 @@
 import os
+import re
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 import sqlite3
 
+from app.models import db, Comment, EmojiSummary
+from app.sentiment import local_summary
+
 load_dotenv()
 
-# Fetches timestamped comments for given episode/movie from SQLite database.
-def get_comments(media_id, db_path=None):
+# Upper bound on prompt tokens packed into a single batch summarization request
+BATCH_TOKEN_BUDGET = 30000
+# Give up on a single Gemini summary call after this long (milliseconds)
+GENAI_TIMEOUT_MS = int(os.getenv("GENAI_TIMEOUT_MS", 10000))
+
+# Token budget for the comment digest sent to the model per media item
+DIGEST_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", 4000))
+# Width of the runtime buckets comments are grouped into for the digest
+DIGEST_BUCKET_SECONDS = 60
+# Longer comments are cut down so one of them cannot take the whole budget
+DIGEST_MAX_COMMENT_CHARS = 280
+
+
+# Fetches timestamped comments for given episode/movie from SQLite database,
+# condensed into a digest that fits the token budget.
+def get_comments(media_id, db_path=None, token_budget=DIGEST_TOKEN_BUDGET):
     # Determine path to database
     if not db_path:
         db_path = os.path.join(os.path.dirname(
@@ -20,10 +43,10 @@ def get_comments(media_id, db_path=None):
     # query all comments of episode/movie, sorted by time
     cursor.execute(
         """
-        SELECT timestamp, content
+        SELECT timestamp, content, created_at
         FROM comment
         WHERE episode_id = ?
-        ORDER BY timestamp ASC
+        ORDER BY timestamp ASC, id ASC
     """,
         (media_id,),
     )
@@ -34,27 +57,87 @@ def get_comments(media_id, db_path=None):
     if not comments:
         return ""
 
-    formatted = []
-    for seconds, content in comments:
-        seconds = int(seconds)
-        hours = seconds // 3600
-        minutes = (seconds % 3600) // 60
-        secs = seconds % 60
+    return build_comment_digest(comments, token_budget)
+
+
+# Format seconds as [MM:SS] or [HH:MM:SS]
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    hours = seconds // 3600
+    minutes = (seconds % 3600) // 60
+    secs = seconds % 60
+
+    if hours:
+        return f"{hours:02}:{minutes:02}:{secs:02}"
+    return f"{minutes:02}:{secs:02}"
+
+
+# Key used to treat comments like "LOL!!", "lol" and "lolll" as the same text
+def normalize_comment(content):
+    text = re.sub(r"[^\w\s]", "", content.lower())
+    text = re.sub(r"(.)\1{2,}", r"\1", text)
+    return " ".join(text.split())
+
+
+# Condense (timestamp, content, created_at) rows into at most token_budget
+# tokens. Comments are bucketed by timestamp, near-duplicates within a bucket
+# are merged with a count, and buckets are filled round-robin with their most
+# recent comments first so every part of the runtime stays represented.
+# Comments that no longer fit are skipped, not the end of the digest.
+def build_comment_digest(comments, token_budget=DIGEST_TOKEN_BUDGET,
+                         bucket_seconds=DIGEST_BUCKET_SECONDS):
+    buckets = {}
+    for order, (seconds, content, created_at) in enumerate(comments):
+        content = (content or "").strip() or "(gif)"
+        if len(content) > DIGEST_MAX_COMMENT_CHARS:
+            content = content[:DIGEST_MAX_COMMENT_CHARS].rstrip() + "…"
+        bucket = buckets.setdefault(int(seconds // bucket_seconds), {})
+        key = normalize_comment(content) or content
+        if key in bucket:
+            bucket[key]["count"] += 1
+            continue
+        bucket[key] = {
+            "seconds": seconds,
+            "content": content,
+            "recency": (created_at or "", order),
+            "count": 1,
+        }
 
-        if hours:
-            timestamp = f"{hours:02}:{minutes:02}:{secs:02}"
-        else:
-            timestamp = f"{minutes:02}:{secs:02}"
+    # most recent first inside each bucket
+    ranked = [
+        sorted(bucket.values(), key=lambda c: c["recency"], reverse=True)
+        for _, bucket in sorted(buckets.items())
+    ]
 
-        formatted.append(f"[{timestamp}] {content}")
+    picked = []
+    used = 0
+    depth = 0
+    while used < token_budget and any(depth < len(bucket) for bucket in ranked):
+        for bucket in ranked:
+            if depth >= len(bucket):
+                continue
+            comment = bucket[depth]
+            suffix = f" (x{comment['count']})" if comment["count"] > 1 else ""
+            comment["line"] = f"[{format_timestamp(comment['seconds'])}] {comment['content']}{suffix}"
+            cost = estimate_tokens(comment["line"])
+            if used + cost > token_budget:
+                # a shorter comment further on may still fit
+                continue
+            picked.append(comment)
+            used += cost
+        depth += 1
 
-    return "\n".join(formatted)
+    picked.sort(key=lambda c: (c["seconds"], c["recency"][1]))
+    return "\n".join(comment["line"] for comment in picked)
 
 
 def summarize_comments(comment_block):
     # Create genAI client in function to avoid errors when testing
     api_key = os.getenv("GENAI_KEY")
-    client = genai.Client(api_key=api_key)
+    client = genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(timeout=GENAI_TIMEOUT_MS),
+    )
 
     prompt = f"""
     Analyze timestamped viewer comments on a movie or episode.
@@ -77,3 +160,316 @@ def summarize_comments(comment_block):
     )
 
     return response.text.strip()
+
+
+# Stops calling Gemini for a while after repeated failures so pages fall
+# back to local summaries instead of waiting on a degraded upstream
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, reset_seconds=60):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    # True if a call may be attempted; once reset_seconds pass one trial call is let through
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    # True while calls are refused, without using up the half-open trial call
+    def is_open(self):
+        with self._lock:
+            return (self.opened_at is not None
+                    and time.monotonic() - self.opened_at < self.reset_seconds)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+summary_breaker = CircuitBreaker()
+
+
+# Whether a Gemini call could be attempted right now
+def gemini_available():
+    return bool(os.getenv("GENAI_KEY")) and not summary_breaker.is_open()
+
+
+# Gemini summary when it is reachable, otherwise the local lexicon summary.
+# Returns (emojis, source) where source is "gemini" or "local".
+def summarize_with_fallback(comment_block):
+    if not os.getenv("GENAI_KEY") or not summary_breaker.allow():
+        return local_summary(comment_block), "local"
+
+    try:
+        emoji = summarize_comments(comment_block)
+    except Exception as e:
+        summary_breaker.record_failure()
+        print(f"Gemini summary failed, using local summary: {e}")
+        return local_summary(comment_block), "local"
+
+    summary_breaker.record_success()
+    return emoji, "gemini"
+
+
+# Fingerprint of a formatted comment block, used to tell when comments changed
+def comment_fingerprint(comment_block):
+    return hashlib.sha256(comment_block.encode("utf-8")).hexdigest()
+
+
+# Returns the emoji summary for a comment block, only calling Gemini when the
+# comments have changed since the cached summary was generated. Local fallback
+# summaries are retried against Gemini whenever it is available.
+def get_cached_summary(media_id, comment_block):
+    if not comment_block:
+        return ""
+
+    fingerprint = comment_fingerprint(comment_block)
+    cached = db.session.get(EmojiSummary, int(media_id))
+    unchanged = cached is not None and cached.comment_hash == fingerprint
+    # a local summary of the same comments can only improve once Gemini answers
+    if unchanged and (cached.source == "gemini" or not gemini_available()):
+        if cached.is_stale:
+            # comments were added and removed again, nothing to regenerate
+            cached.is_stale = False
+            db.session.commit()
+        return cached.emoji
+
+    emoji, source = summarize_with_fallback(comment_block)
+    if unchanged and source == "local":
+        # Gemini failed again, the stored local summary is still current
+        if cached.is_stale:
+            cached.is_stale = False
+            db.session.commit()
+        return cached.emoji
+
+    store_summary(media_id, fingerprint, emoji, cached, source)
+    db.session.commit()
+
+    return emoji
+
+
+# Insert or update the cached summary row, caller commits
+def store_summary(media_id, fingerprint, emoji, cached=None, source="gemini"):
+    if cached is None:
+        cached = db.session.get(EmojiSummary, int(media_id))
+    if cached is None:
+        cached = EmojiSummary(episode_id=int(media_id))
+        db.session.add(cached)
+    cached.comment_hash = fingerprint
+    cached.emoji = emoji
+    cached.source = source
+    cached.generated_at = datetime.now(timezone.utc)
+    cached.is_stale = False
+    return cached
+
+
+# Flag the cached summary as out of date, caller commits with the comment change
+def mark_summary_stale(media_id):
+    EmojiSummary.query.filter_by(episode_id=int(media_id)).update(
+        {"is_stale": True})
+
+
+# Recompute the cached summary from the comments currently in the app database
+def refresh_summary(media_id):
+    comment_block = get_comments(media_id, db.engine.url.database)
+    if not comment_block:
+        EmojiSummary.query.filter_by(episode_id=int(media_id)).delete()
+        db.session.commit()
+        return ""
+
+    return get_cached_summary(media_id, comment_block)
+
+
+# Rough prompt size estimate, Gemini averages about 4 characters per token
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+# Split {media_id: comment_block} into batches that each fit the token budget.
+# A block larger than the budget on its own gets a batch to itself.
+def pack_batches(comment_blocks, token_budget=BATCH_TOKEN_BUDGET):
+    batches = []
+    current = {}
+    used = 0
+    for media_id, comment_block in comment_blocks.items():
+        cost = estimate_tokens(comment_block)
+        if current and used + cost > token_budget:
+            batches.append(current)
+            current = {}
+            used = 0
+        current[media_id] = comment_block
+        used += cost
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+# One structured request for several media items, returns {media_id: emojis}
+# for every id the model answered
+def _summarize_batch(client, batch):
+    sections = "\n\n".join(
+        f"### {media_id}\n{comment_block}" for media_id, comment_block in batch.items()
+    )
+
+    prompt = f"""
+    Analyze timestamped viewer comments on several movies or episodes.
+
+    The comments for each item are listed under a heading with its id (e.g. ### 12345).
+    Each comment starts with a timestamp (e.g. [13:10]).
+    For each id, provide 4 emojis that represent the overall sentiment and general viewer reaction to that item.
+
+    Here are the comments:
+    {sections}
+    """
+
+    response = client.models.generate_content(
+        model="gemini-2.5-flash",
+        config=types.GenerateContentConfig(
+            system_instruction=(
+                "You are a helpful assistant. Respond with a JSON object "
+                "mapping each id to a string of exactly 4 emojis"
+            ),
+            response_mime_type="application/json",
+        ),
+        contents=prompt,
+    )
+
+    data = json.loads(response.text)
+    if not isinstance(data, dict):
+        raise ValueError("batch summary response is not a JSON object")
+
+    summaries = {}
+    for media_id in batch:
+        emoji = data.get(str(media_id))
+        if isinstance(emoji, str) and emoji.strip():
+            summaries[media_id] = emoji.strip()
+    return summaries
+
+
+# Retry each half of a batch separately
+def _split_and_retry(client, batch):
+    items = list(batch.items())
+    half = len(items) // 2
+    summaries = _summarize_with_split(client, dict(items[:half]))
+    summaries.update(_summarize_with_split(client, dict(items[half:])))
+    return summaries
+
+
+# Summarize a batch, retrying unanswered ids and splitting failed batches in
+# half. Every call goes through summary_breaker, once it opens the rest of
+# the batch is given up on.
+def _summarize_with_split(client, batch):
+    if not summary_breaker.allow():
+        return {}
+    try:
+        summaries = _summarize_batch(client, batch)
+    except Exception as e:
+        summary_breaker.record_failure()
+        if len(batch) == 1:
+            print(f"failed to summarize comments for {next(iter(batch))}: {e}")
+            return {}
+        return _split_and_retry(client, batch)
+
+    summary_breaker.record_success()
+    missing = {media_id: block for media_id, block in batch.items() if media_id not in summaries}
+    if not missing:
+        return summaries
+
+    if len(missing) < len(batch):
+        summaries.update(_summarize_with_split(client, missing))
+    elif len(batch) > 1:
+        summaries.update(_split_and_retry(client, batch))
+    else:
+        print(f"no summary returned for {next(iter(batch))}")
+    return summaries
+
+
+# Summarize many comment blocks with as few model calls as the token budget
+# allows. Ids missing from the result could not be summarized by Gemini.
+def summarize_comments_batch(comment_blocks, token_budget=BATCH_TOKEN_BUDGET):
+    if not comment_blocks or not os.getenv("GENAI_KEY"):
+        return {}
+
+    api_key = os.getenv("GENAI_KEY")
+    client = genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(timeout=GENAI_TIMEOUT_MS),
+    )
+
+    summaries = {}
+    for batch in pack_batches(comment_blocks, token_budget):
+        summaries.update(_summarize_with_split(client, batch))
+    return summaries
+
+
+# Backfill every missing or stale summary in batches, falling back to local
+# summaries for whatever Gemini could not answer. Returns how many were stored.
+def refresh_stale_summaries(limit=None, token_budget=BATCH_TOKEN_BUDGET):
+    wanted = [EmojiSummary.episode_id.is_(None), EmojiSummary.is_stale.is_(True)]
+    # local summaries of unchanged comments can only be replaced by Gemini
+    if gemini_available():
+        wanted.append(EmojiSummary.source != "gemini")
+    # missing first, then stale, so --limit reaches them before local rows
+    priority = db.case(
+        (EmojiSummary.episode_id.is_(None), 0),
+        (EmojiSummary.is_stale.is_(True), 1),
+        else_=2,
+    )
+    query = (
+        db.session.query(Comment.episode_id)
+        .outerjoin(EmojiSummary, EmojiSummary.episode_id == Comment.episode_id)
+        .filter(db.or_(*wanted))
+        .group_by(Comment.episode_id)
+        .order_by(priority, Comment.episode_id)
+    )
+    if limit:
+        query = query.limit(limit)
+    media_ids = [media_id for (media_id,) in query.all()]
+
+    db_path = db.engine.url.database
+    comment_blocks = {}
+    fingerprints = {}
+    for media_id in media_ids:
+        comment_block = get_comments(media_id, db_path)
+        fingerprint = comment_fingerprint(comment_block)
+        cached = db.session.get(EmojiSummary, media_id)
+        if (cached and cached.comment_hash == fingerprint
+                and (cached.source == "gemini" or not gemini_available())):
+            cached.is_stale = False
+            continue
+        comment_blocks[media_id] = comment_block
+        fingerprints[media_id] = fingerprint
+
+    summaries = summarize_comments_batch(comment_blocks, token_budget)
+    stored = 0
+    for media_id, comment_block in comment_blocks.items():
+        if media_id in summaries:
+            store_summary(media_id, fingerprints[media_id], summaries[media_id])
+            stored += 1
+            continue
+        cached = db.session.get(EmojiSummary, media_id)
+        if cached and cached.comment_hash == fingerprints[media_id]:
+            # the local summary of these comments is already stored
+            cached.is_stale = False
+            continue
+        store_summary(media_id, fingerprints[media_id], local_summary(comment_block),
+                      cached, source="local")
+        stored += 1
+    db.session.commit()
+
+    return stored
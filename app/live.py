@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+from app.comments import serialize_comment
+from app.models import db, Comment
+
+# Recent comments kept per media item for clients resuming a stream
+LIVE_BUFFER_SIZE = 200
+# Media items with a buffer, least recently used ones are dropped first
+LIVE_MAX_CHANNELS = 1000
+# Seconds between keepalive lines on an idle stream
+LIVE_KEEPALIVE_SECONDS = 15
+# Seconds a stream stays open before the client is told to reconnect, so a
+# tab left open never holds a worker for long
+LIVE_STREAM_SECONDS = 30
+
+
+class _Channel:
+    def __init__(self, lock, size, floor):
+        self.events = deque(maxlen=size)  # (comment_id, payload)
+        # comments with ids at or below floor may be missing from events
+        self.floor = floor
+        self.changed = threading.Condition(lock)
+
+
+# Fans new comments out to every viewer of a media item from one in-process
+# buffer, so connected clients never poll the database. Event ids are comment
+# ids, which lets a reconnecting client resume from Last-Event-ID. Only sees
+# comments posted to this process.
+class CommentBroadcaster:
+    def __init__(self, app=None, buffer_size=LIVE_BUFFER_SIZE, max_channels=LIVE_MAX_CHANNELS):
+        self.buffer_size = buffer_size
+        self.max_channels = max_channels
+        self._lock = threading.Lock()
+        self._channels = OrderedDict()  # episode_id -> _Channel
+        self._last_id = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    # Anything already in the database was never buffered here
+    # LIVE_COMMENTS_ENABLED is off by default: every open stream holds a web
+    # worker, so it needs a threaded or async worker class
+    def init_app(self, app):
+        app.config.setdefault("LIVE_COMMENTS_ENABLED", False)
+        app.config.setdefault("LIVE_KEEPALIVE_SECONDS", LIVE_KEEPALIVE_SECONDS)
+        app.config.setdefault("LIVE_STREAM_SECONDS", LIVE_STREAM_SECONDS)
+        with app.app_context():
+            last_id = db.session.query(db.func.max(Comment.id)).scalar() or 0
+        with self._lock:
+            self._channels.clear()
+            self._last_id = last_id
+
+    # Newest comment id this process knows about, pages hand it to the stream
+    def last_id(self):
+        return self._last_id
+
+    def _channel(self, episode_id):
+        channel = self._channels.get(episode_id)
+        if channel is None:
+            channel = _Channel(self._lock, self.buffer_size, self._last_id)
+            self._channels[episode_id] = channel
+            if len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        else:
+            self._channels.move_to_end(episode_id)
+        return channel
+
+    def publish(self, episode_id, event_id, payload):
+        with self._lock:
+            channel = self._channel(int(episode_id))
+            if len(channel.events) == channel.events.maxlen:
+                channel.floor = max(channel.floor, channel.events[0][0])
+            channel.events.append((event_id, payload))
+            self._last_id = max(self._last_id, event_id)
+            channel.changed.notify_all()
+
+    # Buffered events for episode_id newer than last_id, waiting up to timeout
+    # seconds for one to arrive. Returns None when the buffer no longer reaches
+    # back to last_id and the caller has to catch up from the database.
+    def events_after(self, episode_id, last_id, timeout=None):
+        with self._lock:
+            channel = self._channel(int(episode_id))
+            if last_id < channel.floor:
+                return None
+            channel.changed.wait_for(
+                lambda: channel.events and channel.events[-1][0] > last_id, timeout)
+            return [event for event in channel.events if event[0] > last_id]
+
+    # Oldest id events_after can resume from without the database
+    def floor(self, episode_id):
+        with self._lock:
+            return self._channel(int(episode_id)).floor
+
+
+# pending_id names the placeholder a write-behind comment replaces
+def publish_comment(comment, pending_id=None):
+    publish_serialized(comment.episode_id, serialize_comment(comment), pending_id)
+
+
+# Same for a comment already turned into its payload by serialize_comment
+def publish_serialized(episode_id, payload, pending_id=None):
+    if pending_id:
+        payload["pending_id"] = pending_id
+    live_comments.publish(episode_id, payload["id"], payload)
+
+
+# Comments the buffer has lost, straight from the comment table
+def _missed_comments(episode_id, last_id, limit=LIVE_BUFFER_SIZE):
+    rows = (
+        Comment.query.options(db.joinedload(Comment.user))
+        .filter(Comment.episode_id == episode_id, Comment.id > last_id)
+        .order_by(Comment.id)
+        .limit(limit)
+        .all()
+    )
+    return [(c.id, serialize_comment(c)) for c in rows]
+
+
+def format_event(event_id, payload):
+    return f"id: {event_id}\nevent: comment\ndata: {json.dumps(payload)}\n\n"
+
+
+# Server-Sent Events for episode_id starting after comment last_id.
+# Yields keepalive comments while idle so proxies keep the connection open,
+# and ends after `duration` seconds; EventSource then reconnects and resumes
+# from Last-Event-ID.
+def comment_stream(episode_id, last_id, keepalive=LIVE_KEEPALIVE_SECONDS,
+                   duration=LIVE_STREAM_SECONDS):
+    deadline = time.monotonic() + duration
+    yield "retry: 3000\n\n"
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        events = live_comments.events_after(episode_id, last_id, min(keepalive, remaining))
+        if events is None:
+            floor = live_comments.floor(episode_id)
+            events = _missed_comments(episode_id, last_id)
+            if not events:
+                last_id = max(last_id, floor)
+                continue
+
+        if not events:
+            yield ": keepalive\n\n"
+            continue
+
+        for event_id, payload in events:
+            if event_id > last_id:
+                yield format_event(event_id, payload)
+                last_id = event_id
+
+
+live_comments = CommentBroadcaster()
@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, g
+
+# Idle read connections kept per media.db file
+MEDIA_POOL_SIZE = 8
+# Page cache per connection in KiB (negative cache_size) and memory-mapped I/O
+MEDIA_CACHE_KIB = 16384
+MEDIA_MMAP_BYTES = 256 * 1024 * 1024
+
+
+# Identifies one version of media.db. The inode changes when the daily
+# rebuild swaps in a new file, mtime and size when pages get cached into it.
+def media_stamp(path):
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+# Version of the media.db in use, for caches built from it
+def media_version():
+    return media_stamp(current_app.config["MEDIA_DB_PATH"])
+
+
+# Read-only connections to media.db shared between requests. A request
+# borrows one on first use (g.media_db) and hands it back on teardown, so
+# connection setup and a warm page cache carry over between requests.
+# Connections to a file that has since been replaced are closed, not reused.
+class MediaDB:
+    def __init__(self, app=None, pool_size=MEDIA_POOL_SIZE):
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._idle = {}  # path -> [(inode, connection), ...]
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("MEDIA_DB_POOL_SIZE", self.pool_size)
+        # give connections back when the request ends, or with the app
+        # context for work outside a request
+        app.teardown_request(self._teardown)
+        app.teardown_appcontext(self._teardown)
+
+    def _open(self, path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA cache_size = -{MEDIA_CACHE_KIB}")
+        conn.execute(f"PRAGMA mmap_size = {MEDIA_MMAP_BYTES}")
+        return conn
+
+    # The request's read-only connection to media.db
+    def connection(self):
+        if "media_db" in g:
+            return g.media_db[1]
+
+        path = current_app.config["MEDIA_DB_PATH"]
+        inode = media_stamp(path)[0]
+        conn = None
+        with self._lock:
+            idle = self._idle.get(path, [])
+            while idle:
+                idle_inode, idle_conn = idle.pop()
+                if idle_inode == inode:
+                    conn = idle_conn
+                    break
+                idle_conn.close()
+
+        if conn is None:
+            conn = self._open(path)
+        g.media_db = (path, conn, inode)
+        return conn
+
+    def _teardown(self, exc):
+        borrowed = g.pop("media_db", None)
+        if borrowed is None:
+            return
+
+        path, conn, inode = borrowed
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            idle = self._idle.setdefault(path, [])
+            if len(idle) < current_app.config["MEDIA_DB_POOL_SIZE"]:
+                idle.append((inode, conn))
+                return
+        conn.close()
+
+    # Close every idle connection, e.g. after media.db was rebuilt
+    def close_idle(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, conn in connections:
+                conn.close()
+
+    # A short-lived read-write connection for caching API results into media.db
+    @contextmanager
+    def writer(self):
+        conn = sqlite3.connect(current_app.config["MEDIA_DB_PATH"], timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+
+media_db = MediaDB()
+
+
+# Rows as dicts for templates and JSON
+def fetch_all(query, params=()):
+    return [dict(row) for row in media_db.connection().execute(query, params).fetchall()]
+
+
+def fetch_one(query, params=()):
+    row = media_db.connection().execute(query, params).fetchone()
+    return dict(row) if row is not None else None
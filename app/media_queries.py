@@ -0,0 +1,112 @@
+import json
+
+from app.media_db import fetch_all, fetch_one, media_version
+
+# Every media.db lookup the site makes. Values are always bound with ?, so
+# each query is one prepared statement that SQLite's statement cache reuses.
+MEDIA_COLUMNS = "tmdb_id, title, media_type, poster_url, overview, release_date, runtime, vote_average"
+SEASON_COLUMNS = ("season_id, tv_id, title, season_number, name, overview, poster_url, "
+                  "air_date, episode_count, vote_average")
+EPISODE_COLUMNS = ("episode_id, season_id, tv_id, season_number, episode_number, episode_name, "
+                   "overview, air_date, runtime, vote_average, still_url")
+ANIME_COLUMNS = ("anilist_id, title_romaji, title_english, episodes, average_score, trending, "
+                 "genres, description, cover_url, start_date")
+ANIME_EP_COLUMNS = "episode_id, anilist_id, episode_title, thumbnail, duration"
+FEATURED_COLUMNS = "tmdb_id, title, poster_url, overview, rank"
+
+MEDIA_BY_ID = f"SELECT {MEDIA_COLUMNS} FROM media WHERE tmdb_id = ?"
+MOVIE_BY_ID = f"SELECT {MEDIA_COLUMNS} FROM media WHERE tmdb_id = ? AND media_type = 'movie'"
+MEDIA_BY_IDS = f"SELECT {MEDIA_COLUMNS} FROM media WHERE tmdb_id IN (SELECT value FROM json_each(?))"
+EPISODE_BY_ID = f"SELECT {EPISODE_COLUMNS} FROM episodes WHERE episode_id = ?"
+ANIME_BY_ID = f"SELECT {ANIME_COLUMNS} FROM anime WHERE anilist_id = ?"
+ANIME_BY_IDS = (f"SELECT {ANIME_COLUMNS}, 'anime' AS media_type FROM anime "
+                "WHERE anilist_id IN (SELECT value FROM json_each(?))")
+TRENDING_ANIME = f"SELECT {ANIME_COLUMNS} FROM anime ORDER BY trending DESC LIMIT ?"
+ANIME_EPISODES = f"SELECT {ANIME_EP_COLUMNS} FROM anime_ep WHERE anilist_id = ?"
+ANIME_EPISODE_BY_ID = f"SELECT {ANIME_EP_COLUMNS} FROM anime_ep WHERE episode_id = ?"
+
+# A show's seasons with their episodes in one pass, episode columns prefixed ep_
+SHOW_TREE = (
+    "SELECT " + ", ".join(f"s.{c}" for c in SEASON_COLUMNS.split(", ")) + ", "
+    + ", ".join(f"e.{c} AS ep_{c}" for c in EPISODE_COLUMNS.split(", "))
+    + " FROM seasons s LEFT JOIN episodes e ON e.season_id = s.season_id"
+    " WHERE s.tv_id = ? ORDER BY s.season_number, s.season_id, e.episode_number"
+)
+
+FEATURED_MOVIES = f"SELECT {FEATURED_COLUMNS} FROM featured_movies ORDER BY rank ASC LIMIT ?"
+FEATURED_TV = f"SELECT {FEATURED_COLUMNS} FROM featured_tv ORDER BY rank ASC LIMIT ?"
+
+
+def get_media(tmdb_id):
+    return fetch_one(MEDIA_BY_ID, (tmdb_id,))
+
+
+def get_movie(tmdb_id):
+    return fetch_one(MOVIE_BY_ID, (tmdb_id,))
+
+
+# A list of ids is bound as one JSON array so every length shares a statement
+def media_by_ids(tmdb_ids):
+    return fetch_all(MEDIA_BY_IDS, (json.dumps(list(tmdb_ids)),))
+
+
+# Show trees kept per tv_id until media.db changes
+SHOW_TREE_CACHE_SIZE = 256
+_show_trees = {}  # tv_id -> (media version, seasons)
+
+
+# Seasons of a show in order, each with an "episodes" list. The result is
+# shared between requests, callers must not modify it.
+def get_show_tree(tv_id):
+    version = media_version()
+    cached = _show_trees.get(tv_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    season_columns = SEASON_COLUMNS.split(", ")
+    episode_columns = EPISODE_COLUMNS.split(", ")
+    seasons = []
+    for row in fetch_all(SHOW_TREE, (tv_id,)):
+        if not seasons or seasons[-1]["season_id"] != row["season_id"]:
+            season = {c: row[c] for c in season_columns}
+            season["episodes"] = []
+            seasons.append(season)
+        if row["ep_episode_id"] is not None:
+            seasons[-1]["episodes"].append({c: row[f"ep_{c}"] for c in episode_columns})
+
+    if tv_id not in _show_trees and len(_show_trees) >= SHOW_TREE_CACHE_SIZE:
+        _show_trees.pop(next(iter(_show_trees)), None)
+    _show_trees[tv_id] = (version, seasons)
+    return seasons
+
+
+def get_episode(episode_id):
+    return fetch_one(EPISODE_BY_ID, (episode_id,))
+
+
+def get_anime(anilist_id):
+    return fetch_one(ANIME_BY_ID, (anilist_id,))
+
+
+def anime_by_ids(anilist_ids):
+    return fetch_all(ANIME_BY_IDS, (json.dumps(list(anilist_ids)),))
+
+
+def trending_anime(limit=10):
+    return fetch_all(TRENDING_ANIME, (limit,))
+
+
+def get_anime_episodes(anilist_id):
+    return fetch_all(ANIME_EPISODES, (anilist_id,))
+
+
+def get_anime_episode(episode_id):
+    return fetch_one(ANIME_EPISODE_BY_ID, (episode_id,))
+
+
+def featured_movies(limit=50):
+    return fetch_all(FEATURED_MOVIES, (limit,))
+
+
+def featured_tv(limit=10):
+    return fetch_all(FEATURED_TV, (limit,))
@@ -33,6 +33,48 @@ class Comment(db.Model):
 
     user = db.relationship("User", backref="comments")
 
+    # media pages read comments by episode in timestamp order
+    __table_args__ = (
+        db.Index("ix_comment_episode_timestamp", "episode_id", "timestamp"),
+    )
+
+
+# Cached Gemini emoji summary for an episode/movie, keyed by a hash of its comments
+class EmojiSummary(db.Model):
+    episode_id = db.Column(db.Integer, primary_key=True)
+    comment_hash = db.Column(db.String(64), nullable=False)
+    emoji = db.Column(db.String(64), nullable=False)
+    generated_at = db.Column(
+        db.DateTime, default=lambda: datetime.now(timezone.utc))
+    is_stale = db.Column(db.Boolean, default=False, nullable=False)
+    source = db.Column(db.String(10), default="gemini", nullable=False)  # gemini or local
+
+    def __repr__(self):
+        return f"EmojiSummary(Episode: {self.episode_id}, Emoji: {self.emoji})"
+
+
+# Running count of comments per (episode, runtime bucket, sentiment category)
+class SentimentBucket(db.Model):
+    episode_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.Integer, primary_key=True)  # index into sentiment.CATEGORIES
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+
+# Running count of comments per (episode, runtime bucket), see comments.py
+class CommentBucketCount(db.Model):
+    episode_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+
+# Highest write-behind spool row already copied into the comment table,
+# committed together with the copied comments, see comment_spool.py
+class SpoolCheckpoint(db.Model):
+    name = db.Column(db.String(32), primary_key=True)
+    last_id = db.Column(db.Integer, default=0, nullable=False)
+
+
 class Favorite(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -52,4 +94,27 @@ class History(db.Model):
     user = db.relationship("User", backref="history_entries")
 
     def __repr__(self):
-        return f"History(User: {self.user_id}, Media: {self.title}, Type: {self.media_type}, Watched: {self.watched_at})"
\ No newline at end of file
+        return f"History(User: {self.user_id}, Media: {self.title}, Type: {self.media_type}, Watched: {self.watched_at})"
+
+
+# db.create_all() only creates missing tables, so an existing site.db never
+# picks up indexes or columns added to tables it already has. Add them here.
+def upgrade_schema(engine):
+    inspector = db.inspect(engine)
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    default = column.default.arg
+                    ddl += f" DEFAULT {int(default) if isinstance(default, bool) else repr(default)}"
+                conn.exec_driver_sql(ddl)
+
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+# Requests per second allowed to each upstream before its headers say
+# otherwise, and the floor adaptive slow-downs stop at
+HOST_RATES = {
+    "api.themoviedb.org": 40,
+    "graphql.anilist.co": 1.5,  # 90 per minute
+    "tenor.googleapis.com": 10,
+}
+DEFAULT_RATE = 5
+MIN_RATE = 0.1
+# Pause when a 429 carries no Retry-After, and the longest pause honoured
+DEFAULT_RETRY_AFTER = 5
+MAX_RETRY_AFTER = 300
+# Below this share of the window left, slow down before the upstream refuses
+LOW_REMAINING = 0.1
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Seconds to wait from a Retry-After header (delay-seconds or an HTTP date)
+def retry_after_seconds(value, now=None):
+    seconds = _number(value)
+    if seconds is None and value:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - (now or time.time())
+        except (TypeError, ValueError):
+            seconds = None
+    if seconds is None:
+        return None
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+# Token bucket shared by every thread and coroutine calling one upstream.
+# acquire() / acquire_async() wait until a request may go out, so all callers
+# together stay under `rate` requests per second, with bursts of up to `burst`.
+# update(response) adapts the rate to what the upstream reports: a 429 or an
+# exhausted X-RateLimit-Remaining halves it and pauses for Retry-After (or
+# until X-RateLimit-Reset), a nearly exhausted window slows it down, and
+# successful responses grow it back towards max_rate.
+class RateLimiter:
+    def __init__(self, rate, burst=None, min_rate=MIN_RATE):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst if burst is not None else max(1, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    # Take a token, or return how long to wait before trying again
+    def _take(self):
+        with self._lock:
+            now = self._refill()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    # Wait for a token and return True. With a timeout, return False instead
+    # of waiting longer than that (e.g. while paused by a long Retry-After).
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    # Hold every caller back for `seconds`
+    def pause(self, seconds):
+        with self._lock:
+            now = self._refill()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0
+
+    def _slow_down(self, factor):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * factor)
+
+    def _speed_up(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1)
+
+    def update(self, response):
+        headers = response.headers
+        remaining = _number(headers.get("X-RateLimit-Remaining"))
+        limit = _number(headers.get("X-RateLimit-Limit"))
+
+        if response.status_code == 429 or remaining == 0:
+            self._slow_down(0.5)
+            wait = retry_after_seconds(headers.get("Retry-After"))
+            reset = _number(headers.get("X-RateLimit-Reset"))
+            if wait is None and reset is not None:
+                wait = min(max(reset - time.time(), 0), MAX_RETRY_AFTER)
+            self.pause(DEFAULT_RETRY_AFTER if wait is None else wait)
+        elif remaining is not None and limit and remaining / limit < LOW_REMAINING:
+            self._slow_down(0.75)
+        elif response.ok:
+            self._speed_up()
+
+
+# One limiter per upstream host, created on first use
+class HostLimiters:
+    def __init__(self, rates=None, default_rate=DEFAULT_RATE):
+        self.rates = dict(rates or {})
+        self.default_rate = default_rate
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        host = urlsplit(url).hostname if "//" in url else url
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = RateLimiter(self.rates.get(host, self.default_rate))
+                self._limiters[host] = limiter
+            return limiter
+
+    # Replace a host's limiter, e.g. with a rate from the environment
+    def configure(self, host, rate, burst=None):
+        with self._lock:
+            self.rates[host] = rate
+            self._limiters[host] = limiter = RateLimiter(rate, burst)
+            return limiter
+
+
+host_limiters = HostLimiters(HOST_RATES)
+
+
+# requests.get / requests.post through the upstream's limiter. A 429 is
+# retried up to `retries` times once the limiter's pause is over; the last
+# response is returned either way. With max_wait, None is returned instead
+# of waiting longer than that many seconds for the limiter.
+def limited_request(method, url, retries=2, max_wait=None, **kwargs):
+    limiter = host_limiters.get(url)
+    send = requests.get if method == "GET" else requests.post
+    response = None
+    for attempt in range(retries + 1):
+        if not limiter.acquire(max_wait):
+            break
+        response = send(url, **kwargs)
+        limiter.update(response)
+        if response.status_code != 429:
+            break
+    return response
+
+
+def limited_get(url, retries=2, max_wait=None, **kwargs):
+    return limited_request("GET", url, retries, max_wait, **kwargs)
+
+
+def limited_post(url, retries=2, max_wait=None, **kwargs):
+    return limited_request("POST", url, retries, max_wait, **kwargs)
@@ -0,0 +1,110 @@
+import re
+import numpy as np
+
+# Local, offline emoji summaries used when Gemini is unavailable.
+# Each category has an emoji and the words/emojis that count towards it.
+CATEGORIES = [
+    ("😂", ["lol", "lmao", "lmfao", "haha", "hahaha", "funny", "hilarious", "dead",
+           "joke", "laughing", "😂", "🤣", "💀"]),
+    ("😍", ["love", "loved", "beautiful", "cute", "wholesome", "adorable", "gorgeous",
+           "perfect", "masterpiece", "❤", "😍", "🥰"]),
+    ("😱", ["omg", "wtf", "twist", "shocked", "shocking", "insane", "crazy", "wow",
+           "whoa", "unexpected", "plot", "😱", "😮", "🤯"]),
+    ("😢", ["sad", "cry", "crying", "cried", "tears", "rip", "heartbreaking",
+           "miss", "depressing", "😢", "😭", "💔"]),
+    ("😡", ["hate", "worst", "terrible", "awful", "stupid", "annoying", "trash",
+           "angry", "ugh", "😡", "🤬", "👎"]),
+    ("🔥", ["fire", "hype", "hyped", "epic", "goat", "banger", "amazing", "awesome",
+           "best", "great", "incredible", "🔥", "👏", "🙌"]),
+    ("🤔", ["confused", "confusing", "why", "huh", "lost", "weird", "strange",
+           "theory", "wait", "🤔", "❓"]),
+    ("😴", ["boring", "bored", "slow", "sleep", "sleepy", "meh", "dragging",
+           "filler", "😴", "🥱"]),
+]
+CATEGORY_EMOJIS = [emoji for emoji, _ in CATEGORIES]
+
+# Shown when no comment matches any category
+NEUTRAL_SUMMARY = "🍿🍿🍿🍿"
+
+# token -> category index
+LEXICON = {word: index for index, (_, words) in enumerate(CATEGORIES) for word in words}
+
+TOKEN_PATTERN = re.compile(r"[a-z']+|[^\w\s]")
+DIGEST_LINE = re.compile(r"^\[[\d:]+\]\s*(.*?)(?:\s\(x(\d+)\))?$")
+
+
+# Split a digest/comment block into per-comment text and weight.
+# Digest lines look like "[05:00] lol (x12)"; plain text lines count once.
+def parse_comment_block(comment_block):
+    texts = []
+    weights = []
+    for line in comment_block.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = DIGEST_LINE.match(line)
+        if match:
+            texts.append(match.group(1))
+            weights.append(int(match.group(2) or 1))
+        else:
+            texts.append(line)
+            weights.append(1)
+    return texts, weights
+
+
+# Weighted hit count per category over all comments
+def score_comments(texts, weights=None):
+    if weights is None:
+        weights = [1] * len(texts)
+
+    tokens = []
+    token_weights = []
+    for text, weight in zip(texts, weights):
+        found = TOKEN_PATTERN.findall(text.lower())
+        tokens.extend(found)
+        token_weights.extend([weight] * len(found))
+
+    if not tokens:
+        return np.zeros(len(CATEGORIES))
+
+    # Look up each distinct token once, then map back to every occurrence
+    vocab, inverse = np.unique(np.array(tokens), return_inverse=True)
+    vocab_category = np.array([LEXICON.get(token, -1) for token in vocab])
+    token_category = vocab_category[inverse]
+
+    matched = token_category >= 0
+    return np.bincount(
+        token_category[matched],
+        weights=np.asarray(token_weights, dtype=float)[matched],
+        minlength=len(CATEGORIES),
+    )
+
+
+# Share 4 emoji slots between categories in proportion to their scores
+def scores_to_emojis(scores, slots=4):
+    total = scores.sum()
+    if total <= 0:
+        return NEUTRAL_SUMMARY
+
+    shares = scores / total * slots
+    counts = np.floor(shares).astype(int)
+    # hand leftover slots to the largest remainders
+    leftover = slots - counts.sum()
+    if leftover:
+        order = np.argsort(-(shares - counts), kind="stable")
+        counts[order[:leftover]] += 1
+
+    ranked = np.argsort(-scores, kind="stable")
+    return "".join(CATEGORY_EMOJIS[i] * int(counts[i]) for i in ranked if counts[i])
+
+
+# 4-emoji summary of a comment block computed entirely on this machine
+def local_summary(comment_block):
+    texts, weights = parse_comment_block(comment_block)
+    return scores_to_emojis(score_comments(texts, weights))
+
+
+# Distinct category indexes a single comment matches
+def comment_categories(text):
+    tokens = TOKEN_PATTERN.findall((text or "").lower())
+    return sorted({LEXICON[token] for token in tokens if token in LEXICON})
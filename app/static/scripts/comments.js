@@ -64,9 +64,12 @@ document.addEventListener("DOMContentLoaded", () => {
     scrollToBottomIfAllowed();
   });
 
-  const comments = container.querySelectorAll(".comment-line, .comment");
-  comments.forEach((comment) => {
-    observer.observe(comment, { attributes: true, attributeFilter: ["data-hidden", "style"] });
+  // Comments are added as playback advances, so watch the whole feed
+  observer.observe(container, {
+    childList: true,
+    subtree: true,
+    attributes: true,
+    attributeFilter: ["data-hidden", "style"],
   });
 });
 
@@ -12,6 +12,7 @@ document.addEventListener('DOMContentLoaded', () => {
   const skipBackBtn = document.getElementById('skip-back');
   const skipForwardBtn = document.getElementById('skip-forward');
   const comments = document.getElementById('comments-container');
+  const timelineEmoji = document.getElementById('timeline-emoji');
 
   if (!bar || !barFill) return;
 
@@ -25,6 +26,22 @@ document.addEventListener('DOMContentLoaded', () => {
   let playing = false;
   let watchedTimeThisSession = 0;
   const WATCH_TIME_UPDATE_INTERVAL = 10;
+  let timelineBucketSeconds = 30;
+  let timelineEmojis = {};
+
+  // COMMENT WINDOWS
+  // The page only ships the opening comments. Later ones are fetched a window
+  // ahead of playback, and the feed starts over after a long seek.
+  const COMMENT_WINDOW_SECS = 120;
+  const currentUserId = comments?.dataset.currentUser || '';
+  const loadedCommentIds = new Set(
+    [...document.querySelectorAll('.comment-line')].map(el => el.dataset.commentId));
+  let pendingWindow = comments?.dataset.cursor
+    ? { from: 0, to: Number(comments.dataset.windowTo), cursor: comments.dataset.cursor }
+    : null;
+  let loadedFrom = 0;
+  let loadedTo = pendingWindow ? 0 : (Number(comments?.dataset.windowTo) || 0);
+  let windowLoading = false;
 
   const fmt = (s) => {
     const h = Math.floor(s / 3600);
@@ -35,6 +52,113 @@ document.addEventListener('DOMContentLoaded', () => {
       : `${m}:${String(sec).padStart(2, '0')}`;
   };
 
+  const fmtStamp = (s) => [Math.floor(s / 3600), Math.floor((s % 3600) / 60), Math.floor(s % 60)]
+    .map(v => String(v).padStart(2, '0'))
+    .join(':');
+
+  // Same markup as templates/comment_line.html
+  function buildComment(c) {
+    const wrapper = document.createElement('div');
+    wrapper.className = 'comment-line-wrapper';
+
+    const line = document.createElement('div');
+    line.className = 'comment-line';
+    line.dataset.secs = c.timestamp;
+    line.dataset.commentId = c.id;
+
+    const name = document.createElement('strong');
+    name.textContent = c.username;
+    const stamp = document.createElement('code');
+    stamp.textContent = fmtStamp(c.timestamp);
+    line.append(name, ' ', stamp);
+
+    if (c.content) {
+      const text = document.createElement('span');
+      text.className = 'chat-text';
+      text.textContent = `: ${c.content}`;
+      line.append(' ', text);
+    }
+
+    if (c.gif_url) {
+      const gifWrapper = document.createElement('div');
+      gifWrapper.className = 'chat-gif-wrapper';
+      const gif = document.createElement('img');
+      gif.src = c.gif_url;
+      gif.alt = 'GIF';
+      gif.className = 'comment-gif';
+      gifWrapper.appendChild(gif);
+      line.appendChild(gifWrapper);
+    }
+
+    if (currentUserId && String(c.user_id) === currentUserId) {
+      const form = document.createElement('form');
+      form.method = 'POST';
+      form.action = `/comment/${c.id}/delete`;
+      form.className = 'delete-comment-form';
+      const btn = document.createElement('button');
+      btn.type = 'submit';
+      btn.className = 'delete-comment';
+      btn.textContent = 'Ⅹ';
+      form.appendChild(btn);
+      line.appendChild(form);
+    }
+
+    wrapper.appendChild(line);
+    return wrapper;
+  }
+
+  // Insert a comment in playback order, skipping ones already shown
+  function addComment(c) {
+    if (!comments || loadedCommentIds.has(String(c.id))) return;
+    loadedCommentIds.add(String(c.id));
+
+    const node = buildComment(c);
+    const later = [...comments.querySelectorAll('.comment-line')]
+      .find(el => Number(el.dataset.secs) > c.timestamp);
+    if (later) {
+      comments.insertBefore(node, later.closest('.comment-line-wrapper'));
+    } else {
+      comments.appendChild(node);
+    }
+  }
+
+  function loadCommentWindow() {
+    if (!comments || windowLoading) return;
+
+    if (elapsed < loadedFrom || elapsed > loadedTo + COMMENT_WINDOW_SECS) {
+      // long seek: drop what is loaded and start again around the playhead
+      comments.innerHTML = '';
+      loadedCommentIds.clear();
+      loadedFrom = loadedTo = Math.max(0, elapsed - COMMENT_WINDOW_SECS);
+      pendingWindow = null;
+    }
+
+    if (!pendingWindow) {
+      if (loadedTo >= duration || loadedTo > elapsed + COMMENT_WINDOW_SECS / 2) return;
+      pendingWindow = { from: loadedTo, to: Math.max(loadedTo, elapsed) + COMMENT_WINDOW_SECS, cursor: '' };
+    }
+
+    const { from, to, cursor } = pendingWindow;
+    const params = new URLSearchParams({ from, to });
+    if (cursor) params.set('cursor', cursor);
+
+    windowLoading = true;
+    fetch(`/api/comments/${mediaId}/window?${params}`)
+      .then(res => res.json())
+      .then(data => {
+        data.comments.forEach(addComment);
+        if (data.next_cursor) {
+          pendingWindow.cursor = data.next_cursor;
+        } else {
+          loadedTo = to;
+          pendingWindow = null;
+        }
+        updateVisibleComments();
+      })
+      .catch(err => console.error("Failed to load comments:", err))
+      .finally(() => { windowLoading = false; });
+  }
+
   function updateVisibleComments() {
     document.querySelectorAll('.comment-line').forEach(comment => {
       const time = Number(comment.dataset.secs);
@@ -58,8 +182,12 @@ document.addEventListener('DOMContentLoaded', () => {
     if (tsInput) tsInput.value = fmt(elapsed);
     if (currentTimeDisplay) currentTimeDisplay.textContent = fmt(elapsed);
     if (totalTimeDisplay) totalTimeDisplay.textContent = fmt(duration);
+    if (timelineEmoji) {
+      timelineEmoji.textContent = timelineEmojis[Math.floor(elapsed / timelineBucketSeconds)] || '';
+    }
 
     updateVisibleComments();
+    loadCommentWindow();
     localStorage.setItem(STORAGE_KEY, elapsed);
     playBtn.textContent = playing ? '❚❚' : '▶';
   }
@@ -173,20 +301,83 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   });
 
-  // HEATMAP
-  fetch(`/api/comments/${mediaId}`)
-    .then(res => res.json())
-    .then(timestamps => {
-      const secondsPerBucket = 30;
-      const bucketCount = Math.min(200, Math.max(10, Math.floor(duration / secondsPerBucket)));
-      const bucketSize = duration / bucketCount;
-      const density = new Array(bucketCount).fill(0);
+  // NEW COMMENTS
+  // Comments posted after the page loaded, by this viewer or anyone else.
+  // They bump the count once and are shown if they fall in the loaded window.
+  const commentsBtnText = document.getElementById('comments-btn-text');
+  const receivedCommentIds = new Set();
+
+  function receiveComment(c) {
+    if (!comments || receivedCommentIds.has(c.id)) return;
+    receivedCommentIds.add(c.id);
+
+    if (c.pending_id && (receivedCommentIds.has(c.pending_id) || loadedCommentIds.has(c.pending_id))) {
+      // our own write-behind comment landed, swap the placeholder for it
+      comments.querySelector(`[data-comment-id="${c.pending_id}"]`)
+        ?.closest('.comment-line-wrapper')?.remove();
+      loadedCommentIds.delete(c.pending_id);
+      addComment(c);
+      updateVisibleComments();
+      return;
+    }
+
+    if (commentsBtnText) {
+      const count = Number(commentsBtnText.dataset.count || 0) + 1;
+      commentsBtnText.dataset.count = count;
+      commentsBtnText.textContent = commentsBtnText.textContent.replace(/\d+ Comments?/,
+        `${count} Comment${count === 1 ? '' : 's'}`);
+    }
+    if (c.timestamp >= loadedFrom && c.timestamp < (pendingWindow ? pendingWindow.to : loadedTo)) {
+      addComment(c);
+      updateVisibleComments();
+    }
+  }
 
-      timestamps.forEach(ts => {
-        const i = Math.floor(ts / bucketSize);
-        if (i < bucketCount) density[i]++;
-      });
+  // Post without reloading the page, the server answers with the new comment
+  const commentForm = document.querySelector('form.chat-input-form');
+  if (commentForm?.dataset.postUrl) {
+    commentForm.addEventListener('submit', (e) => {
+      e.preventDefault();
+      const body = Object.fromEntries(new FormData(commentForm));
 
+      fetch(commentForm.dataset.postUrl, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body),
+      })
+        .then(res => res.json())
+        .then(data => {
+          if (!data.success) {
+            const errors = data.errors ? Object.values(data.errors).flat() : [];
+            window.showToast?.(errors[0] || data.message || 'Could not add comment.', 'error');
+            return;
+          }
+          receiveComment(data.comment);
+          commentForm.querySelector('textarea').value = '';
+          const gifInput = commentForm.querySelector('input[name="gif_url"]');
+          if (gifInput) gifInput.value = '';
+          window.showToast?.('Comment added!', 'success');
+        })
+        .catch(err => console.error("Failed to post comment:", err));
+    });
+  }
+
+  // New comments from other viewers arrive over Server-Sent Events when the
+  // server has them enabled. Each stream ends after a while; the browser
+  // reconnects on its own and resumes from the last event id.
+  if (comments && comments.dataset.liveAfter !== undefined && window.EventSource) {
+    const live = new EventSource(
+      `/api/comments/${mediaId}/live?after=${comments.dataset.liveAfter || 0}`);
+    live.addEventListener('comment', (e) => receiveComment(JSON.parse(e.data)));
+    window.addEventListener('beforeunload', () => live.close());
+  }
+
+  // HEATMAP
+  const heatmapBuckets = Math.min(200, Math.max(10, Math.floor(duration / 30)));
+  fetch(`/api/comments/${mediaId}/heatmap?buckets=${heatmapBuckets}&duration=${duration}`)
+    .then(res => res.json())
+    .then(({ density }) => {
+      const bucketCount = density.length;
       const max = Math.max(...density, 1);
       const getGrayscale = norm => `hsl(0, 0%, ${90 - norm * 60}%)`;
       const getColor = norm => `hsl(250, 80%, ${85 - norm * 60}%)`;
@@ -203,5 +394,16 @@ document.addEventListener('DOMContentLoaded', () => {
     })
     .catch(err => console.error("Failed to load heatmap data:", err));
 
+  // EMOJI TIMELINE
+  fetch(`/api/timeline/${mediaId}`)
+    .then(res => res.json())
+    .then(data => {
+      timelineBucketSeconds = data.bucket_seconds;
+      timelineEmojis = {};
+      data.timeline.forEach(([bucket, emoji]) => { timelineEmojis[bucket] = emoji; });
+      render();
+    })
+    .catch(err => console.error("Failed to load emoji timeline:", err));
+
   render();
 });
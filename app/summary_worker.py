@@ -0,0 +1,106 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.google_ai import gemini_available, refresh_summary
+from app.models import db, EmojiSummary
+
+# Shown while the first summary for a media item is still being generated
+SUMMARY_PLACEHOLDER = "⏳"
+
+
+# Recomputes emoji summaries off the request path. Each media item has at most
+# one pending job, so a burst of comments collapses into a single recompute.
+class SummaryWorker:
+    def __init__(self, app=None, max_workers=2, debounce_seconds=5.0):
+        self.app = None
+        self.max_workers = max_workers
+        self.debounce_seconds = debounce_seconds
+        self._lock = threading.Lock()
+        self._pending = {}  # media_id -> debounce timer
+        self._executor = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault("SUMMARY_WORKER_ENABLED", True)
+        app.config.setdefault("SUMMARY_WORKERS", self.max_workers)
+        app.config.setdefault("SUMMARY_DEBOUNCE_SECONDS", self.debounce_seconds)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.app.config["SUMMARY_WORKERS"],
+                    thread_name_prefix="summary-worker",
+                )
+            return self._executor
+
+    # Queue a recompute for media_id after the debounce delay.
+    # Returns False if one is already pending or the worker is disabled.
+    def schedule(self, media_id):
+        if not self.app.config["SUMMARY_WORKER_ENABLED"]:
+            return False
+
+        media_id = int(media_id)
+        with self._lock:
+            if media_id in self._pending:
+                return False
+            timer = threading.Timer(
+                self.app.config["SUMMARY_DEBOUNCE_SECONDS"],
+                self._submit,
+                args=(media_id,),
+            )
+            timer.daemon = True
+            self._pending[media_id] = timer
+        timer.start()
+        return True
+
+    def pending(self):
+        with self._lock:
+            return set(self._pending)
+
+    def _submit(self, media_id):
+        self._get_executor().submit(self._recompute, media_id)
+
+    def _recompute(self, media_id):
+        # Clear the pending flag first so comments posted mid-recompute queue another run
+        with self._lock:
+            self._pending.pop(media_id, None)
+
+        with self.app.app_context():
+            try:
+                refresh_summary(media_id)
+            except Exception as e:
+                db.session.rollback()
+                print(f"failed to refresh summary for {media_id}: {e}")
+            finally:
+                db.session.remove()
+
+    # Run all pending jobs now on the calling thread
+    def flush(self):
+        with self._lock:
+            pending = list(self._pending.items())
+            for _, timer in pending:
+                timer.cancel()
+
+        for media_id, _ in pending:
+            self._recompute(media_id)
+
+    # Summary to render right now: last known emojis, or a placeholder while
+    # the first one is generated. Queues a refresh when missing, stale or
+    # only a local fallback that Gemini could now replace.
+    def summary_for_page(self, media_id, has_comments):
+        if not has_comments:
+            return ""
+
+        summary = db.session.get(EmojiSummary, int(media_id))
+        if (summary is None or summary.is_stale
+                or (summary.source != "gemini" and gemini_available())):
+            self.schedule(media_id)
+
+        return summary.emoji if summary else SUMMARY_PLACEHOLDER
+
+
+summary_worker = SummaryWorker()
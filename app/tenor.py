@@ -1,10 +1,14 @@
-import requests
 import os
 from dotenv import load_dotenv
 
+from app.rate_limit import limited_get
+
 # set the apikey
 load_dotenv()
 tenor_key = os.getenv("TENOR_API_KEY")
+# GIF searches run inside a page request: a 429 is not retried, and while
+# Tenor has us paused the search comes back empty instead of waiting
+TENOR_MAX_WAIT = 1
 
 def search_gif(query, limit=20, pos=None):
     if not query:
@@ -19,9 +23,9 @@ def search_gif(query, limit=20, pos=None):
         "pos": str(pos)
     }
 
-    response = requests.get(url, params=params)
+    response = limited_get(url, retries=0, max_wait=TENOR_MAX_WAIT, params=params)
 
-    if response.status_code == 200:
+    if response is not None and response.status_code == 200:
         data = response.json()
         gifs = []
         # Extract the .gif URL from each result
@@ -42,8 +46,8 @@ def featured_gifs(limit=20):
         "limit": limit
     }
 
-    response = requests.get(url, params)
-    if response.status_code == 200:
+    response = limited_get(url, retries=0, max_wait=TENOR_MAX_WAIT, params=params)
+    if response is not None and response.status_code == 200:
         data = response.json()
         links = []
         # Extract the .gif URL from each result
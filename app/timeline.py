@@ -0,0 +1,87 @@
+from sqlalchemy.dialects.sqlite import insert
+
+from app.models import db, Comment, SentimentBucket
+from app.sentiment import CATEGORY_EMOJIS, comment_categories
+
+# Width of each emoji timeline entry in seconds of runtime
+TIMELINE_BUCKET_SECONDS = 30
+
+
+def timeline_bucket(seconds):
+    return int(seconds // TIMELINE_BUCKET_SECONDS)
+
+
+# Add (or with delta=-1 remove) one comment's sentiment from its bucket.
+# Touches at most one row per matched category, caller commits.
+def _apply_comment(comment, delta):
+    bucket = timeline_bucket(comment.timestamp)
+    for category in comment_categories(comment.content):
+        if delta > 0:
+            stmt = insert(SentimentBucket).values(
+                episode_id=comment.episode_id,
+                bucket=bucket,
+                category=category,
+                count=delta,
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["episode_id", "bucket", "category"],
+                set_={"count": SentimentBucket.count + delta},
+            )
+            db.session.execute(stmt)
+        else:
+            key = dict(episode_id=comment.episode_id, bucket=bucket, category=category)
+            SentimentBucket.query.filter_by(**key).update(
+                {"count": SentimentBucket.count + delta})
+            SentimentBucket.query.filter_by(**key).filter(
+                SentimentBucket.count <= 0).delete()
+
+
+def record_comment_sentiment(comment):
+    _apply_comment(comment, 1)
+
+
+def remove_comment_sentiment(comment):
+    _apply_comment(comment, -1)
+
+
+# Compact timeline for the player: [[bucket, emoji, hits], ...] for every
+# bucket that has at least one matched comment, using its top category
+def get_timeline(episode_id):
+    rows = (
+        SentimentBucket.query
+        .filter_by(episode_id=episode_id)
+        .order_by(SentimentBucket.bucket, SentimentBucket.count.desc(), SentimentBucket.category)
+        .all()
+    )
+
+    timeline = []
+    for row in rows:
+        if timeline and timeline[-1][0] == row.bucket:
+            continue
+        timeline.append([row.bucket, CATEGORY_EMOJIS[row.category], row.count])
+
+    return {"bucket_seconds": TIMELINE_BUCKET_SECONDS, "timeline": timeline}
+
+
+# Recompute timelines from the comment table (for data that predates them)
+def rebuild_timeline(episode_id=None):
+    buckets = SentimentBucket.query
+    comments = db.session.query(Comment.episode_id, Comment.timestamp, Comment.content)
+    if episode_id is not None:
+        buckets = buckets.filter_by(episode_id=episode_id)
+        comments = comments.filter_by(episode_id=episode_id)
+    buckets.delete()
+
+    counts = {}
+    for comment in comments.yield_per(1000):
+        bucket = timeline_bucket(comment.timestamp)
+        for category in comment_categories(comment.content):
+            key = (comment.episode_id, bucket, category)
+            counts[key] = counts.get(key, 0) + 1
+
+    db.session.add_all(
+        SentimentBucket(episode_id=ep, bucket=bucket, category=category, count=count)
+        for (ep, bucket, category), count in counts.items()
+    )
+    db.session.commit()
+    return len(counts)
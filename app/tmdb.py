@@ -1,7 +1,9 @@
-import requests
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+from app.rate_limit import host_limiters, limited_get
+
 # Load environmental variables from .env file
 load_dotenv()
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
@@ -9,44 +11,105 @@ TMDB_API_KEY = os.getenv("TMDB_API_KEY")
 BASE_URL = "https://api.themoviedb.org/3"
 IMG_BASE_URL = "https://image.tmdb.org/t/p/w780"
 
+# Requests in flight at once during an import, and the request rate all of
+# them share (TMDb allows around 50 per second)
+TMDB_CONCURRENCY = int(os.getenv("TMDB_CONCURRENCY", "8"))
+TMDB_RATE_LIMIT = float(os.getenv("TMDB_RATE_LIMIT", "40"))
+host_limiters.configure("api.themoviedb.org", TMDB_RATE_LIMIT)
+
+
+# GET a TMDb API path through the shared api.themoviedb.org rate limiter
+def tmdb_get(path, headers=None, **params):
+    return limited_get(
+        f"{BASE_URL}{path}", params={"api_key": TMDB_API_KEY, **params}, headers=headers)
+
+
+# Conditional GET using validators from an earlier response. Returns
+# (data, etag, last_modified) with data None when TMDb says 304.
+def fetch_if_changed(path, etag=None, last_modified=None):
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    response = tmdb_get(path, headers=headers)
+    if response.status_code == 304:
+        return None, etag, last_modified
+    response.raise_for_status()
+    return response.json(), response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+
+# Ids of movies or shows edited on TMDb since start_date (YYYY-MM-DD, at
+# most 14 days back)
+def fetch_changed_ids(media_type, start_date):
+    ids = set()
+    page = 1
+    while True:
+        response = tmdb_get(f"/{media_type}/changes", start_date=start_date, page=page)
+        response.raise_for_status()
+        data = response.json()
+        ids.update(item["id"] for item in data["results"])
+        if page >= data.get("total_pages", 1):
+            return ids
+        page += 1
+
+
+# Run fetch(arg) for every arg on a thread pool, results in the order of args
+def fetch_concurrently(fetch, args, concurrency=None):
+    with ThreadPoolExecutor(max_workers=concurrency or TMDB_CONCURRENCY) as pool:
+        return list(pool.map(fetch, args))
+
+# Pages of popular movies or TV shows, one list of results at a time
+def iter_popular(media_type="movie", pages=1):
+    for page in range(1, pages + 1):
+        response = tmdb_get(f"/{media_type}/popular", page=page)
+        response.raise_for_status()
+        yield response.json()["results"]
+
 # Fetch multiple pages of popular movies or TV shows
 def fetch_popular(media_type="movie", pages=1):
     results = []
-    for page in range(1, pages + 1):
-        url = f"{BASE_URL}/{media_type}/popular"
-        response = requests.get(
-            url, params={"api_key": TMDB_API_KEY, "page": page})
-        response.raise_for_status()
-        results.extend(response.json()["results"])
-        
+    for page_results in iter_popular(media_type, pages):
+        results.extend(page_results)
     return results
 
-def fetch_featured(media_type="movie", pages=2, count=100):
-    results = []
+# Pages of today's trending movies or TV shows
+def iter_featured(media_type="movie", pages=2, count=100):
     for page in range(1, pages + 1):
-        url = f"{BASE_URL}/trending/{media_type}/day"
-        response = requests.get(
-            url, params={"api_key": TMDB_API_KEY, "page": page})
+        response = tmdb_get(f"/trending/{media_type}/day", page=page)
         response.raise_for_status()
-        results.extend(response.json()["results"][:count])
+        yield response.json()["results"][:count]
 
+def fetch_featured(media_type="movie", pages=2, count=100):
+    results = []
+    for page_results in iter_featured(media_type, pages, count):
+        results.extend(page_results)
     return results
 
-# Extract necessary fields from TMDb movie/TV show data
-def parse_tmdb_items(items, media_type, include_rank=False):
+# Runtime of a movie from its details, None if TMDb doesn't have it
+def fetch_movie_runtime(tmdb_id):
+    response = tmdb_get(f"/movie/{tmdb_id}")
+    if response.ok:
+        return response.json().get("runtime")
+    return None
+
+# Extract necessary fields from TMDb movie/TV show data. Movie runtimes
+# come from `runtimes` (tmdb_id -> runtime) when given, otherwise they are
+# fetched.
+def parse_tmdb_items(items, media_type, include_rank=False, concurrency=None, first_rank=1,
+                     runtimes=None):
     parsed = []
 
-    # For movies, get the runtime
-    for i, item in enumerate(items):
-        runtime = None
-        if media_type == "movie":
-            movie_url = f"{BASE_URL}/movie/{item['id']}"
-            response = requests.get(
-                movie_url, params={"api_key": TMDB_API_KEY})
-            if response.ok:
-                details = response.json()
-                runtime = details.get("runtime")
+    # For movies, get the runtimes (one request each, fetched in parallel)
+    if runtimes is not None:
+        runtimes = [runtimes.get(item["id"]) for item in items]
+    elif media_type == "movie":
+        runtimes = fetch_concurrently(
+            fetch_movie_runtime, [item["id"] for item in items], concurrency)
+    else:
+        runtimes = [None] * len(items)
 
+    for i, (item, runtime) in enumerate(zip(items, runtimes)):
         entry = {
                 "tmdb_id": item["id"],
                 "title": item.get("title") or item.get("name"),
@@ -63,15 +126,14 @@ def parse_tmdb_items(items, media_type, include_rank=False):
             }
         
         if include_rank:
-            entry["rank"] = i+1  # Rank starts from 1
+            entry["rank"] = first_rank + i  # Rank starts from 1
 
         parsed.append(entry)
     return parsed
 
 # Fetch all seasons of a particular TV show
 def fetch_tv_seasons(tv_id):
-    url = f"{BASE_URL}/tv/{tv_id}"
-    response = requests.get(url, params={"api_key": TMDB_API_KEY})
+    response = tmdb_get(f"/tv/{tv_id}")
     response.raise_for_status()
     return response.json().get("seasons", [])
 
@@ -101,8 +163,7 @@ def parse_seasons(tv_id, title, seasons_raw):
 
 # Fetch all episodes for a particular TV show season
 def fetch_season_episodes(tv_id, season_number):
-    url = f"{BASE_URL}/tv/{tv_id}/season/{season_number}"
-    response = requests.get(url, params={"api_key": TMDB_API_KEY})
+    response = tmdb_get(f"/tv/{tv_id}/season/{season_number}")
     response.raise_for_status()
     return response.json().get("episodes", [])
 
@@ -131,26 +192,31 @@ def parse_episodes(tv_id, season_num, season_id, episodes_raw):
         )
     return episodes
 
-# Take all the episode data and store them in db
-def generate_episode_entries(tv):
+# Take all the episode data and store them in db. Requests run on one
+# thread pool: a show's season requests are queued as soon as its season
+# list arrives, and results are assembled in the order of `tv`.
+def generate_episode_entries(tv, concurrency=None):
     season_data = []
     episode_data = []
-    for show in tv:
-        tv_id = show["tmdb_id"]
-        title = show["title"]
-
-        seasons_raw = fetch_tv_seasons(tv_id)
-        seasons = parse_seasons(tv_id, title, seasons_raw)
-        season_data.extend(seasons)
-
-        for season in seasons:
-            season_num = season["season_number"]
-            season_id = season["season_id"]
-
-            episodes_raw = fetch_season_episodes(tv_id, season_num)
-            episodes = parse_episodes(tv_id, season_num, season_id, episodes_raw)
-            episode_data.extend(episodes)
-            
+    with ThreadPoolExecutor(max_workers=concurrency or TMDB_CONCURRENCY) as pool:
+        shows = {pool.submit(fetch_tv_seasons, show["tmdb_id"]): show for show in tv}
+        show_seasons = {}
+        episode_requests = {}
+        for future in as_completed(shows):
+            show = shows[future]
+            seasons = parse_seasons(show["tmdb_id"], show["title"], future.result())
+            show_seasons[show["tmdb_id"]] = seasons
+            for season in seasons:
+                episode_requests[season["season_id"]] = pool.submit(
+                    fetch_season_episodes, season["tv_id"], season["season_number"])
+
+        for show in tv:
+            for season in show_seasons[show["tmdb_id"]]:
+                season_data.append(season)
+                episodes_raw = episode_requests[season["season_id"]].result()
+                episode_data.extend(parse_episodes(
+                    season["tv_id"], season["season_number"], season["season_id"], episodes_raw))
+
     return season_data, episode_data
 
 def main():
@@ -0,0 +1,111 @@
+"""Catalogue page latency as the user table grows.
+
+Builds throwaway site.db files with N users and a small media.db, points the
+app at them and times GET / for a logged-in visitor. The old catalogue also
+loaded every User row on each hit, that cost is timed alongside for
+comparison; the page itself only looks up the visitor by primary key.
+
+    python benchmarks/bench_catalogue.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import create_engine
+
+from app.flask_app import app
+from app.models import db, User
+
+
+def build_site_db(path, users):
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany(
+        "INSERT INTO user (id, username, password, total_movie_seconds, total_show_seconds, "
+        "total_anime_seconds) VALUES (?, ?, 'x', 0, 0, 0)",
+        ((i, f"user{i}") for i in range(1, users + 1)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def build_media_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE featured_movies (tmdb_id INTEGER, title TEXT, poster_url TEXT, overview TEXT, rank INTEGER);
+        CREATE TABLE featured_tv (tmdb_id INTEGER, title TEXT, poster_url TEXT, overview TEXT, rank INTEGER);
+        CREATE TABLE anime (anilist_id INTEGER PRIMARY KEY, title_romaji TEXT, title_english TEXT,
+            episodes INTEGER, average_score INTEGER, trending INTEGER, genres TEXT, description TEXT,
+            cover_url TEXT, start_date TEXT);
+    """)
+    for table, count in (("featured_movies", 50), ("featured_tv", 10)):
+        conn.executemany(
+            f"INSERT INTO {table} VALUES (?, ?, NULL, ?, ?)",
+            ((i, f"Title {i}", "overview " * 30, i) for i in range(count)),
+        )
+    conn.executemany(
+        "INSERT INTO anime VALUES (?, ?, NULL, 12, 80, ?, 'Action', ?, NULL, '2024-01-01')",
+        ((i, f"Anime {i}", i, "description " * 30) for i in range(10)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def median_ms(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    app.config.update(TESTING=True, SUMMARY_WORKER_ENABLED=False)
+    print(f"{'users':>12} {'GET / ms':>10} {'load all users ms':>18}")
+    with tempfile.TemporaryDirectory() as tmp:
+        media_path = os.path.join(tmp, "media.db")
+        build_media_db(media_path)
+        app.config["MEDIA_DB_PATH"] = media_path
+
+        for users in args.sizes:
+            site_path = os.path.join(tmp, f"site-{users}.db")
+            build_site_db(site_path, users)
+            engine = create_engine(f"sqlite:///{site_path}")
+            with app.app_context():
+                previous = db.engines[None]
+                db.engines[None] = engine
+                try:
+                    client = app.test_client()
+                    with client.session_transaction() as session:
+                        session["_user_id"] = str(users)
+                    client.get("/")  # render the shared rows once
+
+                    page = median_ms(lambda: client.get("/"), args.repeats)
+                    load_all = median_ms(lambda: (User.query.all(), db.session.expunge_all()),
+                                         max(args.repeats // 10, 1))
+                finally:
+                    db.session.remove()
+                    db.engines[None] = previous
+                    engine.dispose()
+            print(f"{users:>12,} {page:>10.3f} {load_all:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Per-episode comment read time as the comment table grows.
+
+Builds throwaway site.db files with the real Comment schema, keeps the
+number of comments on the episode being viewed fixed, and grows the rest of
+the table. With the (episode_id, timestamp) index the media page query stays
+flat; without it every read is a full table scan plus a sort.
+
+    python benchmarks/bench_comment_reads.py --sizes 10000 100000 1000000 10000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import create_engine
+
+from app.models import db, User, Comment
+
+PAGE_QUERY = """
+    SELECT id, content, timestamp, user_id, gif_url
+    FROM comment
+    WHERE episode_id = ?
+    ORDER BY timestamp
+"""
+TARGET_EPISODE = 1
+TARGET_COMMENTS = 500
+
+
+def build_db(path, rows):
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine, tables=[User.__table__, Comment.__table__])
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("INSERT INTO user (id, username, password, total_movie_seconds, "
+                 "total_show_seconds, total_anime_seconds) VALUES (1, 'bench', 'x', 0, 0, 0)")
+
+    rng = random.Random(rows)
+    episodes = max(rows // 1000, 2)
+
+    def generate():
+        for i in range(rows):
+            episode = TARGET_EPISODE if i < TARGET_COMMENTS else rng.randint(2, episodes + 1)
+            yield (f"comment {i}", rng.uniform(0, 7200), 1, episode, "Bench")
+
+    conn.executemany(
+        "INSERT INTO comment (content, timestamp, user_id, episode_id, media_title) "
+        "VALUES (?, ?, ?, ?, ?)",
+        generate(),
+    )
+    conn.commit()
+    return conn
+
+
+def time_query(conn, repeats=20):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        conn.execute(PAGE_QUERY, (TARGET_EPISODE,)).fetchall()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'indexed ms':>12} {'scan ms':>12}  plan")
+    for rows in args.sizes:
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            conn = build_db(path, rows)
+            conn.execute("ANALYZE")
+            plan = conn.execute("EXPLAIN QUERY PLAN " + PAGE_QUERY, (TARGET_EPISODE,)).fetchall()
+            indexed = time_query(conn, args.repeats)
+
+            conn.execute("DROP INDEX ix_comment_episode_timestamp")
+            scan = time_query(conn, max(args.repeats // 4, 1))
+            conn.close()
+
+            print(f"{rows:>12,} {indexed:>12.3f} {scan:>12.3f}  {plan[0][-1]}")
+        finally:
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Comment ingest rate: one commit per comment vs the write-behind spool.
+
+Posts N comments from several threads into a throwaway site.db the way the
+form POST does (one INSERT + COMMIT each), then into a WAL spool file the way
+COMMENT_SPOOL_ENABLED does, and finally times flushing that spool into the
+comment table in batches.
+
+    python benchmarks/bench_comment_spool.py --comments 20000 --threads 8
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import create_engine
+
+from app.comment_spool import SPOOL_SCHEMA
+from app.models import db, User, Comment
+
+COMMENT_INSERT = (
+    "INSERT INTO comment (content, timestamp, user_id, episode_id, media_title, created_at) "
+    "VALUES (?, ?, 1, 1, 'Bench', '2025-01-01T00:00:00')"
+)
+SPOOL_INSERT = (
+    "INSERT INTO pending_comment (user_id, episode_id, timestamp, content, gif_url, "
+    "media_title, created_at) VALUES (1, 1, ?, ?, NULL, 'Bench', '2025-01-01T00:00:00')"
+)
+
+
+def build_site_db(path):
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine, tables=[User.__table__, Comment.__table__])
+    engine.dispose()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO user (id, username, password, total_movie_seconds, "
+                 "total_show_seconds, total_anime_seconds) VALUES (1, 'bench', 'x', 0, 0, 0)")
+    conn.commit()
+    conn.close()
+
+
+# Run `per_thread` inserts in each thread, returns (comments/s, failures)
+def hammer(connect, statement, threads, per_thread):
+    failures = []
+
+    def worker(offset):
+        conn = connect()
+        for i in range(per_thread):
+            try:
+                conn.execute(statement, (float(i), f"comment {offset + i}"))
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                failures.append(e)
+        conn.close()
+
+    workers = [threading.Thread(target=worker, args=(n * per_thread,)) for n in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return threads * per_thread / elapsed, len(failures)
+
+
+def flush_rate(spool_path, site_path, batch):
+    spool = sqlite3.connect(spool_path)
+    site = sqlite3.connect(site_path)
+    copied = 0
+    start = time.perf_counter()
+    while True:
+        rows = spool.execute(
+            "SELECT id, timestamp, content FROM pending_comment ORDER BY id LIMIT ?", (batch,)
+        ).fetchall()
+        if not rows:
+            break
+        site.executemany(COMMENT_INSERT, [(ts, content) for _, ts, content in rows])
+        site.commit()
+        spool.execute("DELETE FROM pending_comment WHERE id <= ?", (rows[-1][0],))
+        spool.commit()
+        copied += len(rows)
+    return copied / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--comments", type=int, default=20_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+    per_thread = args.comments // args.threads
+
+    with tempfile.TemporaryDirectory() as tmp:
+        site_path = os.path.join(tmp, "site.db")
+        spool_path = os.path.join(tmp, "spool.db")
+        build_site_db(site_path)
+
+        rate, failed = hammer(lambda: sqlite3.connect(site_path, timeout=5),
+                              COMMENT_INSERT, args.threads, per_thread)
+        print(f"{'commit per comment':<22} {rate:>10,.0f} comments/s  {failed} locked")
+
+        def spool_connect():
+            conn = sqlite3.connect(spool_path, timeout=5)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(SPOOL_SCHEMA)
+            return conn
+
+        rate, failed = hammer(spool_connect, SPOOL_INSERT, args.threads, per_thread)
+        print(f"{'spool enqueue':<22} {rate:>10,.0f} comments/s  {failed} locked")
+
+        rate = flush_rate(spool_path, site_path, args.batch)
+        print(f"{'spool flush':<22} {rate:>10,.0f} comments/s  (batches of {args.batch})")
+
+
+if __name__ == "__main__":
+    main()
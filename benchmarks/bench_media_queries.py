@@ -0,0 +1,84 @@
+"""Lookup cost of f-string SQL vs the bound statements in app/media_queries.py.
+
+Builds a throwaway media.db and looks up random ids the way the routes used
+to (the id pasted into the SQL text, so every id is a new statement to
+parse and plan) and the way media_queries does (one statement with a ?
+binding that sqlite3's statement cache prepares once).
+
+    python benchmarks/bench_media_queries.py --rows 50000 --lookups 20000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.media_queries import EPISODE_BY_ID, MEDIA_COLUMNS, MEDIA_BY_ID
+
+
+def build_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.executescript(f"""
+        CREATE TABLE media (tmdb_id INTEGER PRIMARY KEY, title TEXT, media_type TEXT,
+            poster_url TEXT, overview TEXT, release_date TEXT, runtime INTEGER, vote_average REAL);
+        CREATE TABLE episodes (episode_id INTEGER PRIMARY KEY, season_id TEXT, tv_id INTEGER,
+            season_number INTEGER, episode_number INTEGER, episode_name TEXT, overview TEXT,
+            air_date TEXT, runtime INTEGER, vote_average REAL, still_url TEXT);
+    """)
+    conn.executemany(
+        f"INSERT INTO media ({MEDIA_COLUMNS}) VALUES (?, ?, 'movie', NULL, ?, '2024-01-01', 100, 7.5)",
+        ((i, f"Movie {i}", "overview " * 20) for i in range(rows)),
+    )
+    conn.executemany(
+        "INSERT INTO episodes VALUES (?, ?, 1, 1, ?, ?, ?, '2024-01-01', 45, 8.0, NULL)",
+        ((i, "1-1", i, f"Episode {i}", "overview " * 20) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def time_lookups(conn, ids, literal_sql, bound_sql):
+    start = time.perf_counter()
+    for i in ids:
+        conn.execute(literal_sql.format(i)).fetchone()
+    literal = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in ids:
+        conn.execute(bound_sql, (i,)).fetchone()
+    bound = time.perf_counter() - start
+    return literal / len(ids) * 1e6, bound / len(ids) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        build_db(path, args.rows)
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        ids = [random.randrange(args.rows) for _ in range(args.lookups)]
+
+        cases = [
+            ("media by id", "SELECT * FROM media WHERE tmdb_id = {}", MEDIA_BY_ID),
+            ("episode by id", "SELECT * FROM episodes WHERE episode_id = {}", EPISODE_BY_ID),
+        ]
+        print(f"{'lookup':<16} {'f-string us':>12} {'bound us':>10} {'speedup':>8}")
+        for name, literal_sql, bound_sql in cases:
+            literal, bound = time_lookups(conn, ids, literal_sql, bound_sql)
+            print(f"{name:<16} {literal:>12.2f} {bound:>10.2f} {literal / bound:>7.1f}x")
+        conn.close()
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""TMDb import wall-clock time against the number of concurrent requests.
+
+Starts a fake TMDb on localhost that answers /movie/<id>, /tv/<id> and
+/tv/<id>/season/<n> after a fixed delay (standing in for network and API
+latency), points app.tmdb at it and times the runtime lookups for a page of
+movies plus the season and episode walk for a set of shows.
+
+    python benchmarks/bench_tmdb_ingest.py --movies 60 --shows 20 --latency 0.05
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app import tmdb
+from app.rate_limit import host_limiters
+
+SEASONS_PER_SHOW = 4
+EPISODES_PER_SEASON = 10
+
+
+# the default listen backlog of 5 drops connections under 32 workers
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_handler(latency):
+    class FakeTMDb(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            path = self.path.split("?", 1)[0]
+            if match := re.fullmatch(r"/movie/(\d+)", path):
+                body = {"id": int(match[1]), "runtime": 100}
+            elif match := re.fullmatch(r"/tv/(\d+)", path):
+                body = {"seasons": [{"season_number": n} for n in range(1, SEASONS_PER_SHOW + 1)]}
+            elif match := re.fullmatch(r"/tv/(\d+)/season/(\d+)", path):
+                base = int(match[1]) * 1000 + int(match[2]) * 100
+                body = {"episodes": [{"id": base + e, "episode_number": e}
+                                     for e in range(1, EPISODES_PER_SEASON + 1)]}
+            else:
+                self.send_error(404)
+                return
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return FakeTMDb
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--movies", type=int, default=60)
+    parser.add_argument("--shows", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--rate", type=float, default=1000,
+                        help="shared requests/s limit (TMDb's own is around 50)")
+    args = parser.parse_args()
+
+    server = FakeServer(("127.0.0.1", 0), make_handler(args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    tmdb.BASE_URL = f"http://127.0.0.1:{server.server_port}"
+
+    movies = [{"id": i, "title": f"Movie {i}"} for i in range(args.movies)]
+    shows = [{"tmdb_id": i, "title": f"Show {i}"} for i in range(1, args.shows + 1)]
+    requests_made = args.movies + args.shows * (1 + SEASONS_PER_SHOW)
+
+    print(f"{requests_made} requests, {args.latency * 1000:.0f} ms each, limit {args.rate:g}/s")
+    print(f"{'concurrency':>12} {'seconds':>9} {'requests/s':>11} {'speedup':>8}")
+    baseline = None
+    for concurrency in args.concurrency:
+        host_limiters.configure("127.0.0.1", args.rate)
+        start = time.perf_counter()
+        tmdb.parse_tmdb_items(movies, "movie", concurrency=concurrency)
+        seasons, episodes = tmdb.generate_episode_entries(shows, concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        assert len(episodes) == args.shows * SEASONS_PER_SHOW * EPISODES_PER_SEASON
+
+        baseline = baseline or elapsed
+        print(f"{concurrency:>12} {elapsed:>9.2f} {requests_made / elapsed:>11.0f} "
+              f"{baseline / elapsed:>7.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
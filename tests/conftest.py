@@ -11,6 +11,8 @@ from unittest.mock import patch, MagicMock
 # Import your app and models
 from app.flask_app import app
 from app.models import db, User, Comment, Favorite, History
+from app.comments import invalidate_heatmap
+from app.live import live_comments
 
 
 def load_test_config():
@@ -40,6 +42,11 @@ def app_instance(test_config, media_db):  # <-- Add media_db as a dependency
         "SECRET_KEY": "test-secret-key",
         "WTF_CSRF_ENABLED": False,
         "MEDIA_DB_PATH": media_db,  # <-- Use the path from the media_db fixture
+        "SUMMARY_WORKER_ENABLED": False,  # tests drive the summary worker directly
+        "COMMENT_SPOOL_ENABLED": False,
+        "LIVE_COMMENTS_ENABLED": False,
+        "LIVE_KEEPALIVE_SECONDS": 15,
+        "LIVE_STREAM_SECONDS": 30,
     })
     
     with patch.dict(os.environ, {
@@ -50,6 +57,8 @@ def app_instance(test_config, media_db):  # <-- Add media_db as a dependency
     }):
         with app.app_context():
             db.create_all()
+            invalidate_heatmap()
+            live_comments.init_app(app)
             yield app
 
     # Clean up
@@ -179,12 +188,16 @@ def media_db(test_config):
         CREATE TABLE featured_movies (
             tmdb_id INTEGER PRIMARY KEY,
             title TEXT,
+            poster_url TEXT,
+            overview TEXT,
             rank INTEGER
         );
         
         CREATE TABLE featured_tv (
             tmdb_id INTEGER PRIMARY KEY,
             title TEXT,
+            poster_url TEXT,
+            overview TEXT,
             rank INTEGER
         );
     ''')
@@ -202,9 +215,9 @@ def media_db(test_config):
         ))
         
         conn.execute('''
-            INSERT INTO featured_movies (tmdb_id, title, rank)
-            VALUES (?, ?, ?)
-        ''', (movie['tmdb_id'], movie['title'], 1))
+            INSERT INTO featured_movies (tmdb_id, title, poster_url, overview, rank)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (movie['tmdb_id'], movie['title'], movie['poster_url'], movie['overview'], 1))
     
     tv_shows = test_config['test_config']['test_data']['tv_shows']
     for show in tv_shows:
@@ -218,9 +231,9 @@ def media_db(test_config):
         ))
         
         conn.execute('''
-            INSERT INTO featured_tv (tmdb_id, title, rank)
-            VALUES (?, ?, ?)
-        ''', (show['tmdb_id'], show['title'], 1))
+            INSERT INTO featured_tv (tmdb_id, title, poster_url, overview, rank)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (show['tmdb_id'], show['title'], show['poster_url'], show['overview'], 1))
     
     anime_list = test_config['test_config']['test_data']['anime']
     for anime in anime_list:
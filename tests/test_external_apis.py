@@ -5,6 +5,15 @@ from app.tmdb import fetch_popular, fetch_featured, fetch_tv_seasons, fetch_seas
 from app.anilist import fetch_anime, fetch_episodes
 from app.tenor import search_gif, featured_gifs
 from app.cache_tmdb import fetch_and_cache_movie, fetch_and_cache_show
+from app import rate_limit
+from app.rate_limit import HostLimiters, RateLimiter
+
+
+@pytest.fixture(autouse=True)
+def fresh_limiters():
+    """Give every test full token buckets for each upstream"""
+    with patch.object(rate_limit, 'host_limiters', HostLimiters(rate_limit.HOST_RATES)):
+        yield
 
 
 class TestTMDBAPI:
@@ -134,6 +143,83 @@ class TestTMDBAPI:
         assert result[0]["id"] == 111
         assert result[0]["episode_number"] == 1
 
+    @patch('requests.get')
+    def test_fetch_if_changed_not_modified(self, mock_get):
+        """Test a 304 from TMDb is returned as unchanged with the old validators"""
+        from app.tmdb import fetch_if_changed
+
+        mock_get.return_value = MagicMock(status_code=304)
+
+        assert fetch_if_changed("/tv/1", '"abc"') == (None, '"abc"', None)
+        assert mock_get.call_args.kwargs["headers"] == {"If-None-Match": '"abc"'}
+
+    @patch('requests.get')
+    def test_fetch_changed_ids_pages(self, mock_get):
+        """Test every page of the change list is read"""
+        from app.tmdb import fetch_changed_ids
+
+        def changes(url, params, **kwargs):
+            response = MagicMock()
+            response.json.return_value = {
+                "results": [{"id": params["page"] * 10}, {"id": params["page"] * 10 + 1}],
+                "total_pages": 3,
+            }
+            return response
+
+        mock_get.side_effect = changes
+
+        assert fetch_changed_ids("tv", "2025-01-01") == {10, 11, 20, 21, 30, 31}
+        assert "/tv/changes" in mock_get.call_args.args[0]
+
+    @patch('requests.get')
+    def test_parse_movies_fetches_runtimes(self, mock_get):
+        """Test movie runtimes are fetched in parallel but kept in order"""
+        from app.tmdb import parse_tmdb_items
+
+        def details(url, **kwargs):
+            response = MagicMock(ok=True)
+            response.json.return_value = {"runtime": int(url.rsplit("/", 1)[1])}
+            return response
+
+        mock_get.side_effect = details
+        items = [{"id": i, "title": f"Movie {i}"} for i in range(100, 120)]
+
+        result = parse_tmdb_items(items, "movie", include_rank=True, concurrency=4)
+
+        assert [m["runtime"] for m in result] == list(range(100, 120))
+        assert [m["rank"] for m in result] == list(range(1, 21))
+        assert mock_get.call_count == 20
+
+    @patch('requests.get')
+    def test_generate_episode_entries_concurrent(self, mock_get):
+        """Test concurrent season and episode fetches give the sequential result"""
+        from app.tmdb import generate_episode_entries
+
+        def tmdb(url, **kwargs):
+            response = MagicMock()
+            response.raise_for_status.return_value = None
+            parts = url.split("/tv/", 1)[1].split("/")
+            tv_id = int(parts[0])
+            if len(parts) == 1:
+                response.json.return_value = {
+                    "seasons": [{"season_number": n} for n in range(1, tv_id % 3 + 2)]}
+            else:
+                season = int(parts[2])
+                response.json.return_value = {"episodes": [
+                    {"id": tv_id * 100 + season * 10 + e, "episode_number": e} for e in (1, 2)]}
+            return response
+
+        mock_get.side_effect = tmdb
+        shows = [{"tmdb_id": i, "title": f"Show {i}"} for i in (7, 3, 5, 4)]
+
+        seasons, episodes = generate_episode_entries(shows, concurrency=8)
+
+        assert [s["season_id"] for s in seasons] == [
+            "7-1", "7-2", "3-1", "5-1", "5-2", "5-3", "4-1", "4-2"]
+        assert [e["episode_id"] for e in episodes][:4] == [711, 712, 721, 722]
+        assert len(episodes) == 16
+        assert all(e["season_id"] == f"{e['tv_id']}-{e['season_number']}" for e in episodes)
+
 
 class TestAniListAPI:
     """Test AniList API integration"""
@@ -460,19 +546,165 @@ class TestCachingFunctions:
 
 class TestAPIRateLimit:
     """Test API rate limiting and error handling"""
+
+    def _clock(self):
+        clock = {"now": 0.0, "slept": []}
+
+        def sleep(seconds):
+            clock["slept"].append(seconds)
+            clock["now"] += seconds
+
+        async def async_sleep(seconds):
+            sleep(seconds)
+
+        patches = [
+            patch('app.rate_limit.time.monotonic', side_effect=lambda: clock["now"]),
+            patch('app.rate_limit.time.sleep', side_effect=sleep),
+            patch('app.rate_limit.asyncio.sleep', side_effect=async_sleep),
+        ]
+        return clock, patches
+
+    def _response(self, status=200, **headers):
+        response = MagicMock(status_code=status, ok=status < 400)
+        response.headers = headers
+        return response
+
+    def test_rate_limiter_bursts_then_waits(self):
+        """Test the token bucket allows a burst, then spaces out requests"""
+        clock, patches = self._clock()
+        with patches[0], patches[1]:
+            limiter = RateLimiter(rate=10, burst=3)
+            for _ in range(3):
+                limiter.acquire()
+            assert clock["slept"] == []
+
+            limiter.acquire()
+            limiter.acquire()
+        assert clock["now"] == pytest.approx(0.2)
+
+    def test_rate_limiter_async(self):
+        """Test coroutines wait on the same bucket without blocking the loop"""
+        import asyncio
+
+        clock, patches = self._clock()
+        with patches[0], patches[2]:
+            limiter = RateLimiter(rate=10, burst=1)
+
+            async def burst():
+                await asyncio.gather(*(limiter.acquire_async() for _ in range(3)))
+
+            asyncio.run(burst())
+        assert clock["now"] == pytest.approx(0.2)
+
+    def test_rate_limiter_honours_retry_after(self):
+        """Test a 429 halves the rate and pauses every caller for Retry-After"""
+        clock, patches = self._clock()
+        with patches[0], patches[1]:
+            limiter = RateLimiter(rate=10, burst=5)
+            limiter.update(self._response(429, **{"Retry-After": "30"}))
+            assert limiter.rate == 5
+
+            limiter.acquire()
+        assert clock["now"] == pytest.approx(30)
+
+    def test_rate_limiter_timeout(self):
+        """Test acquire gives up instead of waiting out a long pause"""
+        clock, patches = self._clock()
+        with patches[0], patches[1]:
+            limiter = RateLimiter(rate=10, burst=1)
+            limiter.update(self._response(429, **{"Retry-After": "300"}))
+
+            assert limiter.acquire(timeout=1) is False
+            assert clock["now"] == 0
+
+            clock["now"] = 300
+            assert limiter.acquire(timeout=1) is True
+
+    def test_rate_limiter_reads_remaining(self):
+        """Test X-RateLimit headers slow the limiter down and successes speed it back up"""
+        clock, patches = self._clock()
+        with patches[0], patches[1], patch('app.rate_limit.time.time', return_value=1000):
+            limiter = RateLimiter(rate=10, burst=5)
+            limiter.update(self._response(**{"X-RateLimit-Remaining": "5", "X-RateLimit-Limit": "90"}))
+            assert limiter.rate == pytest.approx(7.5)
+
+            limiter.update(self._response(**{"X-RateLimit-Remaining": "60", "X-RateLimit-Limit": "90"}))
+            assert limiter.rate == pytest.approx(8.5)
+
+            limiter.update(self._response(**{"X-RateLimit-Remaining": "0", "X-RateLimit-Limit": "90",
+                                              "X-RateLimit-Reset": "1012"}))
+            limiter.acquire()
+        assert clock["now"] == pytest.approx(12)
+
+    def test_limiters_per_host(self):
+        """Test each upstream host gets its own limiter"""
+        limiters = HostLimiters({"graphql.anilist.co": 1.5})
+        anilist = limiters.get("https://graphql.anilist.co")
+        assert anilist is limiters.get("https://graphql.anilist.co/other")
+        assert anilist.rate == 1.5
+        assert limiters.get("https://api.themoviedb.org/3/movie/1") is not anilist
+
+    @patch('app.rate_limit.RateLimiter.acquire')
+    @patch('requests.get')
+    def test_limited_get_retries_429(self, mock_get, mock_acquire):
+        """Test a 429 is retried once the limiter lets requests through again"""
+        mock_get.side_effect = [self._response(429, **{"Retry-After": "1"}), self._response(200)]
+
+        response = rate_limit.limited_get("https://api.themoviedb.org/3/movie/1")
+
+        assert response.status_code == 200
+        assert mock_get.call_count == 2
+        assert mock_acquire.call_count == 2
+
+    @patch('requests.get')
+    def test_tenor_does_not_retry(self, mock_get):
+        """Test request-time GIF searches give up on a 429 instead of waiting"""
+        mock_get.return_value = self._response(429, **{"Retry-After": "60"})
+
+        assert search_gif("funny") == {"gifs": [], "next": None}
+        assert mock_get.call_count == 1
+
+    @patch('requests.get')
+    def test_tenor_does_not_wait_while_paused(self, mock_get):
+        """Test GIF searches come back empty at once while Tenor has us paused"""
+        mock_get.return_value = self._response(429, **{"Retry-After": "300"})
+        search_gif("funny")
+
+        with patch('app.rate_limit.time.sleep') as mock_sleep:
+            assert search_gif("funny") == {"gifs": [], "next": None}
+            assert featured_gifs() == []
+        mock_sleep.assert_not_called()
+        assert mock_get.call_count == 1
     
+    @patch('requests.get')
+    def test_page_time_tmdb_lookup_does_not_wait(self, mock_get, client):
+        """Test an uncached page gets a 503 at once while TMDb has us paused"""
+        from app.cache_tmdb import TMDbUnavailable
+
+        mock_get.return_value = self._response(429, **{"Retry-After": "300"})
+        with pytest.raises(TMDbUnavailable):
+            fetch_and_cache_movie(99999, None)
+
+        with patch('app.rate_limit.time.sleep') as mock_sleep:
+            assert client.get('/movie/99999').status_code == 503
+            assert client.get('/media/99999').status_code == 503
+        mock_sleep.assert_not_called()
+        assert mock_get.call_count == 1
+
     @patch('time.sleep')
+    @patch('app.rate_limit.RateLimiter.acquire')
     @patch('requests.post')
-    def test_anilist_rate_limiting(self, mock_post, mock_sleep):
-        """Test AniList API respects rate limits"""
+    def test_anilist_rate_limiting(self, mock_post, mock_acquire, mock_sleep):
+        """Test AniList episodes are fetched in one batch through the rate limiter"""
         from app.anilist import generate_episodes
         
         mock_response = MagicMock()
         mock_response.raise_for_status.return_value = None
         mock_response.json.return_value = {
             "data": {
-                "Media": {
-                    "streamingEpisodes": []
+                "Page": {
+                    "pageInfo": {"hasNextPage": False},
+                    "media": []
                 }
             }
         }
@@ -486,10 +718,72 @@ class TestAPIRateLimit:
         
         generate_episodes(anime_data)
         
-        # Should sleep between requests for rate limiting
-        assert mock_sleep.call_count == 2  # Once per anime
-        mock_sleep.assert_called_with(1.8)
-    
+        # One request for both anime, paced by the limiter instead of a fixed sleep
+        assert mock_post.call_count == 1
+        assert mock_post.call_args.kwargs["json"]["variables"]["ids"] == [1, 2]
+        assert mock_acquire.call_count == 1
+        mock_sleep.assert_not_called()
+
+    @patch('app.rate_limit.RateLimiter.acquire')
+    @patch('requests.post')
+    def test_anilist_episode_batches_split_per_anime(self, mock_post, mock_acquire):
+        """Test batched episode results are split back per anime across pages"""
+        from app.anilist import generate_episodes
+
+        def page(media, has_next):
+            response = MagicMock()
+            response.json.return_value = {"data": {"Page": {
+                "pageInfo": {"hasNextPage": has_next}, "media": media}}}
+            return response
+
+        mock_post.side_effect = [
+            page([{"id": 2, "duration": 24, "streamingEpisodes": [
+                {"title": "Episode 2", "thumbnail": None}, {"title": "Episode 1", "thumbnail": None}]}], True),
+            page([{"id": 1, "duration": 12, "streamingEpisodes": [
+                {"title": "Episode 1", "thumbnail": None}]}], False),
+        ]
+        anime_data = [{"anilist_id": i, "title_english": f"Anime {i}"} for i in (1, 2, 3)]
+
+        episodes = generate_episodes(anime_data)
+
+        assert [(e["anilist_id"], e["episode_id"], e["duration"]) for e in episodes] == [
+            (1, 1001, 12), (2, 2001, 24), (2, 2002, 24)]
+        assert [c.kwargs["json"]["variables"]["page"] for c in mock_post.call_args_list] == [1, 2]
+
+    @patch('app.rate_limit.RateLimiter.acquire')
+    @patch('requests.post')
+    def test_anilist_episode_batch_failure_and_empty(self, mock_post, mock_acquire):
+        """Test an anime with no episodes maps to [] and a failed batch to None"""
+        from app.anilist import iter_episode_batches
+
+        ok = MagicMock()
+        ok.json.return_value = {"data": {"Page": {"pageInfo": {"hasNextPage": False}, "media": []}}}
+        failed = MagicMock()
+        failed.raise_for_status.side_effect = requests.HTTPError("500")
+        mock_post.side_effect = [ok, failed]
+
+        batches = list(iter_episode_batches([{"anilist_id": 1}]))
+        batches += list(iter_episode_batches([{"anilist_id": 2}]))
+
+        assert [episodes for _, episodes in batches] == [{1: []}, None]
+
+    @patch('app.rate_limit.RateLimiter.acquire')
+    @patch('requests.post')
+    def test_anilist_episode_batches_chunked(self, mock_post, mock_acquire):
+        """Test more anime than fit in one request are split into batches"""
+        from app.anilist import generate_episodes, EPISODE_BATCH_SIZE
+
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"data": {"Page": {
+            "pageInfo": {"hasNextPage": False}, "media": []}}}
+        mock_post.return_value = mock_response
+        anime_data = [{"anilist_id": i} for i in range(EPISODE_BATCH_SIZE * 2 + 1)]
+
+        generate_episodes(anime_data)
+
+        sizes = [len(c.kwargs["json"]["variables"]["ids"]) for c in mock_post.call_args_list]
+        assert sizes == [EPISODE_BATCH_SIZE, EPISODE_BATCH_SIZE, 1]
+
     @patch('requests.get')
     def test_tmdb_api_timeout(self, mock_get):
         """Test TMDB API timeout handling"""
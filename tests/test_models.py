@@ -1,6 +1,6 @@
 import pytest
 from datetime import datetime, timezone
-from app.models import User, Comment, Favorite, History, db
+from app.models import User, Comment, Favorite, History, db, upgrade_schema
 
 
 class TestUserModel:
@@ -220,4 +220,52 @@ class TestHistoryModel:
         
         assert movie_history.media_type == "movie"
         assert tv_history.media_type == "tv"
-        assert anime_history.media_type == "anime"
\ No newline at end of file
+        assert anime_history.media_type == "anime"
+
+
+class TestSchemaUpgrade:
+    """Test indexes and upgrades for existing databases"""
+
+    def test_comment_reads_use_index(self, test_db):
+        """Test per-episode comment reads are served by the composite index"""
+        plan = db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN SELECT * FROM comment WHERE episode_id = 1 ORDER BY timestamp"
+        )).fetchall()
+        detail = " ".join(row[-1] for row in plan)
+
+        assert "ix_comment_episode_timestamp" in detail
+        assert "TEMP B-TREE" not in detail  # no separate sort step
+
+    def test_upgrade_legacy_database(self, tmp_path):
+        """Test an old site.db gains new indexes and columns"""
+        import sqlite3
+        from sqlalchemy import create_engine, inspect
+
+        path = tmp_path / "legacy.db"
+        conn = sqlite3.connect(path)
+        conn.executescript('''
+            CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(20), password VARCHAR(60),
+                               total_movie_seconds INTEGER, total_show_seconds INTEGER,
+                               total_anime_seconds INTEGER);
+            CREATE TABLE comment (id INTEGER PRIMARY KEY, content TEXT, timestamp FLOAT,
+                                  created_at DATETIME, user_id INTEGER, episode_id INTEGER,
+                                  gif_url TEXT, media_title VARCHAR(255));
+            CREATE TABLE emoji_summary (episode_id INTEGER PRIMARY KEY, comment_hash VARCHAR(64),
+                                        emoji VARCHAR(64), generated_at DATETIME);
+            INSERT INTO emoji_summary VALUES (1, 'abc', '😀😀😀😀', NULL);
+        ''')
+        conn.close()
+
+        engine = create_engine(f"sqlite:///{path}")
+        upgrade_schema(engine)
+        upgrade_schema(engine)  # running again is a no-op
+
+        inspector = inspect(engine)
+        assert "ix_comment_episode_timestamp" in [i["name"] for i in inspector.get_indexes("comment")]
+        columns = {c["name"] for c in inspector.get_columns("emoji_summary")}
+        assert {"is_stale", "source"} <= columns
+
+        with engine.connect() as conn:
+            row = conn.exec_driver_sql("SELECT is_stale, source FROM emoji_summary").fetchone()
+        assert tuple(row) == (0, "gemini")
+        engine.dispose()
@@ -1,7 +1,11 @@
 import pytest
 import json
+from sqlalchemy import event
 from unittest.mock import patch, MagicMock
-from app.models import User, Comment, Favorite, History, db
+from app.models import User, Comment, CommentBucketCount, Favorite, History, EmojiSummary, SentimentBucket, db
+from app.comments import record_comment_count
+from app.live import live_comments
+from app.comment_spool import comment_spool
 
 
 class TestAuthRoutes:
@@ -100,7 +104,53 @@ class TestMediaRoutes:
         response = client.get('/')
         assert response.status_code == 200
         assert b'catalogue' in response.data.lower()
-    
+
+    def test_catalogue_rows_cached_per_media_version(self, client, media_db):
+        """Test catalogue rows render once until media.db changes"""
+        from app import media_queries
+        from app.media_db import media_db as media_pool
+
+        with patch.object(media_queries, 'featured_movies',
+                          wraps=media_queries.featured_movies) as featured:
+            first = client.get('/')
+            second = client.get('/')
+            assert featured.call_count == 1
+            assert first.data == second.data
+            assert b'Test Movie' in second.data
+
+            with media_pool.writer() as writer:
+                writer.execute("UPDATE featured_movies SET title = 'Renamed Movie'")
+            response = client.get('/')
+            assert featured.call_count == 2
+            assert b'Renamed Movie' in response.data
+
+    def test_catalogue_greets_user_around_cached_rows(self, client, sample_users):
+        """Test the per-user greeting is rendered around the shared rows"""
+        user = sample_users[0]
+        client.get('/')
+        client.post('/login', data={'username': user.username, 'password': user.password})
+        response = client.get('/')
+        assert f'Welcome {user.username}'.encode() in response.data
+        assert b'Test Movie' in response.data
+
+    def test_catalogue_does_not_load_users(self, client, sample_users):
+        """Test the catalogue only looks up the visitor, not the user table"""
+        user = sample_users[0]
+        client.post('/login', data={'username': user.username, 'password': user.password})
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = client.get('/')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        assert response.status_code == 200
+        user_reads = [s for s in statements if 'FROM user' in s]
+        assert all('WHERE user.id = ?' in s for s in user_reads)
+
     def test_movie_page(self, client, media_db):
         """Test individual movie page"""        
         response = client.get('/movie/12345')
@@ -116,6 +166,73 @@ class TestMediaRoutes:
         response = client.get('/anime/11111')
         assert response.status_code == 200
     
+    def test_catalogue_not_modified(self, client, media_db):
+        """Test a repeat catalogue visit with a matching ETag gets a 304"""
+        first = client.get('/')
+        etag = first.headers['ETag']
+        assert first.headers['Cache-Control'] == 'public, no-cache'
+
+        response = client.get('/', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+
+    def test_etag_changes_with_media_db(self, client, media_db):
+        """Test rewriting media.db invalidates page ETags"""
+        from app.media_db import media_db as media_pool
+
+        etag = client.get('/media/67890').headers['ETag']
+        with media_pool.writer() as writer:
+            writer.execute("UPDATE media SET title = 'Renamed Show' WHERE tmdb_id = 67890")
+
+        response = client.get('/media/67890', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert b'Renamed Show' in response.data
+
+    def test_etag_per_user(self, client, sample_users, media_db):
+        """Test logged-in pages get their own private ETag"""
+        anonymous = client.get('/').headers['ETag']
+        user = sample_users[0]
+        client.post('/login', data={'username': user.username, 'password': user.password})
+
+        response = client.get('/', headers={'If-None-Match': anonymous})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != anonymous
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    def test_anime_etag_follows_favorite(self, client, auth_user, media_db):
+        """Test favoriting an anime changes its page ETag"""
+        etag = client.get('/anime/11111').headers['ETag']
+        assert client.get('/anime/11111', headers={'If-None-Match': etag}).status_code == 304
+
+        client.post('/toggle_favorite/11111')
+        response = client.get('/anime/11111', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert '⭐'.encode() in response.data
+
+    def test_not_modified_still_records_history(self, client, auth_user, media_db):
+        """Test a 304 for a show page still adds it to the viewer's history"""
+        etag = client.get('/media/67890').headers['ETag']
+        History.query.delete()
+        db.session.commit()
+
+        response = client.get('/media/67890', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert History.query.filter_by(user_id=auth_user.id, media_id=67890).count() == 1
+
+    def test_flashed_page_not_validated(self, client, media_db):
+        """Test a page showing a flash message is rendered without an ETag"""
+        etag = client.get('/').headers['ETag']
+        with client.session_transaction() as session:
+            session['_flashes'] = [('info', 'Logged out')]
+
+        response = client.get('/', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert b'Logged out' in response.data
+        assert 'ETag' not in response.headers
+        assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+
     '''
     def test_nonexistent_media(self, client):
         """Test accessing nonexistent media returns 404"""
@@ -126,7 +243,7 @@ class TestMediaRoutes:
 class TestCommentRoutes:
     """Test comment-related functionality"""
     
-    @patch('app.flask_app.summarize_comments')
+    @patch('app.google_ai.summarize_comments')
     def test_add_comment_authenticated(self, mock_summarize, client, auth_user, media_db):
         """Test adding comment when authenticated""" 
         mock_summarize.return_value = "✔️" # Provide a simple return value
@@ -144,6 +261,88 @@ class TestCommentRoutes:
         assert comment is not None
         assert comment.user_id == auth_user.id
     
+    def test_add_comment_marks_summary_stale(self, client, auth_user, media_db):
+        """Test posting a comment flags the cached summary for a refresh"""
+        db.session.add(EmojiSummary(episode_id=12345, comment_hash="old", emoji="🙂🙂🙂🙂"))
+        db.session.commit()
+
+        response = client.post('/movie/12345', data={
+            'content': 'Great movie!',
+            'timestamp': '10:30',
+            'submit': 'Comment'
+        }, follow_redirects=True)
+
+        assert response.status_code == 200
+        assert "🙂🙂🙂🙂".encode() in response.data
+        assert db.session.get(EmojiSummary, 12345).is_stale is True
+
+    def test_add_comment_api(self, client, auth_user, media_db):
+        """Test posting a comment as JSON returns it without a page rebuild"""
+        response = client.post('/api/comments/movie/12345', json={
+            'content': 'Async hello',
+            'timestamp': '01:02:03',
+        })
+
+        assert response.status_code == 201
+        data = json.loads(response.data)
+        assert data['comment']['content'] == 'Async hello'
+        assert data['comment']['timestamp'] == 3723
+        assert data['comment']['username'] == auth_user.username
+        assert 'data-comment-id="%d"' % data['comment']['id'] in data['html']
+        assert 'delete-comment-form' in data['html']
+
+        comment = db.session.get(Comment, data['comment']['id'])
+        assert comment.episode_id == 12345
+        assert comment.media_title == 'Test Movie'
+        assert CommentBucketCount.query.filter_by(episode_id=12345).first().count == 1
+
+    def test_add_comment_api_invalid(self, client, auth_user, media_db):
+        """Test the JSON comment API applies the comment form rules"""
+        response = client.post('/api/comments/movie/12345', json={'content': 'x', 'timestamp': 'soon'})
+        assert response.status_code == 400
+        assert 'timestamp' in json.loads(response.data)['errors']
+
+        response = client.post('/api/comments/movie/99999', json={'content': 'x', 'timestamp': '00:01'})
+        assert response.status_code == 404
+        response = client.post('/api/comments/book/12345', json={'content': 'x', 'timestamp': '00:01'})
+        assert response.status_code == 404
+        assert Comment.query.count() == 0
+
+    def test_add_comment_api_write_behind(self, client, auth_user, media_db, tmp_path):
+        """Test a spooled comment is shown to its author before it is flushed"""
+        client.application.config.update(
+            COMMENT_SPOOL_ENABLED=True,
+            COMMENT_SPOOL_PATH=str(tmp_path / 'spool.db'),
+            COMMENT_SPOOL_INTERVAL=3600,
+        )
+        try:
+            response = client.post('/api/comments/movie/12345', json={
+                'content': 'Spooled hello',
+                'timestamp': '00:42',
+            })
+            assert response.status_code == 201
+            assert json.loads(response.data)['comment']['id'].startswith('pending-')
+            assert Comment.query.count() == 0
+
+            page = client.get('/movie/12345').data
+            assert b'Spooled hello' in page
+            assert b'Show 1 Comment' in page
+
+            window = json.loads(client.get('/api/comments/12345/window?from=0&to=60').data)
+            assert [c['content'] for c in window['comments']] == ['Spooled hello']
+
+            assert comment_spool.flush() == 1
+            assert Comment.query.filter_by(content='Spooled hello').count() == 1
+            assert b'Show 1 Comment' in client.get('/movie/12345').data
+        finally:
+            client.application.config['COMMENT_SPOOL_ENABLED'] = False
+
+    def test_add_comment_api_unauthenticated(self, client, media_db):
+        """Test the JSON comment API needs a logged in user"""
+        response = client.post('/api/comments/movie/12345', json={'content': 'x', 'timestamp': '00:01'})
+        assert response.status_code == 401
+        assert json.loads(response.data)['success'] is False
+
     def test_add_comment_unauthenticated(self, client, media_db):
         """Test adding comment when not authenticated"""        
         response = client.post('/movie/12345', data={
@@ -392,6 +591,194 @@ class TestAPIRoutes:
         assert isinstance(data, list)
         assert len(data) > 0
     
+    def _add_comments(self, user, episode_id, timestamps):
+        for ts in timestamps:
+            comment = Comment(content=f'at {ts}', timestamp=ts, user_id=user.id,
+                              episode_id=episode_id, media_title='Test Movie')
+            db.session.add(comment)
+            record_comment_count(comment)
+        db.session.commit()
+
+    def test_comment_window_api(self, client, sample_users):
+        """Test a window only returns comments inside its time range, in order"""
+        self._add_comments(sample_users[0], 777, [400, 10, 130, 250, 90])
+
+        data = json.loads(client.get('/api/comments/777/window?from=60&to=300').data)
+        assert [c['timestamp'] for c in data['comments']] == [90, 130, 250]
+        assert data['comments'][0]['username'] == sample_users[0].username
+        assert data['next_cursor'] is None
+
+    def test_comment_window_api_cursor(self, client, sample_users):
+        """Test paging through a window with the cursor"""
+        self._add_comments(sample_users[0], 777, [5, 5, 5, 20, 40])
+
+        seen = []
+        cursor = ''
+        for _ in range(5):
+            data = json.loads(client.get(f'/api/comments/777/window?limit=2&cursor={cursor}').data)
+            seen.extend(c['id'] for c in data['comments'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+
+        expected = [c.id for c in Comment.query.filter_by(episode_id=777)
+                    .order_by(Comment.timestamp, Comment.id)]
+        assert seen == expected
+
+    def test_comment_window_api_bad_cursor(self, client):
+        """Test malformed window parameters are rejected"""
+        assert client.get('/api/comments/777/window?cursor=nonsense').status_code == 400
+        assert client.get('/api/comments/777/window?from=abc').status_code == 400
+
+    def test_media_page_renders_initial_window(self, client, sample_users, media_db):
+        """Test the media page only renders the opening comments but counts them all"""
+        self._add_comments(sample_users[0], 12345, [30, 60, 3000])
+
+        response = client.get('/movie/12345')
+        assert response.status_code == 200
+        assert b'at 60' in response.data
+        assert b'at 3000' not in response.data
+        assert b'Show 3 Comments' in response.data
+
+    def _page_statements(self, client, users):
+        for i in range(users):
+            user = User(username=f'viewer{users}-{i}', password='x')
+            db.session.add(user)
+            db.session.flush()
+            comment = Comment(content=f'hello {i}', timestamp=i, user_id=user.id,
+                              episode_id=12345, media_title='Test Movie')
+            db.session.add(comment)
+            record_comment_count(comment)
+        db.session.commit()
+
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = client.get('/movie/12345')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        assert response.status_code == 200
+        assert f'viewer{users}-{users - 1}'.encode() in response.data
+        return len(statements)
+
+    def test_media_page_query_count_constant(self, client, media_db, test_db):
+        """Test comment authors are loaded with the comments, not one query each"""
+        few = self._page_statements(client, 2)
+        Comment.query.delete()
+        CommentBucketCount.query.delete()
+        db.session.commit()
+        many = self._page_statements(client, 40)
+        assert many == few
+
+    def test_comment_heatmap_api(self, client, sample_users):
+        """Test the heatmap endpoint returns pre-bucketed density"""
+        self._add_comments(sample_users[0], 777, [0, 5, 9.9, 10, 55, 60, 120])
+
+        data = json.loads(client.get('/api/comments/777/heatmap?buckets=6&duration=60').data)
+        assert data['buckets'] == 6
+        assert data['density'] == [3, 1, 0, 0, 0, 1]
+
+    def test_comment_heatmap_api_cache_invalidated(self, client, auth_user, media_db):
+        """Test a new comment shows up in an already cached heatmap"""
+        url = '/api/comments/12345/heatmap?buckets=4&duration=7200'
+        assert json.loads(client.get(url).data)['density'] == [0, 0, 0, 0]
+
+        client.post('/movie/12345', data={'content': 'hi', 'timestamp': '01:00:00', 'submit': 'Comment'})
+        assert json.loads(client.get(url).data)['density'] == [0, 0, 1, 0]
+
+    def test_comment_heatmap_api_bad_params(self, client):
+        """Test the heatmap needs a finite positive duration and caps the bucket count"""
+        assert client.get('/api/comments/777/heatmap').status_code == 400
+        assert client.get('/api/comments/777/heatmap?duration=0').status_code == 400
+        assert client.get('/api/comments/777/heatmap?duration=nan').status_code == 400
+        assert client.get('/api/comments/777/heatmap?duration=inf').status_code == 400
+        assert client.get('/api/comments/777/heatmap?duration=1e-320').status_code == 400
+        assert client.get('/api/comments/777/heatmap?duration=0.5').status_code == 400
+        assert client.get('/api/comments/777/heatmap?duration=60&buckets=x').status_code == 400
+
+        data = json.loads(client.get('/api/comments/777/heatmap?duration=60&buckets=5000').data)
+        assert len(data['density']) == 200
+
+    def test_comment_counts_follow_add_and_delete(self, client, auth_user, media_db):
+        """Test the density buckets are kept in step with comment changes"""
+        for ts in ['00:01', '00:03', '00:12']:
+            client.post('/movie/12345', data={'content': 'hi', 'timestamp': ts, 'submit': 'Comment'})
+
+        counts = {(row.bucket, row.count) for row in CommentBucketCount.query.filter_by(episode_id=12345)}
+        assert counts == {(0, 2), (2, 1)}
+        assert b'Show 3 Comments' in client.get('/movie/12345').data
+
+        comment = Comment.query.filter_by(timestamp=12).first()
+        client.post(f'/comment/{comment.id}/delete')
+        assert CommentBucketCount.query.filter_by(episode_id=12345, bucket=2).count() == 0
+        assert b'Show 2 Comments' in client.get('/movie/12345').data
+
+    def test_live_comments_stream(self, client, auth_user, media_db):
+        """Test a new comment is pushed to the live stream"""
+        client.application.config['LIVE_COMMENTS_ENABLED'] = True
+        after = live_comments.last_id()
+        client.post('/movie/12345', data={'content': 'live one', 'timestamp': '00:10', 'submit': 'Comment'})
+
+        response = client.get(f'/api/comments/12345/live?after={after}', buffered=False)
+        assert response.mimetype == 'text/event-stream'
+        stream = response.response
+        assert next(stream).startswith(b'retry:')
+        event = next(stream)
+        response.close()
+
+        comment = Comment.query.filter_by(content='live one').first()
+        assert event.startswith(f'id: {comment.id}\nevent: comment\n'.encode())
+        assert b'live one' in event
+
+    def test_live_comments_bad_event_id(self, client):
+        """Test a malformed Last-Event-ID is rejected"""
+        client.application.config['LIVE_COMMENTS_ENABLED'] = True
+        response = client.get('/api/comments/12345/live', headers={'Last-Event-ID': 'abc'})
+        assert response.status_code == 400
+
+    def test_live_comments_stream_ends(self, client):
+        """Test a stream closes after LIVE_STREAM_SECONDS so the browser reconnects"""
+        client.application.config.update(
+            LIVE_COMMENTS_ENABLED=True, LIVE_STREAM_SECONDS=0.2, LIVE_KEEPALIVE_SECONDS=0.05)
+        response = client.get('/api/comments/12345/live', buffered=False)
+        chunks = list(response.response)
+        response.close()
+
+        assert chunks[0].startswith(b'retry:')
+        assert set(chunks[1:]) == {b': keepalive\n\n'}
+
+    def test_live_comments_disabled(self, client, media_db):
+        """Test pages do not open a stream unless live comments are enabled"""
+        assert client.get('/api/comments/12345/live').status_code == 404
+        assert b'data-live-after' not in client.get('/movie/12345').data
+
+        client.application.config['LIVE_COMMENTS_ENABLED'] = True
+        assert b'data-live-after' in client.get('/movie/12345').data
+
+    def test_emoji_timeline_api(self, client, auth_user, media_db):
+        """Test the emoji timeline is maintained as comments come and go"""
+        for content, ts in [('lol', '00:05'), ('lmao', '00:20'), ('what a twist', '01:10')]:
+            client.post('/movie/12345', data={'content': content, 'timestamp': ts, 'submit': 'Comment'})
+
+        data = json.loads(client.get('/api/timeline/12345').data)
+        assert data['bucket_seconds'] == 30
+        assert data['timeline'] == [[0, '😂', 2], [2, '😱', 1]]
+
+        comment = Comment.query.filter_by(content='what a twist').first()
+        client.post(f'/comment/{comment.id}/delete')
+
+        data = json.loads(client.get('/api/timeline/12345').data)
+        assert data['timeline'] == [[0, '😂', 2]]
+        assert SentimentBucket.query.filter_by(bucket=2).count() == 0
+
+    def test_emoji_timeline_api_empty(self, client):
+        """Test the emoji timeline for media without comments"""
+        data = json.loads(client.get('/api/timeline/99999').data)
+        assert data['timeline'] == []
+
     @patch('requests.get')
     def test_search_api(self, mock_get, client):
         """Test search API"""
@@ -1,11 +1,43 @@
+import json
+import os
+import sqlite3
+import time
 import pytest
 from unittest.mock import patch, MagicMock
 from app.flask_app import parse_timestamp_string, seconds_to_hours_minutes
 from app.anilist import format_start_date, extract_ep_num, parse_anime
 from app.tmdb import parse_tmdb_items
-from app.google_ai import get_comments, summarize_comments
+from app.google_ai import (
+    get_comments,
+    summarize_comments,
+    get_cached_summary,
+    comment_fingerprint,
+    build_comment_digest,
+    estimate_tokens,
+    pack_batches,
+    summarize_comments_batch,
+    refresh_stale_summaries,
+    summarize_with_fallback,
+    summary_breaker,
+    CircuitBreaker,
+)
+from app.sentiment import local_summary, score_comments, parse_comment_block, NEUTRAL_SUMMARY
 from app.history import add_to_history
-from app.models import History, db
+from app.models import History, EmojiSummary, Comment, CommentBucketCount, SpoolCheckpoint, db
+from app.summary_worker import SummaryWorker, SUMMARY_PLACEHOLDER
+from app.timeline import get_timeline, rebuild_timeline, record_comment_sentiment
+from app.live import CommentBroadcaster, comment_stream, live_comments
+from app.comment_spool import comment_spool
+from app.media_db import MediaDB, media_db
+from app import media_queries
+from app import comments
+from app.comments import (
+    check_comment_counts,
+    comment_heatmap,
+    comment_total,
+    rebuild_comment_counts,
+    record_comment_count,
+)
 
 
 class TestTimestampUtilities:
@@ -275,6 +307,59 @@ class TestGoogleAIUtilities:
         assert "[01:05]" in comment_block
         assert "[01:01:05]" in comment_block
 
+    def test_build_comment_digest_merges_duplicates(self):
+        """Test near-identical comments in a bucket collapse into one line"""
+        comments = [
+            (10, "LOL!!", "2024-01-01 00:00:01"),
+            (12, "lol", "2024-01-01 00:00:02"),
+            (15, "lolllll", "2024-01-01 00:00:03"),
+            (20, "What a twist", "2024-01-01 00:00:04"),
+        ]
+        digest = build_comment_digest(comments)
+
+        lines = digest.splitlines()
+        assert len(lines) == 2
+        assert lines[0].endswith("(x3)")
+        assert "[00:20] What a twist" in lines
+
+    def test_build_comment_digest_respects_budget(self):
+        """Test the digest stays within budget however many comments there are"""
+        comments = [
+            (i % 3600, f"unique comment number {i}", f"2024-01-01 {i:08d}")
+            for i in range(20000)
+        ]
+        digest = build_comment_digest(comments, token_budget=500)
+
+        assert digest
+        assert sum(estimate_tokens(line) for line in digest.splitlines()) <= 500
+
+    def test_build_comment_digest_oversized_comment(self):
+        """Test one huge comment is cut down instead of emptying the digest"""
+        comments = [(5, "x" * 20000, "2026-01-02"), (10, "great scene", "2026-01-01")]
+
+        digest = build_comment_digest(comments, token_budget=4000)
+        assert "[00:10] great scene" in digest
+        assert len(digest.splitlines()[0]) < 300
+
+        # a line that still does not fit is skipped, the rest are kept
+        digest = build_comment_digest(comments, token_budget=20)
+        assert digest == "[00:10] great scene"
+
+    def test_build_comment_digest_covers_runtime(self):
+        """Test every bucket gets a comment before any bucket gets a second"""
+        comments = []
+        for minute in range(10):
+            for i in range(50):
+                comments.append((minute * 60 + i, f"minute {minute} comment {i}", f"2024-01-01 {i:04d}"))
+        # each line costs 7 tokens, so the budget fits exactly one per bucket
+        digest = build_comment_digest(comments, token_budget=75)
+
+        lines = digest.splitlines()
+        assert len(lines) == 10
+        # most recent comment represents each bucket, output is in runtime order
+        assert lines[0] == "[00:49] minute 0 comment 49"
+        assert lines[-1] == "[09:49] minute 9 comment 49"
+
     @patch('app.google_ai.genai.Client')
     def test_summarize_comments(self, mock_client):
         """Test comment summarization"""
@@ -288,6 +373,928 @@ class TestGoogleAIUtilities:
         assert result == "😊😍🎉👏"
         mock_client.assert_called_once()
 
+    def test_get_cached_summary_reuses_cache(self, test_db, mock_genai):
+        """Test cached summary is served while comments are unchanged"""
+        comment_block = "[05:00] Great scene!\n[10:00] Amazing!"
+
+        first = get_cached_summary(12345, comment_block)
+        second = get_cached_summary(12345, comment_block)
+
+        assert first == second == "😊😍🎉👏"
+        assert mock_genai.models.generate_content.call_count == 1
+
+        cached = db.session.get(EmojiSummary, 12345)
+        assert cached.comment_hash == comment_fingerprint(comment_block)
+        assert cached.generated_at is not None
+
+    def test_get_cached_summary_recomputes_on_change(self, test_db, mock_genai):
+        """Test summary is regenerated when the comment fingerprint changes"""
+        get_cached_summary(12345, "[05:00] Great scene!")
+        mock_genai.models.generate_content.return_value.text = "😱😱😢😭"
+
+        result = get_cached_summary(12345, "[05:00] Great scene!\n[06:00] Oh no")
+
+        assert result == "😱😱😢😭"
+        assert mock_genai.models.generate_content.call_count == 2
+        assert EmojiSummary.query.count() == 1
+
+    def test_get_cached_summary_empty_block(self, test_db, mock_genai):
+        """Test no model call is made when there are no comments"""
+        assert get_cached_summary(12345, "") == ""
+        mock_genai.models.generate_content.assert_not_called()
+
+
+class TestLocalSentiment:
+    """Test the offline emoji summary fallback"""
+
+    def test_local_summary_dominant_reaction(self):
+        """Test the most common reaction gets the most emoji slots"""
+        block = "[01:00] lol\n[01:10] LMAO\n[01:20] haha so funny\n[02:00] what a twist"
+        summary = local_summary(block)
+
+        assert summary.startswith("😂😂")
+        assert "😱" in summary
+        assert len(summary) == 4
+
+    def test_local_summary_uses_digest_counts(self):
+        """Test (xN) counts from the digest weight the score"""
+        texts, weights = parse_comment_block("[00:10] so sad (x9)\n[00:20] lol")
+        assert texts == ["so sad", "lol"]
+        assert weights == [9, 1]
+
+        assert local_summary("[00:10] so sad (x9)\n[00:20] lol") == "😢😢😢😢"
+
+    def test_local_summary_no_matches(self):
+        """Test neutral summary when nothing matches the lexicon"""
+        assert local_summary("[00:10] the\n[00:20] a") == NEUTRAL_SUMMARY
+        assert local_summary("") == NEUTRAL_SUMMARY
+
+    def test_score_comments_is_fast(self):
+        """Test thousands of comments score in well under a page render"""
+        import time
+        texts = ["omg what a twist lol", "this is so boring", "love this scene 😍"] * 5000
+
+        start = time.perf_counter()
+        scores = score_comments(texts)
+        elapsed = time.perf_counter() - start
+
+        assert scores.sum() == 30000
+        assert elapsed < 1.0
+
+
+class TestSummaryFallback:
+    """Test the circuit breaker in front of Gemini"""
+
+    def setup_method(self):
+        summary_breaker.record_success()
+
+    def test_breaker_opens_after_failures(self):
+        """Test the breaker opens after repeated failures and half-opens later"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert not breaker.allow()
+
+        breaker.opened_at -= 61
+        assert breaker.allow()       # one trial call
+        assert not breaker.allow()   # others wait for its result
+        breaker.record_success()
+        assert breaker.allow()
+
+    @patch('app.google_ai.genai.Client')
+    def test_fallback_on_api_error(self, mock_client):
+        """Test Gemini errors fall back to the local summary"""
+        mock_client.return_value.models.generate_content.side_effect = Exception("503")
+
+        emoji, source = summarize_with_fallback("[00:10] lol\n[00:20] lmao")
+
+        assert source == "local"
+        assert emoji == "😂😂😂😂"
+
+    @patch('app.google_ai.genai.Client')
+    def test_open_breaker_skips_gemini(self, mock_client):
+        """Test Gemini is not called at all while the breaker is open"""
+        mock_client.return_value.models.generate_content.side_effect = Exception("429")
+        for _ in range(summary_breaker.failure_threshold):
+            summarize_with_fallback("[00:10] lol")
+        mock_client.reset_mock()
+
+        emoji, source = summarize_with_fallback("[00:10] lol")
+
+        assert source == "local"
+        mock_client.assert_not_called()
+
+    def test_missing_key_uses_local(self, monkeypatch):
+        """Test no Gemini key means local summaries"""
+        monkeypatch.delenv("GENAI_KEY", raising=False)
+        assert summarize_with_fallback("[00:10] so sad") == ("😢😢😢😢", "local")
+
+    @patch('app.google_ai.genai.Client')
+    def test_local_summary_is_retried(self, mock_client, test_db, monkeypatch):
+        """Test a cached local summary is replaced once Gemini answers"""
+        monkeypatch.setenv("GENAI_KEY", "test_genai_key")
+        mock_client.return_value.models.generate_content.side_effect = Exception("timeout")
+        assert get_cached_summary(12345, "[00:10] lol") == "😂😂😂😂"
+        assert db.session.get(EmojiSummary, 12345).source == "local"
+
+        summary_breaker.record_success()
+        mock_client.return_value.models.generate_content.side_effect = None
+        mock_client.return_value.models.generate_content.return_value.text = "🤣🤣🤣🤣"
+
+        assert get_cached_summary(12345, "[00:10] lol") == "🤣🤣🤣🤣"
+        assert db.session.get(EmojiSummary, 12345).source == "gemini"
+
+    @patch('app.google_ai.genai.Client')
+    def test_unchanged_local_summary_not_rewritten(self, mock_client, test_db, monkeypatch):
+        """Test a failed retry keeps the stored local summary instead of writing it again"""
+        monkeypatch.setenv("GENAI_KEY", "test_genai_key")
+        mock_client.return_value.models.generate_content.side_effect = Exception("timeout")
+        get_cached_summary(12345, "[00:10] lol")
+        generated_at = db.session.get(EmojiSummary, 12345).generated_at
+
+        assert get_cached_summary(12345, "[00:10] lol") == "😂😂😂😂"
+        assert db.session.get(EmojiSummary, 12345).generated_at == generated_at
+
+        # without a key Gemini is not even tried
+        monkeypatch.delenv("GENAI_KEY")
+        mock_client.reset_mock()
+        assert get_cached_summary(12345, "[00:10] lol") == "😂😂😂😂"
+        mock_client.assert_not_called()
+
+    def teardown_method(self):
+        summary_breaker.record_success()
+
+
+class TestEmojiTimeline:
+    """Test the incrementally maintained emoji timeline"""
+
+    def test_record_comment_sentiment(self, test_db, sample_users):
+        """Test each comment bumps its bucket's category counts"""
+        user = sample_users[0]
+        for content, ts in [("lol", 5), ("so sad", 40), ("crying rn", 45), ("lol", 50)]:
+            comment = Comment(content=content, timestamp=ts, user_id=user.id,
+                              episode_id=1, media_title="Test")
+            db.session.add(comment)
+            record_comment_sentiment(comment)
+        db.session.commit()
+
+        timeline = get_timeline(1)["timeline"]
+        assert timeline == [[0, "😂", 1], [1, "😢", 2]]
+
+    def test_rebuild_timeline_matches_incremental(self, test_db, sample_users):
+        """Test a rebuild from the comment table matches incremental updates"""
+        user = sample_users[0]
+        for i in range(30):
+            comment = Comment(content=["lol", "omg twist", "boring"][i % 3], timestamp=i * 10,
+                              user_id=user.id, episode_id=2, media_title="Test")
+            db.session.add(comment)
+            record_comment_sentiment(comment)
+        db.session.commit()
+        incremental = get_timeline(2)
+
+        rebuild_timeline(2)
+        assert get_timeline(2) == incremental
+
+
+class TestCommentCounts:
+    """Test the comment density buckets and their maintenance commands"""
+
+    def _add(self, user, timestamps, episode_id=3, track=True):
+        for ts in timestamps:
+            comment = Comment(content="hi", timestamp=ts, user_id=user.id,
+                              episode_id=episode_id, media_title="Test")
+            db.session.add(comment)
+            if track:
+                record_comment_count(comment)
+        db.session.commit()
+
+    def test_rebuild_matches_incremental(self, test_db, sample_users):
+        """Test a rebuild from the comment table matches incremental updates"""
+        self._add(sample_users[0], [i * 7.5 for i in range(40)])
+        incremental = comment_heatmap(3, 10, 300)
+
+        assert rebuild_comment_counts(3) > 0
+        assert comment_heatmap(3, 10, 300) == incremental
+        assert comment_total(3) == 40
+        assert check_comment_counts() == []
+
+    def test_check_reports_untracked_comments(self, test_db, sample_users):
+        """Test the checker finds comments the buckets never saw"""
+        self._add(sample_users[0], [1, 2])
+        self._add(sample_users[0], [3, 12], track=False)
+
+        assert check_comment_counts(3) == [(3, 0, 3, 2), (3, 2, 1, 0)]
+
+    def test_check_command_fix(self, runner, test_db, sample_users):
+        """Test check-comment-counts fails on drift and repairs it with --fix"""
+        self._add(sample_users[0], [1, 2], track=False)
+
+        result = runner.invoke(args=["check-comment-counts"])
+        assert result.exit_code == 1
+        assert "expected 2, stored 0" in result.output
+
+        result = runner.invoke(args=["check-comment-counts", "--fix"])
+        assert "Rebuilt 1 media items." in result.output
+        assert runner.invoke(args=["check-comment-counts"]).exit_code == 0
+        assert comment_total(3) == 2
+
+    def test_heatmap_even_without_stripes(self, test_db):
+        """Test evenly spread comments give an even heatmap at any slice width"""
+        db.session.add_all(CommentBucketCount(episode_id=3, bucket=b, count=5) for b in range(1440))
+        db.session.commit()
+
+        assert set(comment_heatmap(3, 200, 7200)) == {36}
+        assert comment_total(3) == 7200
+
+    def test_heatmap_cache_one_entry_per_media(self, test_db, sample_users):
+        """Test arbitrary durations reuse one cached entry per media item"""
+        self._add(sample_users[0], [1, 50, 100])
+        for i in range(50):
+            comment_heatmap(3, 10, 300 + i / 1000)
+
+        assert list(comments._heatmap_cache) == [3]
+        assert comment_heatmap(3, 3, 150) == [1, 1, 1]
+
+    def test_heatmap_cache_expires(self, test_db, sample_users):
+        """Test counts written by another worker show up once the TTL passes"""
+        self._add(sample_users[0], [1])
+        assert comment_heatmap(3, 1, 60) == [1]
+
+        # committed elsewhere, so nothing here invalidated the cache
+        self._add(sample_users[0], [2])
+        assert comment_heatmap(3, 1, 60) == [1]
+
+        with patch("app.comments.time.monotonic",
+                   return_value=time.monotonic() + comments.HEATMAP_CACHE_TTL + 1):
+            assert comment_heatmap(3, 1, 60) == [2]
+
+
+class TestLiveComments:
+    """Test the in-process comment broadcaster behind the live stream"""
+
+    def test_events_after_resumes_from_id(self):
+        """Test subscribers only get events newer than their last id"""
+        hub = CommentBroadcaster()
+        for i in (1, 2, 3):
+            hub.publish(7, i, {"id": i})
+        hub.publish(8, 4, {"id": 4})
+
+        assert [e[0] for e in hub.events_after(7, 1, timeout=0)] == [2, 3]
+        assert hub.events_after(7, 3, timeout=0) == []
+        assert hub.last_id() == 4
+
+    def test_events_after_wakes_on_publish(self):
+        """Test a waiting subscriber is woken by a new comment"""
+        import threading
+        hub = CommentBroadcaster()
+        hub.events_after(7, 0, timeout=0)
+        timer = threading.Timer(0.05, hub.publish, args=(7, 1, {"id": 1}))
+        timer.start()
+
+        assert hub.events_after(7, 0, timeout=5) == [(1, {"id": 1})]
+        timer.join()
+
+    def test_evicted_events_need_catch_up(self):
+        """Test resuming from before the ring buffer asks for a database catch-up"""
+        hub = CommentBroadcaster(buffer_size=2)
+        hub.events_after(7, 0, timeout=0)
+        for i in (1, 2, 3):
+            hub.publish(7, i, {"id": i})
+
+        assert hub.events_after(7, 0, timeout=0) is None
+        assert [e[0] for e in hub.events_after(7, 1, timeout=0)] == [2, 3]
+
+    def test_stream_catches_up_from_database(self, test_db, sample_users):
+        """Test a stream resuming past the buffer reads missed comments from the db"""
+        comment = Comment(content="missed", timestamp=5, user_id=sample_users[0].id,
+                          episode_id=4242, media_title="Test")
+        db.session.add(comment)
+        db.session.commit()
+
+        with patch.object(live_comments, "_last_id", comment.id):
+            stream = comment_stream(4242, 0, keepalive=0)
+            assert next(stream).startswith("retry:")
+            event = next(stream)
+
+        assert event.startswith(f"id: {comment.id}\nevent: comment\n")
+        assert '"content": "missed"' in event
+
+
+class TestCommentSpool:
+    """Test the write-behind comment spool"""
+
+    @pytest.fixture
+    def spool(self, app_instance, tmp_path):
+        app_instance.config.update(
+            COMMENT_SPOOL_ENABLED=True,
+            COMMENT_SPOOL_PATH=str(tmp_path / "spool.db"),
+            COMMENT_SPOOL_INTERVAL=3600,  # tests flush by hand
+        )
+        yield comment_spool
+        app_instance.config["COMMENT_SPOOL_ENABLED"] = False
+
+    def _enqueue(self, user, timestamps, episode_id=5):
+        return [
+            comment_spool.enqueue(Comment(content=f"burst {ts}", timestamp=ts,
+                                          episode_id=episode_id, media_title="Test"), user)
+            for ts in timestamps
+        ]
+
+    def test_flush_copies_spool_in_one_batch(self, spool, test_db, sample_users):
+        """Test spooled comments are visible to their author and flushed together"""
+        user = sample_users[0]
+        pending = self._enqueue(user, [30, 10, 20])
+
+        assert Comment.query.count() == 0
+        assert [c.timestamp for c in spool.pending_for(user, 5)] == [10, 20, 30]
+        assert spool.pending_for(sample_users[1], 5) == []
+        assert pending[0].id == f"pending-{pending[0].spool_id}"
+
+        assert spool.flush() == 3
+        assert Comment.query.filter_by(episode_id=5).count() == 3
+        assert db.session.get(CommentBucketCount, (5, 2)).count == 1
+        assert spool.pending_for(user, 5) == []
+        assert spool.flush() == 0
+
+    def test_flush_publishes_without_reloading(self, spool, test_db, sample_users):
+        """Test flushed comments are published from payloads built before the commit"""
+        from sqlalchemy import event
+        from app.flask_app import on_spool_flushed
+
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        def after_commit(flushed):
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                on_spool_flushed(flushed)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+
+        pending = self._enqueue(sample_users[0], [1, 2])
+        pending += self._enqueue(sample_users[1], [3])
+        with patch.object(spool, "after_commit", after_commit):
+            assert spool.flush() == 3
+
+        assert statements == []
+        events = live_comments.events_after(5, 0, timeout=0)
+        assert [payload["username"] for _, payload in events] == [
+            sample_users[0].username, sample_users[0].username, sample_users[1].username]
+        assert [payload["pending_id"] for _, payload in events] == [p.id for p in pending]
+
+    def test_flush_skips_rows_already_copied(self, spool, test_db, sample_users):
+        """Test a flush that died before clearing the spool does not copy twice"""
+        pending = self._enqueue(sample_users[0], [1, 2, 3])
+        db.session.add(SpoolCheckpoint(name="comment", last_id=pending[1].spool_id))
+        db.session.commit()
+
+        assert spool.flush() == 1
+        assert [c.content for c in Comment.query.all()] == ["burst 3"]
+
+    def test_recreated_spool_continues_after_checkpoint(self, spool, test_db, sample_users, tmp_path):
+        """Test a fresh spool file never reuses ids the checkpoint has passed"""
+        db.session.add(SpoolCheckpoint(name="comment", last_id=50))
+        db.session.commit()
+        spool.app.config["COMMENT_SPOOL_PATH"] = str(tmp_path / "fresh.db")
+
+        pending = self._enqueue(sample_users[0], [1])
+        assert pending[0].spool_id == 51
+        assert spool.flush() == 1
+
+
+class TestMediaDB:
+    """Test the pooled read-only media.db connections"""
+
+    def test_connection_reused_across_requests(self, app_instance):
+        """Test a connection goes back to the pool on teardown and is reused"""
+        with app_instance.app_context():
+            first = media_db.connection()
+            assert media_db.connection() is first
+        with app_instance.app_context():
+            assert media_db.connection() is first
+
+    def test_connection_is_read_only(self, app_instance):
+        """Test pooled connections refuse writes while the writer can cache rows"""
+        import sqlite3
+        with app_instance.app_context():
+            with pytest.raises(sqlite3.OperationalError):
+                media_db.connection().execute("DELETE FROM media")
+
+            with media_db.writer() as writer:
+                writer.execute("INSERT INTO anime (anilist_id, title_romaji) VALUES (777, 'Cached')")
+            row = media_db.connection().execute(
+                "SELECT title_romaji FROM anime WHERE anilist_id = 777").fetchone()
+            assert row["title_romaji"] == "Cached"
+
+    def test_replaced_file_gets_fresh_connection(self, app_instance, tmp_path):
+        """Test connections to a swapped out media.db are not handed out again"""
+        import shutil
+        pool = MediaDB()
+        path = str(tmp_path / "media.db")
+        shutil.copy(app_instance.config["MEDIA_DB_PATH"], path)
+
+        with patch.dict(app_instance.config, MEDIA_DB_PATH=path):
+            with app_instance.app_context():
+                old = pool.connection()
+                pool._teardown(None)
+
+            shutil.copy(app_instance.config["MEDIA_DB_PATH"], path + ".new")
+            os.replace(path + ".new", path)
+            with app_instance.app_context():
+                assert pool.connection() is not old
+                pool._teardown(None)
+
+    def test_not_found_returns_connection(self, client):
+        """Test the 404 paths hand their connection back instead of leaking it"""
+        path = client.application.config["MEDIA_DB_PATH"]
+        media_db.close_idle()
+        assert client.get('/anime/99999').status_code == 404
+        assert client.get('/aniepisode/99999').status_code == 404
+        assert len(media_db._idle[path]) == 1
+
+
+class TestMediaQueries:
+    """Test the parameterized media.db query repository"""
+
+    def test_lookups(self, app_instance):
+        """Test single row lookups return dicts and None when missing"""
+        with app_instance.app_context():
+            movie = media_queries.get_movie(12345)
+            assert movie["title"] == "Test Movie"
+            assert media_queries.get_movie(99999) is None
+            assert media_queries.featured_movies()[0]["tmdb_id"] == 12345
+
+    def test_values_are_bound_not_interpolated(self, app_instance):
+        """Test ids never end up in the SQL text"""
+        with app_instance.app_context():
+            assert media_queries.get_media("0 OR 1=1") is None
+
+        queries = [value for name, value in vars(media_queries).items()
+                   if name.isupper() and "SELECT" in str(value)]
+        assert queries
+        assert not any("SELECT *" in query for query in queries)
+
+    def _add_show(self, app_instance):
+        with media_db.writer() as writer:
+            writer.executemany(
+                "INSERT INTO seasons (season_id, tv_id, season_number, name) VALUES (?, 67890, ?, ?)",
+                [("67890-2", 2, "Season 2"), ("67890-1", 1, "Season 1"), ("67890-3", 3, "Season 3")])
+            writer.executemany(
+                "INSERT INTO episodes (episode_id, season_id, tv_id, season_number, episode_number, "
+                "episode_name) VALUES (?, ?, 67890, ?, ?, ?)",
+                [(12, "67890-1", 1, 2, "Two"), (11, "67890-1", 1, 1, "One"), (21, "67890-2", 2, 1, "Next")])
+
+    def test_show_tree_single_query(self, app_instance):
+        """Test seasons and episodes come back nested from one statement"""
+        with app_instance.app_context():
+            self._add_show(app_instance)
+            statements = []
+            media_db.connection().set_trace_callback(statements.append)
+            try:
+                tree = media_queries.get_show_tree(67890)
+            finally:
+                media_db.connection().set_trace_callback(None)
+
+        assert len(statements) == 1
+        assert [s["name"] for s in tree] == ["Season 1", "Season 2", "Season 3"]
+        assert [e["episode_name"] for e in tree[0]["episodes"]] == ["One", "Two"]
+        assert tree[1]["episodes"][0]["season_id"] == "67890-2"
+        assert tree[2]["episodes"] == []
+
+    def test_show_tree_cached_until_media_db_changes(self, app_instance):
+        """Test the tree is reused until media.db is written to"""
+        with app_instance.app_context():
+            self._add_show(app_instance)
+            tree = media_queries.get_show_tree(67890)
+            assert media_queries.get_show_tree(67890) is tree
+
+            with media_db.writer() as writer:
+                writer.execute("UPDATE seasons SET name = 'Renamed' WHERE season_id = '67890-1'")
+            assert media_queries.get_show_tree(67890)[0]["name"] == "Renamed"
+
+    def test_id_lists_share_one_statement(self, app_instance):
+        """Test IN lookups of any length bind a single JSON array"""
+        with app_instance.app_context():
+            assert media_queries.media_by_ids([]) == []
+            rows = media_queries.media_by_ids([12345, 67890, 42])
+            assert {row["tmdb_id"] for row in rows} == {12345, 67890}
+
+
+class TestCreateMediaDB:
+    """Test the streaming media.db builder"""
+
+    def _upstream(self, fail_popular=False, show_status="Ended", changed=(), not_modified=False,
+                  runtime=95, anime_episodes=True, fail_anime=False):
+        from app import anilist, tmdb
+
+        def featured(media_type, pages):
+            base = 100 if media_type == "movie" else 200
+            return iter([[{"id": base + 1, "title": "First"}], [{"id": base + 2, "name": "Second"}]])
+
+        def popular(media_type, pages):
+            if fail_popular:
+                raise RuntimeError("TMDb is down")
+            if media_type == "movie":
+                return iter([[{"id": 301, "title": "Popular Movie"}]])
+            return iter([[{"id": 401, "name": "Popular Show"}], [{"id": 402, "name": "Other Show"}]])
+
+        def show(path, etag=None, last_modified=None):
+            if not_modified and etag:
+                return None, etag, last_modified
+            seasons = [{"season_number": 1, "episode_count": 2}, {"season_number": 2, "episode_count": 2}]
+            return {"status": show_status, "seasons": seasons}, '"v1"', None
+
+        def episodes(tv_id, season_number):
+            return [{"id": tv_id * 100 + season_number * 10 + n, "episode_number": n} for n in (1, 2)]
+
+        def episode_batches(anime_data):
+            if not anime_data:
+                return iter([])
+            if fail_anime:
+                return iter([(anime_data, None)])
+            episodes = [{"anilist_id": 501, "episode_id": 501001, "episode_title": "Episode 1"}]
+            return iter([(anime_data, {501: episodes if anime_episodes else []})])
+
+        anime = {"id": 501, "title": {"romaji": "Anime", "english": None}, "episodes": 2,
+                 "averageScore": 80, "trending": 5, "genres": ["Action"], "description": None,
+                 "coverImage": {"large": None}, "startDate": {}}
+        return [
+            patch.object(tmdb, "iter_featured", side_effect=featured),
+            patch.object(tmdb, "iter_popular", side_effect=popular),
+            patch.object(tmdb, "fetch_movie_runtime", return_value=runtime),
+            patch.object(tmdb, "fetch_if_changed", side_effect=show),
+            patch.object(tmdb, "fetch_season_episodes", side_effect=episodes),
+            patch.object(tmdb, "fetch_changed_ids", return_value=set(changed)),
+            patch.object(anilist, "iter_anime", return_value=iter([[anime]])),
+            patch.object(anilist, "iter_episode_batches", side_effect=episode_batches),
+        ]
+
+    def _build(self, path, incremental=False, now=None, **kwargs):
+        from contextlib import ExitStack
+        from app.create_media_db import build_media_db
+
+        with ExitStack() as stack:
+            self.mocks = [stack.enter_context(p) for p in self._upstream(**kwargs)]
+            return build_media_db(str(path), incremental=incremental, now=now)
+
+    def _requests(self):
+        """Runtime, show and season requests made by the last build"""
+        _, _, runtimes, shows, seasons, _, _, anime_episodes = self.mocks
+        return runtimes.call_count, shows.call_count, seasons.call_count
+
+    def test_build_writes_every_table(self, app_instance, tmp_path):
+        """Test a build fills each table and is readable through media_queries"""
+        path = tmp_path / "media.db"
+        counts = self._build(path)
+
+        assert counts == {"media": 5, "seasons": 4, "episodes": 8, "anime": 1, "anime_ep": 1,
+                          "featured_movies": 2, "featured_tv": 2, "skipped": 0}
+        app_instance.config["MEDIA_DB_PATH"] = str(path)
+        with app_instance.app_context():
+            assert [m["rank"] for m in media_queries.featured_movies()] == [1, 2]
+            assert [t["title"] for t in media_queries.featured_tv()] == ["First", "Second"]
+            assert media_queries.get_movie(101)["runtime"] == 95
+            tree = media_queries.get_show_tree(402)
+            assert [e["episode_id"] for e in tree[1]["episodes"]] == [40221, 40222]
+            assert media_queries.get_anime_episodes(501)[0]["episode_title"] == "Episode 1"
+        assert list(tmp_path.iterdir()) == [path]
+
+    def test_failed_build_keeps_old_file(self, tmp_path):
+        """Test a failing import leaves the current media.db and no temp file"""
+        path = tmp_path / "media.db"
+        self._build(path)
+        before = path.read_bytes()
+
+        with pytest.raises(RuntimeError):
+            self._build(path, fail_popular=True)
+
+        assert path.read_bytes() == before
+        assert list(tmp_path.iterdir()) == [path]
+
+    def test_incremental_refresh_skips_fresh_entities(self, tmp_path):
+        """Test a refresh inside every TTL only fetches the lists themselves"""
+        path = tmp_path / "media.db"
+        self._build(path, now=1_000_000)
+        assert self._requests() == (3, 2, 4)
+
+        counts = self._build(path, incremental=True, now=1_000_000 + 3600)
+        assert self._requests() == (0, 0, 0)
+        assert counts["skipped"] == 6
+        self.mocks[-1].assert_called_once_with([])
+
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM episodes").fetchone()[0] == 8
+            assert conn.execute("SELECT runtime FROM media WHERE tmdb_id = 301").fetchone()[0] == 95
+
+    def test_incremental_refresh_follows_changes(self, tmp_path):
+        """Test a show on TMDb's change list is fetched, unchanged seasons are not"""
+        path = tmp_path / "media.db"
+        self._build(path, now=1_000_000)
+        self._build(path, incremental=True, now=1_000_000 + 3600, changed=[402])
+        assert self._requests() == (0, 1, 0)
+
+        self._build(path, incremental=True, now=1_000_000 + 7200, changed=[402],
+                    show_status="Returning Series")
+        # an airing show always gets its latest season again
+        assert self._requests() == (0, 1, 1)
+        self.mocks[4].assert_called_once_with(402, 2)
+
+    def test_incremental_refresh_expires_by_ttl(self, tmp_path):
+        """Test entities past their TTL are revalidated with their ETag"""
+        from app.create_media_db import TTL_ENDED
+
+        path = tmp_path / "media.db"
+        self._build(path, now=1_000_000)
+        counts = self._build(path, incremental=True, now=1_000_000 + TTL_ENDED, not_modified=True)
+
+        assert self._requests() == (3, 2, 0)
+        assert self.mocks[3].call_args_list[0].args[1] == '"v1"'
+        assert counts["episodes"] == 0
+
+    def test_incremental_refresh_retries_failed_runtimes(self, tmp_path):
+        """Test a failed runtime lookup is retried next run and keeps the stored runtime"""
+        from app.create_media_db import TTL_MOVIE
+
+        path = tmp_path / "media.db"
+        self._build(path, now=1_000_000, runtime=None)
+        self._build(path, incremental=True, now=1_000_000 + 3600)
+        assert self._requests() == (3, 0, 0)
+
+        self._build(path, incremental=True, now=1_000_000 + 3600 + TTL_MOVIE, runtime=None)
+        assert self._requests() == (3, 0, 0)
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("SELECT runtime FROM media WHERE tmdb_id = 301").fetchone()[0] == 95
+            expires = conn.execute(
+                "SELECT expires_at FROM fetch_meta WHERE entity = 'movie' AND entity_id = '301'"
+            ).fetchone()[0]
+        assert expires == 1_000_000 + 3600 + TTL_MOVIE
+
+    def test_incremental_refresh_keeps_empty_anime(self, tmp_path):
+        """Test an anime without episodes is cached, a failed fetch is retried"""
+        path = tmp_path / "media.db"
+        self._build(path, now=1_000_000, anime_episodes=False)
+        self._build(path, incremental=True, now=1_000_000 + 3600)
+        self.mocks[-1].assert_called_once_with([])
+
+        self._build(path, now=1_000_000, fail_anime=True)
+        self._build(path, incremental=True, now=1_000_000 + 3600)
+        assert [a["anilist_id"] for a in self.mocks[-1].call_args.args[0]] == [501]
+
+    def test_rebuild_swaps_file(self, tmp_path):
+        """Test a rebuild replaces the file, so pooled readers reopen it"""
+        from app.media_db import media_stamp
+
+        path = tmp_path / "media.db"
+        self._build(path)
+        inode = media_stamp(str(path))[0]
+        self._build(path)
+        assert media_stamp(str(path))[0] != inode
+
+
+class TestBatchSummaries:
+    """Test batched emoji summarization across many media items"""
+
+    @pytest.fixture(autouse=True)
+    def closed_breaker(self, monkeypatch):
+        monkeypatch.setenv("GENAI_KEY", "test_genai_key")
+        summary_breaker.record_success()
+        yield
+        summary_breaker.record_success()
+
+    def _answer_all(self, call_log):
+        # Stub response that answers every id listed in the prompt
+        def generate_content(model, config, contents):
+            ids = [line.strip()[4:] for line in contents.splitlines() if line.strip().startswith("### ")]
+            call_log.append(ids)
+            response = MagicMock()
+            response.text = json.dumps({media_id: "😊😊😊😊" for media_id in ids})
+            return response
+        return generate_content
+
+    def test_pack_batches_respects_budget(self):
+        """Test blocks are packed into batches under the token budget"""
+        blocks = {i: "x" * 400 for i in range(10)}  # ~101 tokens each
+        batches = pack_batches(blocks, token_budget=250)
+
+        assert [len(batch) for batch in batches] == [2, 2, 2, 2, 2]
+        assert sum(len(batch) for batch in batches) == 10
+
+    def test_pack_batches_oversized_block(self):
+        """Test a block larger than the budget gets its own batch"""
+        batches = pack_batches({1: "x" * 4000, 2: "short"}, token_budget=100)
+        assert batches == [{1: "x" * 4000}, {2: "short"}]
+
+    @patch('app.google_ai.genai.Client')
+    def test_batch_single_call(self, mock_client):
+        """Test many media items are summarized in one model call"""
+        calls = []
+        mock_client.return_value.models.generate_content.side_effect = self._answer_all(calls)
+
+        blocks = {i: f"[00:0{i}] comment {i}" for i in range(1, 6)}
+        summaries = summarize_comments_batch(blocks)
+
+        assert len(calls) == 1
+        assert summaries == {i: "😊😊😊😊" for i in range(1, 6)}
+
+    @patch('app.google_ai.genai.Client')
+    def test_batch_failure_is_split(self, mock_client):
+        """Test a failed batch is split in half and retried"""
+        calls = []
+        answer = self._answer_all(calls)
+
+        def flaky(model, config, contents):
+            listed = [line for line in contents.splitlines() if line.strip().startswith("### ")]
+            if len(listed) > 2:
+                calls.append("failed")
+                raise RuntimeError("request too large")
+            return answer(model, config, contents)
+
+        mock_client.return_value.models.generate_content.side_effect = flaky
+
+        blocks = {i: f"comment {i}" for i in range(1, 5)}
+        summaries = summarize_comments_batch(blocks)
+
+        assert summaries == {i: "😊😊😊😊" for i in range(1, 5)}
+        assert calls == ["failed", ["1", "2"], ["3", "4"]]
+
+    @patch('app.google_ai.genai.Client')
+    def test_batch_retries_missing_ids(self, mock_client):
+        """Test ids missing from a response are retried on their own"""
+        responses = [
+            MagicMock(text=json.dumps({"1": "😀😀😀😀"})),
+            MagicMock(text=json.dumps({"2": "😢😢😢😢"})),
+        ]
+        mock_client.return_value.models.generate_content.side_effect = responses
+
+        summaries = summarize_comments_batch({1: "good", 2: "sad"})
+
+        assert summaries == {1: "😀😀😀😀", 2: "😢😢😢😢"}
+        assert mock_client.return_value.models.generate_content.call_count == 2
+
+    @patch('app.google_ai.genai.Client')
+    def test_batch_gives_up_on_single_item(self, mock_client):
+        """Test a single item that keeps failing is skipped"""
+        mock_client.return_value.models.generate_content.side_effect = RuntimeError("boom")
+        assert summarize_comments_batch({1: "comment"}) == {}
+
+    @patch('app.google_ai.genai.Client')
+    def test_refresh_stale_summaries(self, mock_client, test_db, sample_comments):
+        """Test missing summaries are backfilled from the app database"""
+        calls = []
+        mock_client.return_value.models.generate_content.side_effect = self._answer_all(calls)
+
+        assert refresh_stale_summaries() == 1
+        summary = db.session.get(EmojiSummary, 12345)
+        assert summary.emoji == "😊😊😊😊"
+        assert summary.is_stale is False
+
+        # Nothing left to do on a second run
+        assert refresh_stale_summaries() == 0
+        assert len(calls) == 1
+
+    @patch('app.google_ai.genai.Client')
+    def test_refresh_limit_reaches_missing_summaries(self, mock_client, test_db, sample_users,
+                                                     monkeypatch):
+        """Test --limit picks media without a summary before local ones"""
+        for episode_id in (1, 2, 3):
+            db.session.add(Comment(content="lol", timestamp=1, user_id=sample_users[0].id,
+                                   episode_id=episode_id, media_title="Test"))
+        for episode_id in (1, 2):
+            db.session.add(EmojiSummary(episode_id=episode_id, comment_hash="old",
+                                        emoji="😂😂😂😂", source="local", is_stale=False))
+        db.session.commit()
+        calls = []
+        mock_client.return_value.models.generate_content.side_effect = self._answer_all(calls)
+
+        assert refresh_stale_summaries(limit=1) == 1
+        assert calls == [["3"]]
+
+        # without Gemini the local rows are not picked at all
+        monkeypatch.delenv("GENAI_KEY")
+        Comment.query.filter_by(episode_id=3).delete()
+        db.session.add(Comment(content="lol", timestamp=1, user_id=sample_users[0].id,
+                               episode_id=4, media_title="Test"))
+        db.session.commit()
+        assert refresh_stale_summaries(limit=1) == 1
+        assert db.session.get(EmojiSummary, 4).source == "local"
+
+    @patch('app.google_ai.genai.Client')
+    def test_batch_failures_open_breaker(self, mock_client):
+        """Test failed batch calls count against the breaker and stop once it opens"""
+        mock_client.return_value.models.generate_content.side_effect = RuntimeError("503")
+
+        blocks = {i: f"comment {i}" for i in range(1, 9)}
+        assert summarize_comments_batch(blocks) == {}
+
+        calls = mock_client.return_value.models.generate_content.call_count
+        assert calls == summary_breaker.failure_threshold
+        assert summary_breaker.is_open()
+
+    @patch('app.google_ai.genai.Client')
+    def test_refresh_falls_back_to_local(self, mock_client, test_db, sample_comments):
+        """Test ids Gemini could not summarize get a local summary"""
+        for _ in range(summary_breaker.failure_threshold):
+            summary_breaker.record_failure()
+
+        assert refresh_stale_summaries() == 1
+        mock_client.return_value.models.generate_content.assert_not_called()
+        summary = db.session.get(EmojiSummary, 12345)
+        assert summary.source == "local"
+        assert summary.is_stale is False
+
+        # the same comments are not summarized or written again while Gemini is out
+        assert refresh_stale_summaries() == 0
+
+
+class TestSummaryWorker:
+    """Test background emoji summary recomputation"""
+
+    def _add_comments(self, user, count, episode_id=12345):
+        for i in range(count):
+            db.session.add(Comment(
+                content=f"Comment {i}",
+                timestamp=i,
+                user_id=user.id,
+                episode_id=episode_id,
+                media_title="Test Movie"
+            ))
+        db.session.commit()
+
+    def test_burst_collapses_to_single_recompute(self, app_instance, sample_users, mock_genai):
+        """Test a burst of comments on one episode triggers a single recompute"""
+        app_instance.config["SUMMARY_WORKER_ENABLED"] = True
+        worker = SummaryWorker(app_instance)
+        self._add_comments(sample_users[0], 50)
+
+        scheduled = [worker.schedule(12345) for _ in range(50)]
+        assert scheduled.count(True) == 1
+        assert worker.pending() == {12345}
+
+        worker.flush()
+
+        assert worker.pending() == set()
+        assert mock_genai.models.generate_content.call_count == 1
+        summary = db.session.get(EmojiSummary, 12345)
+        assert summary.emoji == "😊😍🎉👏"
+        assert summary.is_stale is False
+
+    def test_schedule_disabled(self, app_instance):
+        """Test nothing is queued when the worker is disabled"""
+        worker = SummaryWorker(app_instance)
+        assert worker.schedule(12345) is False
+        assert worker.pending() == set()
+
+    def test_summary_for_page_placeholder(self, app_instance, sample_users, mock_genai):
+        """Test pages get a placeholder until the first summary exists"""
+        app_instance.config["SUMMARY_WORKER_ENABLED"] = True
+        worker = SummaryWorker(app_instance)
+        self._add_comments(sample_users[0], 2)
+
+        assert worker.summary_for_page(12345, has_comments=True) == SUMMARY_PLACEHOLDER
+        mock_genai.models.generate_content.assert_not_called()
+
+        worker.flush()
+        assert worker.summary_for_page(12345, has_comments=True) == "😊😍🎉👏"
+        assert worker.summary_for_page(12345, has_comments=False) == ""
+
+    def test_stale_summary_served_until_refresh(self, app_instance, sample_users, mock_genai):
+        """Test a stale summary is still served while a refresh is queued"""
+        app_instance.config["SUMMARY_WORKER_ENABLED"] = True
+        worker = SummaryWorker(app_instance)
+        db.session.add(EmojiSummary(episode_id=12345, comment_hash="old", emoji="🙂🙂🙂🙂", is_stale=True))
+        self._add_comments(sample_users[0], 1)
+
+        assert worker.summary_for_page(12345, has_comments=True) == "🙂🙂🙂🙂"
+        assert worker.pending() == {12345}
+
+    def test_local_summary_waits_for_gemini(self, app_instance, sample_users, monkeypatch):
+        """Test a local summary is only requeued when Gemini could replace it"""
+        app_instance.config["SUMMARY_WORKER_ENABLED"] = True
+        worker = SummaryWorker(app_instance)
+        db.session.add(EmojiSummary(episode_id=12345, comment_hash="h", emoji="😂😂😂😂",
+                                    source="local", is_stale=False))
+        self._add_comments(sample_users[0], 1)
+
+        monkeypatch.delenv("GENAI_KEY", raising=False)
+        assert worker.summary_for_page(12345, has_comments=True) == "😂😂😂😂"
+        assert worker.pending() == set()
+
+        monkeypatch.setenv("GENAI_KEY", "test_genai_key")
+        try:
+            for _ in range(summary_breaker.failure_threshold):
+                summary_breaker.record_failure()
+            worker.summary_for_page(12345, has_comments=True)
+            assert worker.pending() == set()
+        finally:
+            summary_breaker.record_success()
+
+        worker.summary_for_page(12345, has_comments=True)
+        assert worker.pending() == {12345}
+        worker._pending.pop(12345).cancel()
+
 
 class TestHistoryUtilities:
     """Test history-related utility functions"""